@@ -426,6 +426,10 @@ def choose_acceptance(request, bid_id):
         bid.accepted_at = timezone.now()
         bid.save()
         
+        # Remind both sides ahead of the event
+        from notifications.scheduler import schedule_event_reminders
+        schedule_event_reminders('bid', bid, [bid.user, bid.accepted_by])
+        
         # Send notifications (with email) to selected and rejected users
         try:
             from notifications.utils import send_notification
@@ -730,6 +734,10 @@ def complete_bid(request, bid_id):
     bid.status = 'COMPLETED'
     bid.save()
     
+    # The event is over; don't remind anyone about it
+    from notifications.scheduler import cancel_event_reminders
+    cancel_event_reminders('bid', bid.id)
+    
     # Process payment
     from payments.models import Transaction
     Transaction.objects.create(
@@ -11,6 +11,7 @@ echo "🧾 Backing up SQLite database before migrate..."
 python manage.py backup_db --keep 7 || true
 
 python manage.py migrate --noinput
+python manage.py createcachetable
 
 # Ensure media directory exists on mounted disk
 if [ -n "${MEDIA_ROOT}" ]; then
@@ -38,6 +39,9 @@ fi
 echo "📁 Collecting static files..."
 python manage.py collectstatic --noinput
 
+# Start the background workers (notification deliveries, payment webhooks, scheduler)
+bash workers.sh
+
 # Start server
 echo "🌐 Starting Gunicorn server..."
 gunicorn mjolobid.wsgi:application --bind 0.0.0.0:$PORT
@@ -0,0 +1,9 @@
+from django.contrib import admin
+from .models import MaintenanceCheckpoint
+
+
+@admin.register(MaintenanceCheckpoint)
+class MaintenanceCheckpointAdmin(admin.ModelAdmin):
+    list_display = ['id', 'name', 'last_id', 'processed', 'completed_at', 'updated_at']
+    search_fields = ['name']
+    readonly_fields = ['created_at', 'updated_at']
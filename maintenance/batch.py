@@ -0,0 +1,110 @@
+"""
+Shared framework for resumable, batched maintenance commands.
+
+A ``BatchCommand`` walks its queryset in primary-key order, one batch at a
+time. Each batch is processed and its checkpoint saved in one transaction, so
+the write lock is only held for a batch and an interrupted run picks up after
+the last committed batch. With ``--dry-run`` every batch is rolled back and
+only the stats are reported.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from .models import MaintenanceCheckpoint
+
+
+class BatchCommand(BaseCommand):
+    """Base class for maintenance commands that process rows in committed batches"""
+
+    checkpoint_name = None
+    default_batch_size = 500
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=self.default_batch_size,
+            help=f'Rows per batch/transaction (default: {self.default_batch_size}).',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Roll back every batch and only report what would change.',
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Ignore the saved checkpoint and start from the beginning.',
+        )
+
+    def get_queryset(self):
+        """Rows to process - the framework adds the pk ordering and paging"""
+        raise NotImplementedError
+
+    def process_batch(self, rows, stats):
+        """Process one batch of rows inside its transaction, updating ``stats``"""
+        raise NotImplementedError
+
+    def get_checkpoint(self, restart, dry_run=False):
+        """The saved checkpoint, reset on --restart or after a completed run; dry runs get an unsaved copy"""
+        if dry_run:
+            checkpoint = (MaintenanceCheckpoint.objects.filter(name=self.checkpoint_name).first()
+                          or MaintenanceCheckpoint(name=self.checkpoint_name))
+        else:
+            checkpoint, _ = MaintenanceCheckpoint.objects.get_or_create(name=self.checkpoint_name)
+        if restart or checkpoint.completed_at:
+            checkpoint.last_id = 0
+            checkpoint.processed = 0
+            checkpoint.stats = {}
+            checkpoint.completed_at = None
+            if not dry_run:
+                checkpoint.save()
+        return checkpoint
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+        checkpoint = self.get_checkpoint(options['restart'], dry_run)
+
+        prefix = '[dry run] ' if dry_run else ''
+        queryset = self.get_queryset().order_by('pk')
+        remaining = queryset.filter(pk__gt=checkpoint.last_id).count()
+        if checkpoint.last_id:
+            self.stdout.write(f'{prefix}Resuming {self.checkpoint_name} after id {checkpoint.last_id} ({checkpoint.processed} rows already done)')
+        self.stdout.write(f'{prefix}{remaining} rows to process in batches of {batch_size}')
+
+        last_id = checkpoint.last_id
+        processed = 0
+        stats = {} if dry_run else dict(checkpoint.stats)
+        started = time.monotonic()
+
+        while True:
+            # Keyset paging - each batch is a short indexed read, no cursor stays open
+            rows = list(queryset.filter(pk__gt=last_id)[:batch_size])
+            if not rows:
+                break
+
+            with transaction.atomic():
+                self.process_batch(rows, stats)
+                if dry_run:
+                    transaction.set_rollback(True)
+                else:
+                    checkpoint.last_id = rows[-1].pk
+                    checkpoint.processed += len(rows)
+                    checkpoint.stats = stats
+                    checkpoint.save(update_fields=['last_id', 'processed', 'stats', 'updated_at'])
+
+            last_id = rows[-1].pk
+            processed += len(rows)
+            rate = processed / max(time.monotonic() - started, 0.001)
+            self.stdout.write(f'  {processed}/{remaining} rows (last id {last_id}, {rate:.0f} rows/s)')
+
+        if not dry_run:
+            checkpoint.completed_at = timezone.now()
+            checkpoint.save(update_fields=['completed_at', 'updated_at'])
+
+        summary = ', '.join(f'{key.replace("_", " ")}: {value}' for key, value in sorted(stats.items())) or 'nothing to do'
+        self.stdout.write(self.style.SUCCESS(f'{prefix}{self.checkpoint_name} finished - {summary}'))
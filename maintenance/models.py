@@ -0,0 +1,17 @@
+from django.db import models
+
+
+class MaintenanceCheckpoint(models.Model):
+    """Progress of a resumable batched maintenance command"""
+    
+    name = models.CharField(max_length=100, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    processed = models.BigIntegerField(default=0)
+    stats = models.JSONField(default=dict, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        state = 'done' if self.completed_at else f'at id {self.last_id}'
+        return f"{self.name} ({state})"
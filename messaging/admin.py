@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Conversation, Message, MessageAttachment, TypingIndicator
+from .models import AttachmentBlob, Conversation, ConversationArchive, ConversationReadState, Message, MessageAttachment, PresenceConnection, TypingIndicator
 
 
 @admin.register(Conversation)
@@ -7,7 +7,8 @@ class ConversationAdmin(admin.ModelAdmin):
     list_display = ['id', 'bid', 'created_at', 'updated_at', 'is_active']
     list_filter = ['is_active', 'created_at']
     search_fields = ['bid__title', 'participants__username']
-    readonly_fields = ['created_at', 'updated_at']
+    # last_seq is advanced by message inserts; saving a stale form must not move it back
+    readonly_fields = ['last_seq', 'created_at', 'updated_at']
     
     def get_participants(self, obj):
         return ", ".join([p.username for p in obj.participants.all()])
@@ -31,6 +32,36 @@ class MessageAttachmentAdmin(admin.ModelAdmin):
     list_display = ['id', 'message', 'filename', 'file_size', 'content_type', 'created_at']
     list_filter = ['content_type', 'created_at']
     search_fields = ['filename', 'message__content']
+    raw_id_fields = ['message', 'blob']
+
+
+@admin.register(AttachmentBlob)
+class AttachmentBlobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'sha256', 'file_size', 'content_type', 'created_at']
+    list_filter = ['content_type', 'created_at']
+    search_fields = ['sha256']
+    readonly_fields = ['sha256', 'file_size', 'content_type', 'created_at']
+
+
+@admin.register(ConversationArchive)
+class ConversationArchiveAdmin(admin.ModelAdmin):
+    list_display = ['id', 'conversation', 'message_count', 'file_size', 'updated_at']
+    search_fields = ['path']
+    raw_id_fields = ['conversation']
+    readonly_fields = ['path', 'first_message_id', 'last_message_id', 'message_count', 'file_size', 'created_at', 'updated_at']
+
+
+@admin.register(ConversationReadState)
+class ConversationReadStateAdmin(admin.ModelAdmin):
+    list_display = ['id', 'conversation', 'user', 'last_read_message_id', 'updated_at']
+    search_fields = ['user__username']
+    raw_id_fields = ['conversation', 'user']
+
+
+@admin.register(PresenceConnection)
+class PresenceConnectionAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'channel_name', 'last_seen']
+    search_fields = ['user__username', 'channel_name']
 
 
 @admin.register(TypingIndicator)
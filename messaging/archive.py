@@ -0,0 +1,297 @@
+"""
+Cold storage for the messages of idle conversations.
+
+Each archived conversation is packed into one file under
+``MESSAGE_ARCHIVE_ROOT``:
+
+    MAGIC
+    block*    length-prefixed zlib frames of up to BLOCK_SIZE messages
+    index     one (first_id, last_id, count, offset, length) entry per block
+    footer    index offset, block count, MAGIC
+
+Readers memory-map the file and binary-search the index, so fetching a page
+of history only decompresses the blocks that cover it. Archived messages are
+no longer in the search index (see messaging/search.py). The file is removed
+when its conversation is deleted.
+"""
+import bisect
+import json
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from .models import ConversationArchive, Message
+
+MAGIC = b'MJARCH01'
+BLOCK_SIZE = 128
+
+_LENGTH = struct.Struct('>I')
+_INDEX_ENTRY = struct.Struct('>QQIQI')
+_FOOTER = struct.Struct('>QI8s')
+
+
+def archive_root():
+    """Directory holding the archive files"""
+    root = getattr(settings, 'MESSAGE_ARCHIVE_ROOT', None) or os.path.join(settings.BASE_DIR, 'message_archive')
+    return Path(root)
+
+
+def _encode_message(message):
+    return {
+        'id': message.id,
+        'seq': message.seq,
+        'sender_id': message.sender_id,
+        'content': message.content,
+        'is_read': message.is_read,
+        'read_at': message.read_at.isoformat() if message.read_at else None,
+        'created_at': message.created_at.isoformat(),
+    }
+
+
+def _encode_block(records):
+    payload = b''.join(
+        _LENGTH.pack(len(data)) + data
+        for data in (json.dumps(record, separators=(',', ':')).encode('utf-8') for record in records)
+    )
+    return zlib.compress(payload, 6)
+
+
+def _decode_block(frame):
+    payload = zlib.decompress(frame)
+    records = []
+    offset = 0
+    while offset < len(payload):
+        (length,) = _LENGTH.unpack_from(payload, offset)
+        offset += _LENGTH.size
+        records.append(json.loads(payload[offset:offset + length]))
+        offset += length
+    return records
+
+
+class ArchiveReader:
+    """Memory-mapped, read-only view of one archive file"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        index_offset, block_count, magic = _FOOTER.unpack_from(self._mmap, len(self._mmap) - _FOOTER.size)
+        if magic != MAGIC or self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not a message archive')
+
+        self.blocks = [
+            _INDEX_ENTRY.unpack_from(self._mmap, index_offset + i * _INDEX_ENTRY.size)
+            for i in range(block_count)
+        ]
+        self._first_ids = [block[0] for block in self.blocks]
+
+    def raw_blocks(self):
+        """Yield (index entry, compressed frame) pairs - used when extending an archive"""
+        for entry in self.blocks:
+            offset, length = entry[3], entry[4]
+            yield entry, self._mmap[offset:offset + length]
+
+    def _read_block(self, position):
+        offset, length = self.blocks[position][3], self.blocks[position][4]
+        return _decode_block(self._mmap[offset:offset + length])
+
+    def read_after(self, after, limit):
+        """Records with id > after, oldest first"""
+        position = max(bisect.bisect_right(self._first_ids, after) - 1, 0)
+        records = []
+        while position < len(self.blocks) and len(records) < limit:
+            records.extend(r for r in self._read_block(position) if r['id'] > after)
+            position += 1
+        return records[:limit]
+
+    def read_after_seq(self, seq, limit):
+        """Records with seq > seq, oldest first"""
+        # Seqs grow with ids inside an archive, so blocks are ordered by seq too
+        low, high = 0, len(self.blocks)
+        while low < high:
+            middle = (low + high) // 2
+            if self._read_block(middle)[-1]['seq'] > seq:
+                high = middle
+            else:
+                low = middle + 1
+        records = []
+        position = low
+        while position < len(self.blocks) and len(records) < limit:
+            records.extend(r for r in self._read_block(position) if r['seq'] > seq)
+            position += 1
+        return records[:limit]
+
+    def read_before(self, before, limit):
+        """The ``limit`` records with id < before, oldest first"""
+        position = bisect.bisect_left(self._first_ids, before) - 1
+        records = []
+        while position >= 0 and len(records) < limit:
+            records = [r for r in self._read_block(position) if r['id'] < before] + records
+            position -= 1
+        return records[-limit:] if limit else []
+
+
+@lru_cache(maxsize=64)
+def _open_reader(path, mtime_ns, size):
+    return ArchiveReader(path)
+
+
+def get_reader(archive):
+    """Get a (cached) reader for a ConversationArchive"""
+    path = str(archive_root() / archive.path)
+    stat = os.stat(path)
+    return _open_reader(path, stat.st_mtime_ns, stat.st_size)
+
+
+def _to_messages(conversation, records):
+    """Turn archived records into unsaved Message instances"""
+    User = get_user_model()
+    users = User.objects.in_bulk({record['sender_id'] for record in records})
+    messages = []
+    for record in records:
+        message = Message(
+            id=record['id'],
+            seq=record.get('seq'),
+            conversation=conversation,
+            sender_id=record['sender_id'],
+            content=record['content'],
+            is_read=record['is_read'],
+            read_at=datetime.fromisoformat(record['read_at']) if record['read_at'] else None,
+            created_at=datetime.fromisoformat(record['created_at']),
+        )
+        if record['sender_id'] in users:
+            message.sender = users[record['sender_id']]
+        messages.append(message)
+    return messages
+
+
+def read_archived_after(conversation, archive, after, limit):
+    """Archived messages with id > after, oldest first"""
+    records = get_reader(archive).read_after(after, limit)
+    return _to_messages(conversation, [r for r in records if r['id'] <= archive.last_message_id])
+
+
+def read_archived_after_seq(conversation, archive, seq, limit):
+    """Archived messages with seq > seq, oldest first"""
+    records = get_reader(archive).read_after_seq(seq, limit)
+    return _to_messages(conversation, [r for r in records if r['id'] <= archive.last_message_id])
+
+
+def read_archived_before(conversation, archive, before, limit):
+    """The ``limit`` archived messages with id < before, oldest first"""
+    before = min(before, archive.last_message_id + 1)
+    return _to_messages(conversation, get_reader(archive).read_before(before, limit))
+
+
+def _write_blocks(path, blocks):
+    """Write ``(first_id, last_id, count, frame)`` blocks plus index and footer to ``path`` atomically"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+    index = []
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(MAGIC)
+            for first_id, last_id, count, frame in blocks:
+                index.append((first_id, last_id, count, f.tell(), len(frame)))
+                f.write(frame)
+
+            index_offset = f.tell()
+            for entry in index:
+                f.write(_INDEX_ENTRY.pack(*entry))
+            f.write(_FOOTER.pack(index_offset, len(index), MAGIC))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def _write_archive(path, old_reader, upto, messages):
+    """Write old blocks up to ``upto`` (copied as-is) plus new messages to ``path`` atomically"""
+    blocks = []  # index entries written so far, for the returned totals
+
+    def frames():
+        if old_reader is not None:
+            for entry, frame in old_reader.raw_blocks():
+                if entry[1] > upto:
+                    # Left over from an interrupted run - those rows are still hot
+                    break
+                blocks.append(entry[:3])
+                yield entry[0], entry[1], entry[2], bytes(frame)
+
+        block = []
+        for message in messages:
+            block.append(_encode_message(message))
+            if len(block) == BLOCK_SIZE:
+                blocks.append((block[0]['id'], block[-1]['id'], len(block)))
+                yield blocks[-1] + (_encode_block(block),)
+                block = []
+        if block:
+            blocks.append((block[0]['id'], block[-1]['id'], len(block)))
+            yield blocks[-1] + (_encode_block(block),)
+
+    _write_blocks(path, frames())
+    if not blocks:
+        return None, None, 0
+    return blocks[0][0], blocks[-1][1], sum(count for _, _, count in blocks)
+
+
+def archive_conversation(conversation, dry_run=False):
+    """
+    Move a conversation's hot messages into its archive file.
+
+    Messages that have attachments, and conversations with unread messages,
+    are left in the hot table. Returns the number of messages archived.
+    """
+    messages = conversation.messages.filter(attachments__isnull=True).order_by('id')
+    archive = ConversationArchive.objects.filter(conversation=conversation).first()
+    if archive is not None:
+        # Blocks must stay in id order - only append messages newer than the archive
+        messages = messages.filter(id__gt=archive.last_message_id)
+
+    message_count = messages.count()
+    if dry_run or not message_count:
+        return message_count
+
+    relative_path = Path(f'{conversation.id % 256:02x}') / f'conversation-{conversation.id}.mjar'
+    path = archive_root() / relative_path
+    old_reader = get_reader(archive) if archive is not None else None
+
+    # Only the ids are kept in memory; the rows are streamed into the file
+    message_ids = []
+
+    def stream():
+        for message in messages.iterator(chunk_size=1000):
+            message_ids.append(message.id)
+            yield message
+
+    upto = archive.last_message_id if archive is not None else 0
+    first_id, last_id, count = _write_archive(path, old_reader, upto, stream())
+
+    with transaction.atomic():
+        ConversationArchive.objects.update_or_create(
+            conversation=conversation,
+            defaults={
+                'path': str(relative_path),
+                'first_message_id': first_id,
+                'last_message_id': last_id,
+                'message_count': count,
+                'file_size': path.stat().st_size,
+            }
+        )
+        for start in range(0, len(message_ids), 500):
+            Message.objects.filter(id__in=message_ids[start:start + 500]).delete()
+
+    return len(message_ids)
@@ -0,0 +1,221 @@
+"""
+Streaming, content-addressed storage for message attachments.
+
+Uploads are read from the request in fixed-size chunks, written to a temporary
+file and hashed on the way, so memory use stays flat regardless of file size.
+Blobs are stored once per SHA-256 and shared by every attachment with the
+same content; ``manage.py prune_attachment_blobs`` deletes the ones no
+attachment refers to any more.
+"""
+import codecs
+import hashlib
+import os
+import re
+import tempfile
+import zipfile
+
+from django.conf import settings
+from django.core.files import File
+from django.db import IntegrityError, transaction
+from django.http import FileResponse, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+
+from .models import AttachmentBlob
+
+CHUNK_SIZE = 64 * 1024
+DEFAULT_MAX_SIZE = 10 * 1024 * 1024
+
+ALLOWED_CONTENT_TYPES = [
+    'image/jpeg', 'image/png', 'image/gif', 'image/webp',
+    'application/pdf',
+    'application/msword',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'text/plain'
+]
+
+DOCX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+# Magic numbers for the types we can recognise from the first bytes
+_SIGNATURES = [
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'%PDF-', 'application/pdf'),
+    (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'application/msword'),
+    (b'PK\x03\x04', 'application/zip'),
+]
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class AttachmentError(Exception):
+    """Raised when an upload is rejected"""
+
+
+def _is_docx(file_obj):
+    """A ZIP is only a Word document if it has the main document part"""
+    try:
+        with zipfile.ZipFile(file_obj) as archive:
+            return 'word/document.xml' in archive.namelist()
+    except zipfile.BadZipFile:
+        return False
+
+
+def _is_text(file_obj):
+    """Valid UTF-8 without NUL bytes"""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        while True:
+            chunk = file_obj.read(CHUNK_SIZE)
+            if not chunk:
+                decoder.decode(b'', final=True)
+                return True
+            if b'\x00' in chunk:
+                return False
+            decoder.decode(chunk)
+    except UnicodeDecodeError:
+        return False
+
+
+def sniff_content_type(file_obj, declared=''):
+    """Detect the content type of a seekable file from its content"""
+    file_obj.seek(0)
+    head = file_obj.read(16)
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    for signature, content_type in _SIGNATURES:
+        if head.startswith(signature):
+            if content_type == 'application/zip':
+                file_obj.seek(0)
+                return DOCX_CONTENT_TYPE if _is_docx(file_obj) else content_type
+            return content_type
+    declared = (declared or '').split(';')[0].strip().lower()
+    if declared == 'text/plain':
+        file_obj.seek(0)
+        if _is_text(file_obj):
+            return declared
+    return 'application/octet-stream'
+
+
+def store_stream(stream, declared_content_type='', max_size=None):
+    """
+    Store an upload stream as a content-addressed blob.
+
+    Returns ``(blob, created)``; ``created`` is False when an identical file
+    was already stored and the upload was deduplicated.
+    """
+    max_size = max_size or getattr(settings, 'MESSAGE_ATTACHMENT_MAX_SIZE', DEFAULT_MAX_SIZE)
+    digest = hashlib.sha256()
+    size = 0
+
+    upload_dir = getattr(settings, 'FILE_UPLOAD_TEMP_DIR', None)
+    with tempfile.NamedTemporaryFile(dir=upload_dir) as tmp:
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_size:
+                raise AttachmentError(f'File size cannot exceed {max_size // (1024 * 1024)}MB')
+            digest.update(chunk)
+            tmp.write(chunk)
+
+        if not size:
+            raise AttachmentError('Empty upload')
+
+        tmp.flush()
+        content_type = sniff_content_type(tmp, declared_content_type)
+        if content_type not in ALLOWED_CONTENT_TYPES:
+            raise AttachmentError('File type not allowed')
+
+        sha256 = digest.hexdigest()
+        try:
+            return AttachmentBlob.objects.get(sha256=sha256), False
+        except AttachmentBlob.DoesNotExist:
+            pass
+
+        tmp.seek(0)
+        blob = AttachmentBlob(sha256=sha256, file_size=size, content_type=content_type)
+        # Saving from the temp file copies it chunk by chunk
+        blob.file.save(f'{sha256[:2]}/{sha256}', File(tmp), save=False)
+        try:
+            with transaction.atomic():
+                blob.save()
+            return blob, True
+        except IntegrityError:
+            # Same content stored concurrently - keep the first blob
+            blob.file.delete(save=False)
+            return AttachmentBlob.objects.get(sha256=sha256), False
+
+
+def _file_iterator(file_obj, start, length):
+    file_obj.seek(start)
+    remaining = length
+    try:
+        while remaining > 0:
+            chunk = file_obj.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        file_obj.close()
+
+
+def serve_attachment(request, attachment):
+    """
+    Serve an attachment with Range support.
+
+    When ``MESSAGE_ATTACHMENT_SENDFILE_HEADER`` is set (``X-Sendfile`` or
+    ``X-Accel-Redirect``) the front-end server sends the file instead.
+    """
+    field = attachment.blob.file if attachment.blob_id else attachment.file
+    size = attachment.blob.file_size if attachment.blob_id else attachment.file_size
+    content_type = attachment.content_type or 'application/octet-stream'
+    disposition = f'attachment; filename="{attachment.filename.replace(chr(34), "")}"'
+
+    try:
+        path = field.path
+    except NotImplementedError:
+        # Remote storage - let the storage backend serve it
+        return HttpResponseRedirect(field.url)
+
+    sendfile_header = getattr(settings, 'MESSAGE_ATTACHMENT_SENDFILE_HEADER', '')
+    if sendfile_header:
+        response = HttpResponse(content_type=content_type)
+        if sendfile_header.lower() == 'x-accel-redirect':
+            response[sendfile_header] = field.url
+        else:
+            response[sendfile_header] = path
+        response['Content-Disposition'] = disposition
+        return response
+
+    match = _RANGE_RE.match(request.META.get('HTTP_RANGE', '').strip())
+    if match and (match.group(1) or match.group(2)):
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        else:
+            start = max(size - int(last), 0)
+            end = size - 1
+        if start > end or start >= size:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+        length = end - start + 1
+        response = StreamingHttpResponse(
+            _file_iterator(open(path, 'rb'), start, length),
+            status=206,
+            content_type=content_type
+        )
+        response['Content-Length'] = str(length)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    else:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+        response['Content-Length'] = str(os.path.getsize(path))
+
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = disposition
+    return response
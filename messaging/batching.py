@@ -0,0 +1,124 @@
+"""
+Group-commit batching for chat message inserts.
+
+Every ``ChatConsumer`` in a process submits its messages to one asyncio queue.
+A single writer task drains the queue every few milliseconds and stores the
+whole batch with one ``bulk_create`` inside one transaction, so SQLite pays
+one fsync'd commit per batch instead of two per message. Each submitter gets
+back its saved ``Message`` (with its id) before broadcasting.
+"""
+import asyncio
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Conversation, Message
+
+
+class MessageWriteBatcher:
+    """Per-process writer that commits queued chat messages in batches"""
+
+    def __init__(self, flush_interval=0.005, max_batch_size=200):
+        self.flush_interval = flush_interval
+        self.max_batch_size = max_batch_size
+        self._queue = None
+        self._loop = None
+        self._task = None
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task is None or self._task.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._task = loop.create_task(self._run())
+
+    async def submit(self, conversation_id, sender, content):
+        """
+        Queue a message for the next batch and wait until it is committed.
+
+        Returns the saved Message, or None if the sender can't post in the
+        conversation.
+        """
+        conversation_id = int(conversation_id)
+        self._ensure_started()
+        future = self._loop.create_future()
+        await self._queue.put((conversation_id, sender, content, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            deadline = self._loop.time() + self.flush_interval
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - self._loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                results = await database_sync_to_async(self._write_batch)(
+                    [(conversation_id, sender, content) for conversation_id, sender, content, _ in batch]
+                )
+            except Exception as exc:
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+
+            for (*_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    @staticmethod
+    def _write_batch(items):
+        """Validate and insert a batch of messages in one transaction"""
+        conversation_ids = {conversation_id for conversation_id, _, _ in items}
+        sender_ids = {sender.id for _, sender, _ in items}
+
+        # One query checks access for the whole batch
+        allowed = set(
+            Conversation.participants.through.objects.filter(
+                conversation_id__in=conversation_ids,
+                conversation__is_active=True,
+                user_id__in=sender_ids
+            ).values_list('conversation_id', 'user_id')
+        )
+
+        messages = []
+        positions = []
+        for position, (conversation_id, sender, content) in enumerate(items):
+            if (conversation_id, sender.id) in allowed:
+                messages.append(Message(conversation_id=conversation_id, sender=sender, content=content))
+                positions.append(position)
+
+        results = [None] * len(items)
+        if not messages:
+            return results
+
+        with transaction.atomic():
+            # One UPDATE per conversation reserves the seqs and bumps updated_at
+            Message.assign_seqs(messages, updated_at=timezone.now())
+            Message.objects.bulk_create(messages)
+
+        for position, message in zip(positions, messages):
+            results[position] = message
+        return results
+
+
+_batcher = None
+
+
+def get_message_batcher():
+    """Get the process-wide message batcher"""
+    global _batcher
+    if _batcher is None:
+        _batcher = MessageWriteBatcher(
+            flush_interval=getattr(settings, 'CHAT_WRITE_BATCH_INTERVAL', 0.005),
+            max_batch_size=getattr(settings, 'CHAT_WRITE_BATCH_SIZE', 200),
+        )
+    return _batcher
@@ -1,19 +1,37 @@
+import copy
 import json
+import time
+from urllib.parse import parse_qs
+from channels.exceptions import ChannelFull
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from datetime import timedelta
 from django.contrib.auth.models import AnonymousUser
+from django.db import transaction
 from django.utils import timezone
-from .models import Conversation, Message, TypingIndicator
+from .models import Conversation, Message, PresenceConnection, TypingIndicator
+from .batching import get_message_batcher
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
-    """WebSocket consumer for real-time chat"""
+    """
+    WebSocket consumer for real-time chat
+    
+    Sockets in a room announce themselves with ``peer_hello`` and learn each
+    other's channel names. In a two-party conversation where each side has a
+    single socket, frames are sent straight to the peer's channel instead of
+    through the group; with more participants or devices the group is used.
+    """
+    
+    SYNC_LIMIT = 50
+    MAX_SYNC_LIMIT = 200
     
     async def connect(self):
         """Connect to WebSocket"""
         self.conversation_id = self.scope['url_route']['kwargs']['conversation_id']
         self.room_group_name = f'chat_{self.conversation_id}'
         self.user = self.scope['user']
+        self.peer_channels = None
         
         # Check if user is authenticated and can access this conversation
         if self.user == AnonymousUser():
@@ -26,6 +44,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
         
+        # user id -> channel names of the other sockets in this room
+        self.peer_channels = {}
+        self.is_two_party = await self.get_participant_count() == 2
+        
         # Join room group
         await self.channel_layer.group_add(
             self.room_group_name,
@@ -34,14 +56,34 @@ class ChatConsumer(AsyncWebsocketConsumer):
         
         await self.accept()
         
-        # Send recent messages
-        await self.send_recent_messages()
+        # Announce ourselves before loading history, so nothing sent after
+        # the history query can miss us
+        await self.channel_layer.group_send(self.room_group_name, {
+            'type': 'peer_hello',
+            'conversation_id': int(self.conversation_id),
+            'user_id': self.user.id,
+            'channel': self.channel_name,
+        })
+        
+        # Send recent messages - reconnecting clients pass ?resume_from=<last seen seq>
+        # (or ?after=<last seen id>) and only receive the messages they missed
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        resume_from = self.parse_message_id(query.get('resume_from', [None])[0])
+        after = self.parse_message_id(query.get('after', [None])[0])
+        await self.send_recent_messages(after=after, resume_from=resume_from)
     
     async def disconnect(self, close_code):
         """Disconnect from WebSocket"""
         # Stop typing indicator
         await self.stop_typing()
         
+        if getattr(self, 'peer_channels', None) is not None:
+            await self.channel_layer.group_send(self.room_group_name, {
+                'type': 'peer_goodbye',
+                'conversation_id': int(self.conversation_id),
+                'channel': self.channel_name,
+            })
+        
         # Leave room group
         await self.channel_layer.group_discard(
             self.room_group_name,
@@ -62,6 +104,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 await self.handle_typing_stop()
             elif message_type == 'mark_read':
                 await self.handle_mark_read(text_data_json)
+            elif message_type == 'read_up_to':
+                await self.handle_read_up_to(text_data_json)
+            elif message_type == 'sync':
+                await self.handle_sync(text_data_json)
             
         except json.JSONDecodeError:
             await self.send(text_data=json.dumps({
@@ -84,13 +130,14 @@ class ChatConsumer(AsyncWebsocketConsumer):
         message = await self.save_message(content)
         
         if message:
-            # Send message to room group
-            await self.channel_layer.group_send(
-                self.room_group_name,
+            # Send message to the peer (and echo it back to this socket)
+            await self.deliver(
                 {
                     'type': 'chat_message',
+                    'conversation_id': message.conversation_id,
                     'message': {
                         'id': message.id,
+                        'seq': message.seq,
                         'content': message.content,
                         'sender': self.user.username,
                         'sender_name': f"{self.user.first_name} {self.user.last_name}",
@@ -98,7 +145,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
                         'is_read': message.is_read,
                         'is_own': False
                     }
-                }
+                },
+                include_self=True
             )
     
     async def handle_typing_start(self):
@@ -106,10 +154,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
         await self.set_typing_indicator(True)
         
         # Send typing indicator to other users
-        await self.channel_layer.group_send(
-            self.room_group_name,
+        await self.deliver(
             {
                 'type': 'typing_indicator',
+                'conversation_id': int(self.conversation_id),
                 'user': {
                     'username': self.user.username,
                     'name': f"{self.user.first_name} {self.user.last_name}"
@@ -123,10 +171,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
         await self.set_typing_indicator(False)
         
         # Send typing stop to other users
-        await self.channel_layer.group_send(
-            self.room_group_name,
+        await self.deliver(
             {
                 'type': 'typing_indicator',
+                'conversation_id': int(self.conversation_id),
                 'user': {
                     'username': self.user.username,
                     'name': f"{self.user.first_name} {self.user.last_name}"
@@ -141,6 +189,104 @@ class ChatConsumer(AsyncWebsocketConsumer):
         if message_id:
             await self.mark_message_read(message_id)
     
+    async def handle_read_up_to(self, data):
+        """Handle marking every message up to an id as read"""
+        message_id = self.parse_message_id(data.get('message_id'))
+        if not message_id:
+            return
+        
+        updated, message_id = await self.mark_read_up_to(message_id)
+        if updated:
+            # One receipt for the whole range instead of one per message
+            await self.deliver(
+                {
+                    'type': 'read_receipt',
+                    'conversation_id': int(self.conversation_id),
+                    'user': self.user.username,
+                    'up_to': message_id,
+                }
+            )
+    
+    async def handle_sync(self, data):
+        """Handle a cursor-based sync request (resume_from=<seq>, after=<id> or before=<id>&limit=<n>)"""
+        resume_from = self.parse_message_id(data.get('resume_from'))
+        after = self.parse_message_id(data.get('after'))
+        before = self.parse_message_id(data.get('before'))
+        limit = self.parse_message_id(data.get('limit')) or self.SYNC_LIMIT
+        limit = max(1, min(limit, self.MAX_SYNC_LIMIT))
+        
+        if resume_from is not None:
+            messages, has_more = await self.get_messages_since_seq(resume_from, limit=limit)
+        else:
+            messages, has_more = await self.get_message_window(after=after, before=before, limit=limit)
+        
+        await self.send(text_data=json.dumps({
+            'type': 'sync',
+            'resume_from': resume_from,
+            'after': after,
+            'before': before,
+            'messages': messages,
+            'has_more': has_more
+        }))
+    
+    # Delivery
+    
+    def direct_targets(self):
+        """
+        Channels to deliver to directly, or None when the group has to be used.
+        
+        Direct delivery is only used in two-party conversations where the peer
+        has exactly one known socket and this user has no other socket in the
+        room. Until the peer is known (its ack may still be in flight) the
+        group is used, so nothing is lost.
+        """
+        if not self.is_two_party or self.user.id in self.peer_channels:
+            return None
+        targets = [channel for channels in self.peer_channels.values() for channel in channels]
+        if len(targets) != 1:
+            return None
+        return targets
+    
+    async def deliver(self, event, include_self=False):
+        """Send an event to the other sockets in the room, directly when possible"""
+        targets = self.direct_targets()
+        if targets is None:
+            # The group includes this socket, so it gets its own copy from there
+            await self.channel_layer.group_send(self.room_group_name, event)
+            return
+        
+        for channel in targets:
+            try:
+                await self.channel_layer.send(channel, event)
+            except ChannelFull:
+                # Same as group_send: a full peer misses the frame and resyncs
+                pass
+        if include_self:
+            await getattr(self, event['type'])(copy.deepcopy(event))
+    
+    async def peer_hello(self, event):
+        """Record a socket that joined the room and tell it about this one"""
+        if event['channel'] == self.channel_name:
+            return
+        self.peer_channels.setdefault(event['user_id'], set()).add(event['channel'])
+        await self.channel_layer.send(event['channel'], {
+            'type': 'peer_ack',
+            'conversation_id': int(self.conversation_id),
+            'user_id': self.user.id,
+            'channel': self.channel_name,
+        })
+    
+    async def peer_ack(self, event):
+        """Record a socket that was already in the room"""
+        self.peer_channels.setdefault(event['user_id'], set()).add(event['channel'])
+    
+    async def peer_goodbye(self, event):
+        """Forget a socket that left the room"""
+        for user_id, channels in list(self.peer_channels.items()):
+            channels.discard(event['channel'])
+            if not channels:
+                del self.peer_channels[user_id]
+    
     async def chat_message(self, event):
         """Send chat message to WebSocket"""
         message = event['message']
@@ -161,15 +307,41 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 'is_typing': event['is_typing']
             }))
     
-    async def send_recent_messages(self):
+    async def read_receipt(self, event):
+        """Send read receipt to WebSocket"""
+        # The reader doesn't need its own receipt
+        if event['user'] != self.user.username:
+            await self.send(text_data=json.dumps({
+                'type': 'read_receipt',
+                'user': event['user'],
+                'up_to': event['up_to']
+            }))
+    
+    async def send_recent_messages(self, after=None, resume_from=None):
         """Send recent messages when connecting"""
-        messages = await self.get_recent_messages()
+        if resume_from is not None:
+            # Replay only the gap since the client's last seen seq
+            messages, has_more = await self.get_messages_since_seq(resume_from, limit=self.SYNC_LIMIT)
+        else:
+            messages, has_more = await self.get_message_window(after=after, limit=self.SYNC_LIMIT)
         
         await self.send(text_data=json.dumps({
             'type': 'recent_messages',
-            'messages': messages
+            'resume_from': resume_from,
+            'messages': messages,
+            'has_more': has_more
         }))
     
+    @staticmethod
+    def parse_message_id(value):
+        """Parse a message id cursor, ignoring invalid values"""
+        if value in (None, ''):
+            return None
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+    
     @database_sync_to_async
     def check_conversation_access(self):
         """Check if user can access this conversation"""
@@ -183,9 +355,13 @@ class ChatConsumer(AsyncWebsocketConsumer):
         except Conversation.DoesNotExist:
             return False
     
+    async def save_message(self, content):
+        """Save message to database through the process-wide write batcher"""
+        return await get_message_batcher().submit(self.conversation_id, self.user, content)
+    
     @database_sync_to_async
-    def save_message(self, content):
-        """Save message to database"""
+    def get_message_window(self, after=None, before=None, limit=50):
+        """Get a window of messages for the conversation keyed on message id"""
         try:
             conversation = Conversation.objects.get(
                 id=self.conversation_id,
@@ -193,23 +369,19 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 is_active=True
             )
             
-            message = Message.objects.create(
-                conversation=conversation,
-                sender=self.user,
-                content=content
-            )
-            
-            # Update conversation timestamp
-            conversation.updated_at = timezone.now()
-            conversation.save()
-            
-            return message
+            messages, has_more = conversation.get_message_window(after=after, before=before, limit=limit)
+            return [message.to_dict(self.user) for message in messages], has_more
         except Conversation.DoesNotExist:
-            return None
+            return [], False
+    
+    @database_sync_to_async
+    def get_participant_count(self):
+        """Count the participants of this conversation"""
+        return Conversation.participants.through.objects.filter(conversation_id=self.conversation_id).count()
     
     @database_sync_to_async
-    def get_recent_messages(self, limit=50):
-        """Get recent messages for the conversation"""
+    def get_messages_since_seq(self, seq, limit=50):
+        """Get the messages after a per-conversation sequence number"""
         try:
             conversation = Conversation.objects.get(
                 id=self.conversation_id,
@@ -217,23 +389,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 is_active=True
             )
             
-            messages = conversation.messages.select_related('sender').order_by('-created_at')[:limit]
-            
-            messages_data = []
-            for message in reversed(messages):
-                messages_data.append({
-                    'id': message.id,
-                    'content': message.content,
-                    'sender': message.sender.username,
-                    'sender_name': f"{message.sender.first_name} {message.sender.last_name}",
-                    'timestamp': message.created_at.isoformat(),
-                    'is_read': message.is_read,
-                    'is_own': message.sender == self.user
-                })
-            
-            return messages_data
+            messages, has_more = conversation.get_messages_since_seq(seq, limit=limit)
+            return [message.to_dict(self.user) for message in messages], has_more
         except Conversation.DoesNotExist:
-            return []
+            return [], False
     
     @database_sync_to_async
     def set_typing_indicator(self, is_typing):
@@ -286,3 +445,402 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 message.mark_as_read()
         except Message.DoesNotExist:
             pass
+    
+    @database_sync_to_async
+    def mark_read_up_to(self, message_id):
+        """Mark all messages up to message_id as read. Returns (updated, clamped message_id)."""
+        try:
+            conversation = Conversation.objects.get(
+                id=self.conversation_id,
+                participants=self.user,
+                is_active=True
+            )
+            return conversation.mark_read_up_to(self.user, message_id)
+        except Conversation.DoesNotExist:
+            return 0, 0
+
+
+class MultiplexConsumer(AsyncWebsocketConsumer):
+    """
+    Single WebSocket per user for chat, notifications and presence (/ws/v2/).
+    
+    The socket authenticates once on connect and the client subscribes to
+    topics on demand:
+    
+        {"type": "subscribe", "topic": "chat:<conversation_id>", "after": <id>}
+        {"type": "subscribe", "topic": "notifications"}
+        {"type": "subscribe", "topic": "presence:<user_id>"}
+    
+    Chat actions carry the topic they apply to, e.g.
+    ``{"topic": "chat:12", "type": "chat_message", "content": "..."}``, and
+    every frame sent to the client is tagged with its topic.
+    """
+    
+    PRESENCE_TTL = 120
+    PRESENCE_REFRESH = PRESENCE_TTL // 3  # pings sooner than this after the last refresh don't touch the row
+    
+    async def connect(self):
+        """Connect to WebSocket"""
+        self.user = self.scope['user']
+        self.subscriptions = {}
+        self.presence_refreshed = None
+        
+        if not self.user.is_authenticated:
+            await self.close()
+            return
+        
+        await self.accept()
+        await self.set_presence(True)
+    
+    async def disconnect(self, close_code):
+        """Disconnect from WebSocket"""
+        for topic, group in getattr(self, 'subscriptions', {}).items():
+            await self.leave_group(topic, group)
+        self.subscriptions = {}
+        
+        if self.user.is_authenticated:
+            await self.set_presence(False)
+    
+    async def receive(self, text_data):
+        """Receive frame from WebSocket"""
+        try:
+            data = json.loads(text_data)
+        except json.JSONDecodeError:
+            await self.send_frame(None, {'type': 'error', 'message': 'Invalid JSON'})
+            return
+        
+        message_type = data.get('type')
+        topic = data.get('topic', '')
+        
+        if message_type == 'subscribe':
+            await self.subscribe(topic, data)
+        elif message_type == 'unsubscribe':
+            await self.unsubscribe(topic)
+        elif message_type == 'ping':
+            await self.set_presence(True)
+            await self.send_frame(None, {'type': 'pong'})
+        elif topic.startswith('chat:'):
+            if topic not in self.subscriptions:
+                await self.send_frame(topic, {'type': 'error', 'message': 'Not subscribed'})
+                return
+            await self.handle_chat_action(topic, self.topic_id(topic), message_type, data)
+        elif message_type == 'mark_read' and topic == 'notifications':
+            await self.mark_notification_read(data.get('notification_id'))
+    
+    # Topics
+    
+    @staticmethod
+    def topic_id(topic):
+        """Parse the numeric id from a 'kind:<id>' topic"""
+        try:
+            return int(topic.split(':', 1)[1])
+        except (IndexError, ValueError):
+            return None
+    
+    async def send_frame(self, topic, payload):
+        """Send a frame tagged with its topic"""
+        await self.send(text_data=json.dumps(dict(payload, topic=topic)))
+    
+    async def subscribe(self, topic, data):
+        """Subscribe to a topic after checking access"""
+        if topic in self.subscriptions:
+            await self.send_frame(topic, {'type': 'subscribed'})
+            return
+        
+        extra = {}
+        if topic == 'notifications':
+            group = f'notifications_{self.user.id}'
+        elif topic.startswith('chat:'):
+            conversation_id = self.topic_id(topic)
+            if conversation_id is None or not await self.check_conversation_access(conversation_id):
+                await self.send_frame(topic, {'type': 'error', 'message': 'Access denied'})
+                return
+            group = f'chat_{conversation_id}'
+        elif topic.startswith('presence:'):
+            user_id = self.topic_id(topic)
+            if user_id is None or not await self.check_presence_access(user_id):
+                await self.send_frame(topic, {'type': 'error', 'message': 'Access denied'})
+                return
+            group = f'presence_{user_id}'
+            extra['online'] = await self.is_online(user_id)
+        else:
+            await self.send_frame(topic, {'type': 'error', 'message': 'Unknown topic'})
+            return
+        
+        await self.channel_layer.group_add(group, self.channel_name)
+        self.subscriptions[topic] = group
+        await self.send_frame(topic, dict(extra, type='subscribed'))
+        
+        if topic == 'notifications':
+            await self.unread_count({'count': await self.get_unread_notification_count()})
+        
+        if topic.startswith('chat:'):
+            # Makes two-party ChatConsumers in the room fall back to the group
+            await self.channel_layer.group_send(group, {
+                'type': 'peer_hello',
+                'conversation_id': self.topic_id(topic),
+                'user_id': self.user.id,
+                'channel': self.channel_name,
+            })
+            # Only the delta since the client's last seen message (by seq or id)
+            messages, has_more = await self.get_message_window(
+                self.topic_id(topic),
+                after=ChatConsumer.parse_message_id(data.get('after')),
+                resume_from=ChatConsumer.parse_message_id(data.get('resume_from'))
+            )
+            await self.send_frame(topic, {'type': 'recent_messages', 'messages': messages, 'has_more': has_more})
+    
+    async def unsubscribe(self, topic):
+        """Unsubscribe from a topic"""
+        group = self.subscriptions.pop(topic, None)
+        if group:
+            await self.leave_group(topic, group)
+        await self.send_frame(topic, {'type': 'unsubscribed'})
+    
+    async def leave_group(self, topic, group):
+        """Leave a topic's group, saying goodbye to chat peers"""
+        if topic.startswith('chat:'):
+            await self.channel_layer.group_send(group, {
+                'type': 'peer_goodbye',
+                'conversation_id': self.topic_id(topic),
+                'channel': self.channel_name,
+            })
+        await self.channel_layer.group_discard(group, self.channel_name)
+    
+    # Chat
+    
+    async def handle_chat_action(self, topic, conversation_id, message_type, data):
+        """Handle a chat frame for a subscribed conversation"""
+        group = self.subscriptions[topic]
+        user_info = {
+            'username': self.user.username,
+            'name': f"{self.user.first_name} {self.user.last_name}"
+        }
+        
+        if message_type == 'chat_message':
+            content = data.get('content', '').strip()
+            if not content:
+                await self.send_frame(topic, {'type': 'error', 'message': 'Message cannot be empty'})
+                return
+            message = await get_message_batcher().submit(conversation_id, self.user, content)
+            if message:
+                payload = message.to_dict()
+                await self.channel_layer.group_send(group, {
+                    'type': 'chat_message',
+                    'conversation_id': conversation_id,
+                    'message': payload
+                })
+        elif message_type in ('typing_start', 'typing_stop'):
+            await self.channel_layer.group_send(group, {
+                'type': 'typing_indicator',
+                'conversation_id': conversation_id,
+                'user': user_info,
+                'is_typing': message_type == 'typing_start'
+            })
+        elif message_type == 'read_up_to':
+            message_id = ChatConsumer.parse_message_id(data.get('message_id'))
+            updated = 0
+            if message_id:
+                updated, message_id = await self.mark_read_up_to(conversation_id, message_id)
+            if updated:
+                await self.channel_layer.group_send(group, {
+                    'type': 'read_receipt',
+                    'conversation_id': conversation_id,
+                    'user': self.user.username,
+                    'up_to': message_id,
+                })
+        elif message_type == 'sync':
+            limit = ChatConsumer.parse_message_id(data.get('limit')) or ChatConsumer.SYNC_LIMIT
+            messages, has_more = await self.get_message_window(
+                conversation_id,
+                after=ChatConsumer.parse_message_id(data.get('after')),
+                before=ChatConsumer.parse_message_id(data.get('before')),
+                resume_from=ChatConsumer.parse_message_id(data.get('resume_from')),
+                limit=max(1, min(limit, ChatConsumer.MAX_SYNC_LIMIT))
+            )
+            await self.send_frame(topic, {'type': 'sync', 'messages': messages, 'has_more': has_more})
+    
+    async def chat_message(self, event):
+        """Send chat message to WebSocket"""
+        message = dict(event['message'])
+        message['is_own'] = message['sender'] == self.user.username
+        await self.send_frame(f"chat:{event['conversation_id']}", {'type': 'chat_message', 'message': message})
+    
+    async def typing_indicator(self, event):
+        """Send typing indicator to WebSocket"""
+        if event['user']['username'] != self.user.username:
+            await self.send_frame(f"chat:{event['conversation_id']}", {
+                'type': 'typing_indicator',
+                'user': event['user'],
+                'is_typing': event['is_typing']
+            })
+    
+    async def peer_hello(self, event):
+        """Chat sockets only deliver directly to known peers - this socket is one"""
+        if event['channel'] != self.channel_name:
+            await self.channel_layer.send(event['channel'], {
+                'type': 'peer_ack',
+                'conversation_id': event['conversation_id'],
+                'user_id': self.user.id,
+                'channel': self.channel_name,
+            })
+    
+    async def peer_ack(self, event):
+        """Multiplexed sockets always send through the group"""
+    
+    async def peer_goodbye(self, event):
+        """Multiplexed sockets always send through the group"""
+    
+    async def read_receipt(self, event):
+        """Send read receipt to WebSocket"""
+        if event['user'] != self.user.username:
+            await self.send_frame(f"chat:{event['conversation_id']}", {
+                'type': 'read_receipt',
+                'user': event['user'],
+                'up_to': event['up_to']
+            })
+    
+    # Notifications
+    
+    async def notification_message(self, event):
+        """Send notification to WebSocket"""
+        await self.send_frame('notifications', {
+            'type': 'notification',
+            'message': event['message'],
+            'title': event.get('title', 'New Notification'),
+            'notification_type': event.get('notification_type', 'SYSTEM_ANNOUNCEMENT'),
+            'timestamp': event.get('timestamp'),
+        })
+    
+    async def unread_count(self, event):
+        """Send the user's unread notification count"""
+        await self.send_frame('notifications', {'type': 'unread_count', 'count': event['count']})
+    
+    async def bid_update(self, event):
+        """Send bid update notification"""
+        await self.send_frame('notifications', dict(event, type='bid_update'))
+    
+    async def new_message(self, event):
+        """Send new message notification"""
+        await self.send_frame('notifications', dict(event, type='new_message'))
+    
+    async def payment_update(self, event):
+        """Send payment update notification"""
+        await self.send_frame('notifications', dict(event, type='payment_update'))
+    
+    # Presence
+    
+    async def set_presence(self, online):
+        """
+        Record this socket's presence and broadcast the user's if it changed.
+        
+        Every open socket has its own PresenceConnection row, refreshed by
+        pings, so the user only goes offline when their last tab or device
+        disconnects (or stops pinging for PRESENCE_TTL seconds). Pings within
+        PRESENCE_REFRESH of the last refresh are skipped: the row is still fresh.
+        """
+        now = time.monotonic()
+        if online and self.presence_refreshed is not None and now - self.presence_refreshed < self.PRESENCE_REFRESH:
+            return
+        changed = await self.record_presence(online)
+        self.presence_refreshed = now if online else None
+        if not changed:
+            return
+        
+        await self.channel_layer.group_send(f'presence_{self.user.id}', {
+            'type': 'presence_update',
+            'user_id': self.user.id,
+            'online': online,
+        })
+    
+    async def presence_update(self, event):
+        """Send presence change to WebSocket"""
+        await self.send_frame(f"presence:{event['user_id']}", {
+            'type': 'presence',
+            'user_id': event['user_id'],
+            'online': event['online'],
+        })
+    
+    # Database helpers
+    
+    @database_sync_to_async
+    def check_conversation_access(self, conversation_id):
+        """Check if user can access a conversation"""
+        return Conversation.objects.filter(
+            id=conversation_id,
+            participants=self.user,
+            is_active=True
+        ).exists()
+    
+    @database_sync_to_async
+    def check_presence_access(self, user_id):
+        """Users can see the presence of people they share a conversation with"""
+        if user_id == self.user.id:
+            return True
+        return Conversation.objects.filter(participants=self.user).filter(participants=user_id).exists()
+    
+    def live_connections(self, user_id):
+        cutoff = timezone.now() - timedelta(seconds=self.PRESENCE_TTL)
+        return PresenceConnection.objects.filter(user_id=user_id, last_seen__gte=cutoff)
+    
+    @database_sync_to_async
+    def is_online(self, user_id):
+        """True if the user has a socket that pinged within PRESENCE_TTL"""
+        return self.live_connections(user_id).exists()
+    
+    @database_sync_to_async
+    def record_presence(self, online):
+        """Add, refresh or drop this socket's row. Returns True if the user's presence changed."""
+        with transaction.atomic():
+            was_online = self.live_connections(self.user.id).exists()
+            # Rows of sockets whose process died without disconnecting
+            PresenceConnection.objects.filter(
+                user=self.user, last_seen__lt=timezone.now() - timedelta(seconds=self.PRESENCE_TTL)
+            ).delete()
+            if online:
+                PresenceConnection.objects.update_or_create(
+                    channel_name=self.channel_name,
+                    defaults={'user': self.user, 'last_seen': timezone.now()},
+                )
+            else:
+                PresenceConnection.objects.filter(channel_name=self.channel_name).delete()
+            return self.live_connections(self.user.id).exists() != was_online
+    
+    @database_sync_to_async
+    def get_message_window(self, conversation_id, after=None, before=None, resume_from=None, limit=50):
+        """Get a window of messages for a subscribed conversation"""
+        try:
+            conversation = Conversation.objects.get(id=conversation_id, is_active=True)
+        except Conversation.DoesNotExist:
+            return [], False
+        if resume_from is not None:
+            messages, has_more = conversation.get_messages_since_seq(resume_from, limit=limit)
+        else:
+            messages, has_more = conversation.get_message_window(after=after, before=before, limit=limit)
+        return [message.to_dict(self.user) for message in messages], has_more
+    
+    @database_sync_to_async
+    def mark_read_up_to(self, conversation_id, message_id):
+        """Mark all messages up to message_id as read. Returns (updated, clamped message_id)."""
+        try:
+            conversation = Conversation.objects.get(id=conversation_id, is_active=True)
+        except Conversation.DoesNotExist:
+            return 0, 0
+        return conversation.mark_read_up_to(self.user, message_id)
+    
+    @database_sync_to_async
+    def get_unread_notification_count(self):
+        """Cached unread notification count for this user"""
+        from notifications.counters import get_unread_count
+        
+        return get_unread_count(self.user.id)
+    
+    @database_sync_to_async
+    def mark_notification_read(self, notification_id):
+        """Mark one of this user's notifications as read"""
+        from notifications.models import Notification
+        
+        try:
+            Notification.objects.get(id=notification_id, user=self.user).mark_as_read()
+        except (Notification.DoesNotExist, ValueError, TypeError):
+            pass
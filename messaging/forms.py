@@ -1,5 +1,6 @@
 from django import forms
 from .models import Message, MessageAttachment
+from .attachments import ALLOWED_CONTENT_TYPES
 
 
 class MessageForm(forms.ModelForm):
@@ -45,14 +46,7 @@ class MessageWithAttachmentForm(MessageForm):
                 raise forms.ValidationError('File size cannot exceed 10MB')
             
             # Check file type
-            allowed_types = [
-                'image/jpeg', 'image/png', 'image/gif', 'image/webp',
-                'application/pdf',
-                'application/msword',
-                'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-                'text/plain'
-            ]
-            if attachment.content_type not in allowed_types:
+            if attachment.content_type not in ALLOWED_CONTENT_TYPES:
                 raise forms.ValidationError('File type not allowed')
         
         return attachment
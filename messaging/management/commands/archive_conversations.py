@@ -0,0 +1,80 @@
+"""
+Management command to move the messages of idle conversations into compressed
+cold-storage archives so the hot messages table only holds active chats.
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from messaging.archive import archive_conversation, archive_root
+from messaging.models import Conversation
+
+
+class Command(BaseCommand):
+    help = 'Archive the messages of conversations idle for N days into compressed blobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=90,
+            help='Archive conversations with no activity for this many days (default: 90).',
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=None,
+            help='Maximum number of conversations to archive in this run.',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report what would be archived without changing anything.',
+        )
+        parser.add_argument(
+            '--vacuum',
+            action='store_true',
+            help='Run VACUUM afterwards so SQLite returns the freed pages to the disk.',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        dry_run = options['dry_run']
+
+        # Conversations with unread messages stay hot so unread counts keep working
+        conversations = Conversation.objects.filter(
+            updated_at__lt=cutoff,
+            messages__isnull=False,
+        ).exclude(
+            messages__is_read=False,
+        ).distinct().order_by('id')
+        if options['limit']:
+            conversations = conversations[:options['limit']]
+        # Ids only, so no read cursor stays open while messages are deleted
+        conversation_ids = list(conversations.values_list('id', flat=True))
+
+        self.stdout.write(f"{'[dry run] ' if dry_run else ''}Archiving conversations idle since {cutoff:%Y-%m-%d} to {archive_root()}")
+
+        archived_conversations = 0
+        archived_messages = 0
+        for start in range(0, len(conversation_ids), 200):
+            for conversation in Conversation.objects.filter(id__in=conversation_ids[start:start + 200]).order_by('id'):
+                count = archive_conversation(conversation, dry_run=dry_run)
+                if not count:
+                    continue
+                archived_conversations += 1
+                archived_messages += count
+                self.stdout.write(f'  conversation {conversation.id}: {count} messages')
+
+        verb = 'Would archive' if dry_run else 'Archived'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {archived_messages} messages from {archived_conversations} conversations'
+        ))
+
+        if options['vacuum'] and not dry_run and archived_messages and connection.vendor == 'sqlite':
+            self.stdout.write('Running VACUUM...')
+            with connection.cursor() as cursor:
+                cursor.execute('VACUUM')
+            self.stdout.write(self.style.SUCCESS('VACUUM complete'))
@@ -0,0 +1,52 @@
+"""
+Management command that deletes attachment blobs no attachment refers to any
+more (their messages were deleted), together with their files, in resumable
+batches.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from maintenance.batch import BatchCommand
+from messaging.models import AttachmentBlob
+
+GRACE_HOURS = 24
+
+
+class Command(BatchCommand):
+    help = 'Delete attachment blobs that no attachment refers to, and their files'
+
+    checkpoint_name = 'prune_attachment_blobs'
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            '--grace-hours',
+            type=int,
+            default=GRACE_HOURS,
+            help=f'Keep unreferenced blobs younger than this (default: {GRACE_HOURS}).',
+        )
+
+    def handle(self, *args, **options):
+        self.cutoff = timezone.now() - timedelta(hours=options['grace_hours'])
+        self.stdout.write(f'Pruning unreferenced attachment blobs stored before {self.cutoff:%Y-%m-%d %H:%M}')
+        super().handle(*args, **options)
+
+    def get_queryset(self):
+        # A new blob may belong to an upload whose message isn't committed yet
+        return AttachmentBlob.objects.filter(attachments__isnull=True, created_at__lt=self.cutoff)
+
+    def process_batch(self, blobs, stats):
+        # Checked again inside the transaction - an upload may have reused a blob since it was read
+        orphans = list(AttachmentBlob.objects.filter(id__in=[blob.id for blob in blobs], attachments__isnull=True))
+        AttachmentBlob.objects.filter(id__in=[blob.id for blob in orphans]).delete()
+
+        def delete_files():
+            for blob in orphans:
+                blob.file.delete(save=False)
+
+        # Files go once the rows are gone for good (never on a dry run, which rolls back)
+        transaction.on_commit(delete_files)
+        stats['deleted'] = stats.get('deleted', 0) + len(orphans)
+        stats['bytes_freed'] = stats.get('bytes_freed', 0) + sum(blob.file_size for blob in orphans)
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.7 on 2026-10-19 01:40
+
+from django.db import migrations, models
+
+
+def backfill_pair_keys(apps, schema_editor):
+    """Give every existing 1-on-1 conversation its canonical pair key"""
+    Conversation = apps.get_model('messaging', 'Conversation')
+    Participant = Conversation.participants.through
+
+    participants = {}
+    for conversation_id, user_id in Participant.objects.values_list('conversation_id', 'user_id').iterator():
+        participants.setdefault(conversation_id, []).append(user_id)
+
+    seen = set()
+    conversations = Conversation.objects.order_by('-updated_at').values_list('id', 'bid_id', 'offer_id')
+    for conversation_id, bid_id, offer_id in conversations.iterator():
+        user_ids = participants.get(conversation_id, [])
+        if len(user_ids) != 2:
+            continue
+        if bid_id:
+            context = f"bid:{bid_id}"
+        elif offer_id:
+            context = f"offer:{offer_id}"
+        else:
+            context = "direct:0"
+        low, high = sorted(user_ids)
+        pair_key = f"{context}:{low}:{high}"
+        # Keep the most recently active thread if duplicates already exist
+        if pair_key in seen:
+            continue
+        seen.add(pair_key)
+        Conversation.objects.filter(id=conversation_id).update(pair_key=pair_key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0005_conversationreadstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='pair_key',
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True),
+        ),
+        migrations.RunPython(backfill_pair_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,119 @@
+# Full-text search index for messages (see messaging/search.py)
+#
+# The participant triggers update FTS rows by rowid, through messaging_message's
+# conversation index, rather than scanning the FTS table on its UNINDEXED
+# conversation_id column. Because they read messaging_message, SQLite refuses
+# to rename a table to that name while they exist: a later migration that
+# rebuilds the table (AlterField, AddConstraint, ...) has to drop them first
+# and recreate them, along with the message triggers, afterwards.
+
+from django.db import migrations
+
+
+PARTICIPANT_TOKENS = """
+    (SELECT group_concat('u' || user_id, ' ')
+     FROM messaging_conversation_participants
+     WHERE conversation_id = {conversation_id})
+"""
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS messaging_message_fts USING fts5(
+        content,
+        conversation_id UNINDEXED,
+        participants,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS messaging_message_fts_insert
+    AFTER INSERT ON messaging_message BEGIN
+        INSERT INTO messaging_message_fts (rowid, content, conversation_id, participants)
+        VALUES (NEW.id, NEW.content, NEW.conversation_id,
+                {PARTICIPANT_TOKENS.format(conversation_id='NEW.conversation_id')});
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messaging_message_fts_delete
+    AFTER DELETE ON messaging_message BEGIN
+        DELETE FROM messaging_message_fts WHERE rowid = OLD.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS messaging_message_fts_update
+    AFTER UPDATE OF content, conversation_id ON messaging_message BEGIN
+        DELETE FROM messaging_message_fts WHERE rowid = OLD.id;
+        INSERT INTO messaging_message_fts (rowid, content, conversation_id, participants)
+        VALUES (NEW.id, NEW.content, NEW.conversation_id,
+                {PARTICIPANT_TOKENS.format(conversation_id='NEW.conversation_id')});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS messaging_message_fts_participant_add
+    AFTER INSERT ON messaging_conversation_participants BEGIN
+        UPDATE messaging_message_fts
+        SET participants = {PARTICIPANT_TOKENS.format(conversation_id='NEW.conversation_id')}
+        WHERE rowid IN (SELECT id FROM messaging_message WHERE conversation_id = NEW.conversation_id);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS messaging_message_fts_participant_remove
+    AFTER DELETE ON messaging_conversation_participants BEGIN
+        UPDATE messaging_message_fts
+        SET participants = {PARTICIPANT_TOKENS.format(conversation_id='OLD.conversation_id')}
+        WHERE rowid IN (SELECT id FROM messaging_message WHERE conversation_id = OLD.conversation_id);
+    END
+    """,
+    f"""
+    INSERT INTO messaging_message_fts (rowid, content, conversation_id, participants)
+    SELECT id, content, conversation_id, {PARTICIPANT_TOKENS.format(conversation_id='messaging_message.conversation_id')}
+    FROM messaging_message
+    """,
+]
+
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS messaging_message_fts_participant_remove",
+    "DROP TRIGGER IF EXISTS messaging_message_fts_participant_add",
+    "DROP TRIGGER IF EXISTS messaging_message_fts_update",
+    "DROP TRIGGER IF EXISTS messaging_message_fts_delete",
+    "DROP TRIGGER IF EXISTS messaging_message_fts_insert",
+    "DROP TABLE IF EXISTS messaging_message_fts",
+]
+
+POSTGRESQL_FORWARD = [
+    """
+    ALTER TABLE messaging_message
+    ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('simple', coalesce(content, ''))) STORED
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS messaging_message_search_idx
+    ON messaging_message USING GIN (search_vector)
+    """,
+]
+
+POSTGRESQL_REVERSE = [
+    "DROP INDEX IF EXISTS messaging_message_search_idx",
+    "ALTER TABLE messaging_message DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def _run(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0006_conversation_pair_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _run({'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRESQL_FORWARD}),
+            _run({'sqlite': SQLITE_REVERSE, 'postgresql': POSTGRESQL_REVERSE}),
+        ),
+    ]
@@ -0,0 +1,120 @@
+# Generated by Django 4.2.7 on 2026-10-19 01:51
+
+import json
+import os
+import struct
+import tempfile
+import zlib
+from pathlib import Path
+
+from django.conf import settings
+from django.db import migrations, models
+
+# The archive file format as of this migration (see messaging/archive.py)
+MAGIC = b'MJARCH01'
+_LENGTH = struct.Struct('>I')
+_INDEX_ENTRY = struct.Struct('>QQIQI')
+_FOOTER = struct.Struct('>QI8s')
+
+
+def _number_archive(path):
+    """Give each archived record without a seq its position in the file"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    index_offset, block_count, magic = _FOOTER.unpack_from(data, len(data) - _FOOTER.size)
+    if magic != MAGIC or data[:len(MAGIC)] != MAGIC:
+        return
+
+    blocks = []
+    position = numbered = 0
+    for i in range(block_count):
+        first_id, last_id, count, offset, length = _INDEX_ENTRY.unpack_from(data, index_offset + i * _INDEX_ENTRY.size)
+        payload = zlib.decompress(data[offset:offset + length])
+        records = []
+        cursor = 0
+        while cursor < len(payload):
+            (size,) = _LENGTH.unpack_from(payload, cursor)
+            cursor += _LENGTH.size
+            records.append(json.loads(payload[cursor:cursor + size]))
+            cursor += size
+        for record in records:
+            position += 1
+            if record.get('seq') is None:
+                record['seq'] = position
+                numbered += 1
+        frame = zlib.compress(b''.join(
+            _LENGTH.pack(len(encoded)) + encoded
+            for encoded in (json.dumps(record, separators=(',', ':')).encode('utf-8') for record in records)
+        ), 6)
+        blocks.append((first_id, last_id, count, frame))
+    if not numbered:
+        return
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(MAGIC)
+            index = []
+            for first_id, last_id, count, frame in blocks:
+                index.append((first_id, last_id, count, f.tell(), len(frame)))
+                f.write(frame)
+            index_offset = f.tell()
+            for entry in index:
+                f.write(_INDEX_ENTRY.pack(*entry))
+            f.write(_FOOTER.pack(index_offset, len(index), MAGIC))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def backfill_seqs(apps, schema_editor):
+    """Number existing messages per conversation in id order"""
+    # Archived messages keep the low numbers, hot rows continue after them
+    schema_editor.execute(
+        "UPDATE messaging_message SET seq = ("
+        "  SELECT COUNT(*) FROM messaging_message m2"
+        "  WHERE m2.conversation_id = messaging_message.conversation_id AND m2.id <= messaging_message.id"
+        ") + COALESCE(("
+        "  SELECT a.message_count FROM messaging_conversationarchive a"
+        "  WHERE a.conversation_id = messaging_message.conversation_id"
+        "), 0)"
+    )
+    schema_editor.execute(
+        "UPDATE messaging_conversation SET last_seq = COALESCE(("
+        "  SELECT MAX(m.seq) FROM messaging_message m WHERE m.conversation_id = messaging_conversation.id"
+        "), ("
+        "  SELECT a.message_count FROM messaging_conversationarchive a WHERE a.conversation_id = messaging_conversation.id"
+        "), 0)"
+    )
+
+    # Archived records take the seqs their messages were given above
+    root = Path(getattr(settings, 'MESSAGE_ARCHIVE_ROOT', None) or os.path.join(settings.BASE_DIR, 'message_archive'))
+    ConversationArchive = apps.get_model('messaging', 'ConversationArchive')
+    for relative_path in ConversationArchive.objects.values_list('path', flat=True).iterator():
+        if os.path.exists(root / relative_path):
+            _number_archive(root / relative_path)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0009_conversationarchive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_seq',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='seq',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_seqs, migrations.RunPython.noop),
+    ]
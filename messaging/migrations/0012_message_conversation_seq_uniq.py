@@ -0,0 +1,39 @@
+# Generated by Django 4.2.7 on 2026-10-19 01:51
+
+from django.db import migrations, models
+
+
+CONSTRAINT = models.UniqueConstraint(fields=('conversation', 'seq'), name='message_conversation_seq_uniq')
+
+
+def add_constraint(apps, schema_editor):
+    # SQLite's AddConstraint rebuilds messaging_message, which the FTS triggers
+    # from 0007 don't allow; a unique index enforces the same thing in place
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(
+            'CREATE UNIQUE INDEX IF NOT EXISTS message_conversation_seq_uniq '
+            'ON messaging_message (conversation_id, seq)'
+        )
+    else:
+        schema_editor.add_constraint(apps.get_model('messaging', 'Message'), CONSTRAINT)
+
+
+def remove_constraint(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP INDEX IF EXISTS message_conversation_seq_uniq')
+    else:
+        schema_editor.remove_constraint(apps.get_model('messaging', 'Message'), CONSTRAINT)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0011_message_seq'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunPython(add_constraint, remove_constraint)],
+            state_operations=[migrations.AddConstraint(model_name='message', constraint=CONSTRAINT)],
+        ),
+    ]
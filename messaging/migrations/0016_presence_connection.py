@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-19 02:42
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('messaging', '0012_message_conversation_seq_uniq'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PresenceConnection',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('channel_name', models.CharField(max_length=255, unique=True)),
+                ('last_seen', models.DateTimeField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='presence_connections', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'last_seen'], name='presence_user_seen_idx')],
+            },
+        ),
+    ]
@@ -1,4 +1,7 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import F
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from bids.models import Bid
@@ -12,6 +15,10 @@ class Conversation(models.Model):
     bid = models.ForeignKey(Bid, on_delete=models.CASCADE, related_name='conversations', null=True, blank=True)
     offer = models.ForeignKey('offers.Offer', on_delete=models.CASCADE, related_name='conversations', null=True, blank=True)
     participants = models.ManyToManyField(User, related_name='conversations')
+    # Canonical key for 1-on-1 threads: "<context type>:<context id>:<min user id>:<max user id>"
+    pair_key = models.CharField(max_length=100, unique=True, null=True, blank=True)
+    # Highest Message.seq handed out in this conversation
+    last_seq = models.PositiveBigIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
@@ -26,6 +33,54 @@ class Conversation(models.Model):
             return f"Conversation for {self.offer.title}"
         return "Conversation"
     
+    @staticmethod
+    def build_pair_key(user_a, user_b, bid=None, offer=None):
+        """Build the canonical pair key for a 1-on-1 conversation about a bid or offer"""
+        if bid is not None:
+            context_type, context_id = 'bid', bid.id
+        elif offer is not None:
+            context_type, context_id = 'offer', offer.id
+        else:
+            context_type, context_id = 'direct', 0
+        low, high = sorted([user_a.id, user_b.id])
+        return f"{context_type}:{context_id}:{low}:{high}"
+    
+    @classmethod
+    def get_or_create_for_pair(cls, user_a, user_b, bid=None, offer=None):
+        """
+        Get or create the single 1-on-1 conversation between two users for a bid or offer.
+        
+        The lookup is one indexed get on ``pair_key`` and the unique constraint
+        stops concurrent requests from creating duplicate threads.
+        """
+        pair_key = cls.build_pair_key(user_a, user_b, bid=bid, offer=offer)
+        try:
+            return cls.objects.get(pair_key=pair_key), False
+        except cls.DoesNotExist:
+            pass
+        
+        try:
+            with transaction.atomic():
+                conversation = cls.objects.create(bid=bid, offer=offer, pair_key=pair_key, is_active=True)
+                conversation.participants.add(user_a, user_b)
+            return conversation, True
+        except IntegrityError:
+            # Another request created the thread first
+            return cls.objects.get(pair_key=pair_key), False
+    
+    @classmethod
+    def allocate_seqs(cls, conversation_id, count=1, **updates):
+        """
+        Reserve ``count`` consecutive message sequence numbers and return the first.
+        
+        Must run inside a transaction: the UPDATE locks the conversation row
+        until commit, so concurrent writers get disjoint ranges. Extra
+        ``updates`` (e.g. ``updated_at``) are applied in the same statement.
+        """
+        cls.objects.filter(id=conversation_id).update(last_seq=F('last_seq') + count, **updates)
+        last_seq = cls.objects.filter(id=conversation_id).values_list('last_seq', flat=True).get()
+        return last_seq - count + 1
+    
     def get_title(self):
         """Get the title of the related bid or offer"""
         if self.bid:
@@ -49,6 +104,115 @@ class Conversation(models.Model):
         ).filter(
             is_read=False
         ).count()
+    
+    def newest_message_id(self, up_to):
+        """Id of the newest message (hot or archived) at or below ``up_to``, or 0 if there is none"""
+        newest = self.messages.filter(id__lte=up_to).order_by('-id').values_list('id', flat=True).first() or 0
+        archive = self.get_archive()
+        if archive is not None:
+            newest = max(newest, min(up_to, archive.last_message_id))
+        return newest
+    
+    def mark_read_up_to(self, user, message_id):
+        """
+        Mark every message from the other participants up to ``message_id`` as read
+        with a single UPDATE and advance the user's read watermark.
+        
+        ``message_id`` comes from the client, so it is first clamped to the newest
+        message that exists; a too-high id can't mark future messages read.
+        Returns ``(updated, up_to)``: the number of messages that changed state
+        and the clamped id.
+        """
+        message_id = self.newest_message_id(message_id)
+        if not message_id:
+            return 0, 0
+        now = timezone.now()
+        updated = self.messages.filter(
+            id__lte=message_id,
+            is_read=False
+        ).exclude(
+            sender=user
+        ).update(is_read=True, read_at=now)
+        
+        # Only ever move the watermark forwards
+        advanced = ConversationReadState.objects.filter(
+            conversation=self,
+            user=user,
+            last_read_message_id__lt=message_id
+        ).update(last_read_message_id=message_id, updated_at=now)
+        if not advanced:
+            ConversationReadState.objects.get_or_create(
+                conversation=self,
+                user=user,
+                defaults={'last_read_message_id': message_id}
+            )
+        
+        return updated, message_id
+    
+    def get_messages_since_seq(self, seq, limit=50):
+        """
+        Get the messages with a sequence number above ``seq``, oldest first.
+        
+        Used to replay exactly the gap a reconnecting client missed, including
+        messages that have since moved to the conversation's archive. Returns a
+        ``(messages, has_more)`` tuple.
+        """
+        window = list(
+            self.messages.select_related('sender').filter(seq__gt=seq).order_by('seq')[:limit + 1]
+        )
+        archive = self.get_archive()
+        if archive is not None:
+            from .archive import read_archived_after_seq
+            merged = {message.seq: message for message in read_archived_after_seq(self, archive, seq, limit + 1)}
+            merged.update((message.seq, message) for message in window)
+            window = [merged[message_seq] for message_seq in sorted(merged)][:limit + 1]
+        return window[:limit], len(window) > limit
+    
+    def get_message_window(self, after=None, before=None, limit=50):
+        """
+        Get a window of messages keyed on message id.
+        
+        ``after`` returns the messages newer than that id (oldest first), ``before``
+        returns the ``limit`` messages older than that id, and with neither the
+        latest ``limit`` messages are returned. Only ``limit + 1`` rows are read,
+        so the cost doesn't grow with the length of the conversation.
+        
+        Returns a ``(messages, has_more)`` tuple with messages in chronological order.
+        """
+        messages = self.messages.select_related('sender')
+        archive = self.get_archive()
+        
+        if after is not None:
+            window = list(messages.filter(id__gt=after).order_by('id')[:limit + 1])
+            if archive is not None and after < archive.last_message_id:
+                from .archive import read_archived_after
+                window = self._merge_windows(window, read_archived_after(self, archive, after, limit + 1))[:limit + 1]
+            has_more = len(window) > limit
+            return window[:limit], has_more
+        
+        if before is not None:
+            messages = messages.filter(id__lt=before)
+        window = list(messages.order_by('-id')[:limit + 1])
+        if archive is not None:
+            from .archive import read_archived_before
+            archived = read_archived_before(self, archive, before or archive.last_message_id + 1, limit + 1)
+            window = self._merge_windows(window, archived)[-(limit + 1):][::-1]
+        has_more = len(window) > limit
+        return list(reversed(window[:limit])), has_more
+    
+    def get_archive(self):
+        """Get the cold-storage archive for this conversation, if any"""
+        try:
+            return self.archive
+        except ConversationArchive.DoesNotExist:
+            return None
+    
+    @staticmethod
+    def _merge_windows(hot, archived):
+        """Merge hot and archived messages by id (hot rows win), oldest first"""
+        merged = {message.id: message for message in archived}
+        merged.update((message.id, message) for message in hot)
+        return [merged[message_id] for message_id in sorted(merged)]
 
 
 class Message(models.Model):
@@ -57,17 +221,61 @@ class Message(models.Model):
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages')
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages')
     content = models.TextField(max_length=2000)
+    # Per-conversation sequence number, gapless and increasing in commit order
+    seq = models.PositiveBigIntegerField(null=True, blank=True)
     is_read = models.BooleanField(default=False)
     read_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['conversation', 'id'], name='message_conversation_id_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['conversation', 'seq'], name='message_conversation_seq_uniq'),
+        ]
     
     def __str__(self):
         title = self.conversation.get_title()
         return f"Message from {self.sender.username} in {title}"
     
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.seq is None:
+            with transaction.atomic():
+                self.seq = Conversation.allocate_seqs(self.conversation_id)
+                super().save(*args, **kwargs)
+            return
+        super().save(*args, **kwargs)
+    
+    @staticmethod
+    def assign_seqs(messages, **updates):
+        """
+        Give unsaved messages their sequence numbers before a bulk_create.
+        
+        One UPDATE per conversation; must run inside the bulk_create's transaction.
+        """
+        by_conversation = {}
+        for message in messages:
+            by_conversation.setdefault(message.conversation_id, []).append(message)
+        for conversation_id, group in by_conversation.items():
+            first = Conversation.allocate_seqs(conversation_id, len(group), **updates)
+            for offset, message in enumerate(group):
+                message.seq = first + offset
+    
+    def to_dict(self, user=None):
+        """Serialize message for the JSON and WebSocket APIs"""
+        return {
+            'id': self.id,
+            'seq': self.seq,
+            'content': self.content,
+            'sender': self.sender.username,
+            'sender_name': f"{self.sender.first_name} {self.sender.last_name}",
+            'timestamp': self.created_at.isoformat(),
+            'is_read': self.is_read,
+            'is_own': self.sender_id == getattr(user, 'id', None)
+        }
+    
     def mark_as_read(self):
         """Mark message as read"""
         if not self.is_read:
@@ -76,10 +284,64 @@ class Message(models.Model):
             self.save()
 
 
+class ConversationArchive(models.Model):
+    """Compressed cold-storage file holding the messages of an idle conversation"""
+    
+    conversation = models.OneToOneField(Conversation, on_delete=models.CASCADE, related_name='archive')
+    path = models.CharField(max_length=255)  # Relative to MESSAGE_ARCHIVE_ROOT
+    first_message_id = models.BigIntegerField()
+    last_message_id = models.BigIntegerField()
+    message_count = models.PositiveIntegerField(default=0)
+    file_size = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Archive of conversation {self.conversation_id} ({self.message_count} messages)"
+
+
+@receiver(post_delete, sender=ConversationArchive)
+def delete_archive_file(sender, instance, **kwargs):
+    """Remove the file once the deletion (usually of its conversation) commits"""
+    from .archive import archive_root
+    
+    path = archive_root() / instance.path
+    transaction.on_commit(lambda: path.unlink(missing_ok=True))
+
+
+class ConversationReadState(models.Model):
+    """Per-participant read watermark for a conversation"""
+    
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='read_states')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversation_read_states')
+    last_read_message_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ['conversation', 'user']
+    
+    def __str__(self):
+        return f"{self.user.username} read up to {self.last_read_message_id} in conversation {self.conversation_id}"
+
+
+class AttachmentBlob(models.Model):
+    """Content-addressed attachment file - identical uploads share one blob"""
+    
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to='message_attachments/blobs/')
+    file_size = models.PositiveBigIntegerField()
+    content_type = models.CharField(max_length=100)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"Blob {self.sha256[:12]} ({self.file_size} bytes)"
+
+
 class MessageAttachment(models.Model):
     """File attachments for messages"""
     
     message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='attachments')
+    blob = models.ForeignKey(AttachmentBlob, on_delete=models.PROTECT, related_name='attachments', null=True, blank=True)
     file = models.FileField(upload_to='message_attachments/')
     filename = models.CharField(max_length=255)
     file_size = models.PositiveIntegerField()
@@ -103,4 +365,20 @@ class TypingIndicator(models.Model):
     
     def __str__(self):
         title = self.conversation.get_title()
-        return f"{self.user.username} typing in {title}"
\ No newline at end of file
+        return f"{self.user.username} typing in {title}"
+
+
+class PresenceConnection(models.Model):
+    """One open multiplexed socket; a user is online while any of theirs is fresh"""
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='presence_connections')
+    channel_name = models.CharField(max_length=255, unique=True)
+    last_seen = models.DateTimeField()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'last_seen'], name='presence_user_seen_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user.username} on {self.channel_name}"
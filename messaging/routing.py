@@ -3,4 +3,5 @@ from . import consumers
 
 websocket_urlpatterns = [
     re_path(r'ws/chat/(?P<conversation_id>\w+)/$', consumers.ChatConsumer.as_asgi()),
+    re_path(r'ws/v2/$', consumers.MultiplexConsumer.as_asgi()),
 ]
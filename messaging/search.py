@@ -0,0 +1,137 @@
+"""
+Full-text search over a user's message history.
+
+The index is maintained by the database on insert (see migration 0007):
+- SQLite: an FTS5 table kept in sync by triggers, with the conversation's
+  participants stored as tokens so the per-user scope is resolved inside the index
+- PostgreSQL: a generated ``tsvector`` column with a GIN index
+
+Other backends fall back to a plain ``icontains`` scan.
+
+Only hot messages are searchable: archiving a conversation (messaging/archive.py)
+deletes its rows, which drops them from the index too.
+"""
+import html
+import re
+
+from django.db import connection
+
+from .models import Message
+
+FTS_TABLE = 'messaging_message_fts'
+
+# Sentinels used for highlighting so the snippet can be HTML-escaped safely
+_MARK_START = '\x02'
+_MARK_END = '\x03'
+
+_TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def _terms(query):
+    """Split a search string into index terms"""
+    return _TERM_RE.findall(query.lower())[:10]
+
+
+def _highlight(snippet):
+    """Escape a snippet and turn the sentinels into <mark> tags"""
+    return html.escape(snippet).replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>')
+
+
+def _search_sqlite(user, terms, limit):
+    # Every term is a prefix match so results update as the user types
+    content_query = ' AND '.join(f'"{term}"*' for term in terms)
+    match = f'participants : "u{user.id}" AND content : ({content_query})'
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT f.rowid, f.conversation_id,
+                   snippet({FTS_TABLE}, 0, %s, %s, '…', 12)
+            FROM {FTS_TABLE} f
+            WHERE {FTS_TABLE} MATCH %s
+            ORDER BY f.rowid DESC
+            LIMIT %s
+            """,
+            [_MARK_START, _MARK_END, match, limit]
+        )
+        return cursor.fetchall()
+
+
+def _search_postgresql(user, terms, limit):
+    ts_query = ' & '.join(f'{term}:*' for term in terms)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT m.id, m.conversation_id,
+                   ts_headline('simple', m.content, q,
+                               'StartSel=' || %s || ', StopSel=' || %s || ', MaxWords=24, MinWords=8')
+            FROM messaging_message m
+            JOIN messaging_conversation_participants p ON p.conversation_id = m.conversation_id,
+                 to_tsquery('simple', %s) q
+            WHERE p.user_id = %s AND m.search_vector @@ q
+            ORDER BY m.id DESC
+            LIMIT %s
+            """,
+            [_MARK_START, _MARK_END, ts_query, user.id, limit]
+        )
+        return cursor.fetchall()
+
+
+def _search_fallback(user, terms, limit):
+    messages = Message.objects.filter(conversation__participants=user)
+    for term in terms:
+        messages = messages.filter(content__icontains=term)
+
+    rows = []
+    for message_id, conversation_id, content in messages.order_by('-id').values_list(
+        'id', 'conversation_id', 'content'
+    )[:limit]:
+        snippet = content[:120]
+        for term in terms:
+            snippet = re.sub(
+                f'({re.escape(term)})', f'{_MARK_START}\\1{_MARK_END}', snippet, flags=re.IGNORECASE
+            )
+        rows.append((message_id, conversation_id, snippet))
+    return rows
+
+
+def search_messages(user, query, limit=20):
+    """
+    Search the messages in conversations the user participates in.
+
+    Archived messages are not searched.
+
+    Returns a list of dicts with the message id, conversation id, sender,
+    timestamp and an HTML snippet with the matching terms wrapped in <mark>.
+    """
+    terms = _terms(query or '')
+    if not terms:
+        return []
+
+    if connection.vendor == 'sqlite':
+        rows = _search_sqlite(user, terms, limit)
+    elif connection.vendor == 'postgresql':
+        rows = _search_postgresql(user, terms, limit)
+    else:
+        rows = _search_fallback(user, terms, limit)
+
+    if not rows:
+        return []
+
+    messages = Message.objects.select_related('sender').in_bulk([row[0] for row in rows])
+
+    results = []
+    for message_id, conversation_id, snippet in rows:
+        message = messages.get(message_id)
+        if message is None:
+            continue
+        results.append({
+            'message_id': message_id,
+            'conversation_id': int(conversation_id),
+            'snippet': _highlight(snippet),
+            'sender': message.sender.username,
+            'timestamp': message.created_at.isoformat(),
+            'is_own': message.sender_id == user.id,
+        })
+    return results
@@ -1,3 +1,46 @@
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from accounts.models import User
+
+from .models import Conversation, ConversationReadState, Message
+
+
+class SendMessageTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='pw', phone_number='100')
+        self.bob = User.objects.create_user(username='bob', password='pw', phone_number='200')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.alice, self.bob)
+        self.client.force_login(self.alice)
+
+    def send(self, content):
+        return self.client.post(reverse('messaging:send_message', args=[self.conversation.id]), {'content': content})
+
+    def test_messages_get_consecutive_seqs(self):
+        first = self.send('hello')
+        second = self.send('again')
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual([first.json()['message']['seq'], second.json()['message']['seq']], [1, 2])
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.last_seq, 2)
+
+
+class ReadUpToTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='pw', phone_number='100')
+        self.bob = User.objects.create_user(username='bob', password='pw', phone_number='200')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.alice, self.bob)
+        self.client.force_login(self.bob)
+
+    def test_message_id_is_clamped_to_the_newest_message(self):
+        sent = Message.objects.create(conversation=self.conversation, sender=self.alice, content='hi')
+
+        response = self.client.post(reverse('messaging:read_up_to', args=[self.conversation.id]), {'message_id': 10 ** 9})
+
+        self.assertEqual(response.json()['up_to'], sent.id)
+        state = ConversationReadState.objects.get(conversation=self.conversation, user=self.bob)
+        self.assertEqual(state.last_read_message_id, sent.id)
@@ -10,7 +10,11 @@ urlpatterns = [
     path('start-offer/<int:offer_id>/', views.start_conversation_for_offer, name='start_conversation_for_offer'),
     path('send/<int:conversation_id>/', views.send_message, name='send_message'),
     path('messages/<int:conversation_id>/', views.get_messages, name='get_messages'),
+    path('read/<int:conversation_id>/', views.read_up_to, name='read_up_to'),
+    path('attachments/upload/<int:conversation_id>/', views.upload_attachment, name='upload_attachment'),
+    path('attachments/<int:attachment_id>/', views.download_attachment, name='download_attachment'),
     path('typing/<int:conversation_id>/', views.typing_indicator, name='typing_indicator'),
     path('typing-status/<int:conversation_id>/', views.get_typing_indicators, name='get_typing_indicators'),
     path('api/unread-count/', views.get_unread_message_count, name='unread_count'),
+    path('api/search/', views.search_messages, name='search_messages'),
 ]
@@ -4,18 +4,24 @@ from django.http import JsonResponse, HttpResponseForbidden
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 from django.utils import timezone
-from django.db.models import Q, Prefetch, Count
-from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import Q, Prefetch
+from django.urls import reverse
 import json
+import os
 
 from django.contrib.auth import get_user_model
 
 from .models import Conversation, Message, MessageAttachment, TypingIndicator
 from .forms import MessageForm
+from .attachments import AttachmentError, serve_attachment, store_stream
 from bids.models import Bid, BidAcceptance
 
 User = get_user_model()
 
+MESSAGES_PER_PAGE = 50
+MAX_MESSAGES_PER_PAGE = 200
+
 # Import Offer model if available
 try:
     from offers.models import Offer, OfferBid
@@ -74,17 +80,15 @@ def conversation_detail(request, conversation_id):
     )
     
     # Mark all messages as read
-    conversation.messages.exclude(
-        sender=request.user
-    ).filter(
-        is_read=False
-    ).update(is_read=True, read_at=timezone.now())
-    
-    # Get messages with pagination
-    messages = conversation.messages.select_related('sender').order_by('created_at')
-    paginator = Paginator(messages, 50)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    latest_id = conversation.messages.order_by('-id').values_list('id', flat=True).first()
+    if latest_id and conversation.mark_read_up_to(request.user, latest_id)[0]:
+        _broadcast_read_receipt(conversation, request.user, latest_id)
+    
+    # Latest messages, or older history with ?before=<id> (archived messages included)
+    messages, has_more = conversation.get_message_window(
+        before=_parse_message_id(request.GET.get('before')),
+        limit=MESSAGES_PER_PAGE
+    )
     
     # Get other participant
     other_participant = conversation.get_other_participant(request.user)
@@ -92,7 +96,8 @@ def conversation_detail(request, conversation_id):
     context = {
         'conversation': conversation,
         'other_participant': other_participant,
-        'messages': page_obj,
+        'messages': messages,
+        'has_more': has_more,
         'form': MessageForm(),
     }
     return render(request, 'messaging/conversation_detail.html', context)
@@ -146,41 +151,15 @@ def start_conversation(request, bid_id):
     if not other_participant or other_participant.id == request.user.id:
         return HttpResponseForbidden('Invalid conversation participant')
     
-    # Find or create a conversation between these two specific users for this bid
-    # Each conversation should have exactly 2 participants
-    # Filter conversations that have BOTH users as participants
-    conversations = Conversation.objects.filter(
-        bid=bid,
-        participants=request.user
-    ).filter(
-        participants=other_participant
-    ).annotate(
-        participant_count=Count('participants')
-    ).filter(
-        participant_count=2
+    # Find or create the 1-on-1 conversation between these two users for this bid
+    conversation, created = Conversation.get_or_create_for_pair(
+        request.user, other_participant, bid=bid
     )
     
-    # Get the first conversation that has exactly these 2 participants
-    conversation = None
-    for conv in conversations:
-        participants = list(conv.participants.all())
-        if len(participants) == 2 and request.user in participants and other_participant in participants:
-            conversation = conv
-            break
-    
-    if not conversation:
-        conversation = Conversation.objects.create(bid=bid, is_active=True)
-        conversation.participants.add(request.user, other_participant)
-    else:
+    if not created and not conversation.is_active:
         # Reactivate if it was inactive
-        if not conversation.is_active:
-            conversation.is_active = True
-            conversation.save()
-        # Ensure both participants are in the conversation
-        if request.user not in conversation.participants.all():
-            conversation.participants.add(request.user)
-        if other_participant not in conversation.participants.all():
-            conversation.participants.add(other_participant)
+        conversation.is_active = True
+        conversation.save(update_fields=['is_active', 'updated_at'])
     
     return redirect('messaging:conversation_detail', conversation_id=conversation.id)
 
@@ -237,41 +216,15 @@ def start_conversation_for_offer(request, offer_id):
     if not other_participant or other_participant.id == request.user.id:
         return HttpResponseForbidden('Invalid conversation participant')
     
-    # Find or create a conversation between these two specific users for this offer
-    # Each conversation should have exactly 2 participants
-    # Filter conversations that have BOTH users as participants
-    conversations = Conversation.objects.filter(
-        offer=offer,
-        participants=request.user
-    ).filter(
-        participants=other_participant
-    ).annotate(
-        participant_count=Count('participants')
-    ).filter(
-        participant_count=2
+    # Find or create the 1-on-1 conversation between these two users for this offer
+    conversation, created = Conversation.get_or_create_for_pair(
+        request.user, other_participant, offer=offer
     )
     
-    # Get the first conversation that has exactly these 2 participants
-    conversation = None
-    for conv in conversations:
-        participants = list(conv.participants.all())
-        if len(participants) == 2 and request.user in participants and other_participant in participants:
-            conversation = conv
-            break
-    
-    if not conversation:
-        conversation = Conversation.objects.create(offer=offer, is_active=True)
-        conversation.participants.add(request.user, other_participant)
-    else:
+    if not created and not conversation.is_active:
         # Reactivate if it was inactive
-        if not conversation.is_active:
-            conversation.is_active = True
-            conversation.save()
-        # Ensure both participants are in the conversation
-        if request.user not in conversation.participants.all():
-            conversation.participants.add(request.user)
-        if other_participant not in conversation.participants.all():
-            conversation.participants.add(other_participant)
+        conversation.is_active = True
+        conversation.save(update_fields=['is_active', 'updated_at'])
     
     return redirect('messaging:conversation_detail', conversation_id=conversation.id)
 
@@ -294,9 +247,8 @@ def send_message(request, conversation_id):
         message.sender = request.user
         message.save()
         
-        # Update conversation timestamp
-        conversation.updated_at = timezone.now()
-        conversation.save()
+        # Update conversation timestamp (only - last_seq was advanced by message.save())
+        conversation.save(update_fields=['updated_at'])
         
         # Send real-time notification (if available)
         try:
@@ -319,6 +271,7 @@ def send_message(request, conversation_id):
             'success': True,
             'message': {
                 'id': message.id,
+                'seq': message.seq,
                 'content': message.content,
                 'sender': request.user.username,
                 'timestamp': message.created_at.isoformat(),
@@ -330,10 +283,27 @@ def send_message(request, conversation_id):
     return JsonResponse({'error': 'Invalid message'}, status=400)
 
 
+def _parse_message_id(value):
+    """Parse a message id cursor from the query string"""
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
 @login_required
 @require_http_methods(["GET"])
 def get_messages(request, conversation_id):
-    """Get messages for a conversation (AJAX)"""
+    """
+    Get messages for a conversation (AJAX)
+    
+    Supports cursor-based sync keyed on message id:
+    ``?after=<id>`` returns only messages newer than ``id`` and
+    ``?before=<id>&limit=<n>`` pages history backwards. ``?page=`` is kept for
+    older clients.
+    """
     conversation = get_object_or_404(
         Conversation,
         id=conversation_id,
@@ -341,33 +311,167 @@ def get_messages(request, conversation_id):
         is_active=True
     )
     
-    # Get messages
-    messages = conversation.messages.select_related('sender').order_by('created_at')
-    
-    # Pagination
-    page = int(request.GET.get('page', 1))
-    per_page = 50
-    start = (page - 1) * per_page
-    end = start + per_page
-    
-    messages_data = []
-    for message in messages[start:end]:
-        messages_data.append({
-            'id': message.id,
-            'content': message.content,
-            'sender': message.sender.username,
-            'sender_name': f"{message.sender.first_name} {message.sender.last_name}",
-            'timestamp': message.created_at.isoformat(),
-            'is_read': message.is_read,
-            'is_own': message.sender == request.user
-        })
+    try:
+        limit = int(request.GET.get('limit', MESSAGES_PER_PAGE))
+    except (TypeError, ValueError):
+        limit = MESSAGES_PER_PAGE
+    limit = max(1, min(limit, MAX_MESSAGES_PER_PAGE))
+    
+    after = _parse_message_id(request.GET.get('after'))
+    before = _parse_message_id(request.GET.get('before'))
+    
+    if after is not None or before is not None:
+        messages, has_more = conversation.get_message_window(after=after, before=before, limit=limit)
+    else:
+        # Legacy page offset, oldest first - walk the id cursor so archived messages count too
+        try:
+            page = max(1, int(request.GET.get('page', 1)))
+        except (TypeError, ValueError):
+            page = 1
+        messages, has_more = conversation.get_message_window(after=0, limit=limit)
+        for _ in range(page - 1):
+            if not has_more:
+                messages = []
+                break
+            messages, has_more = conversation.get_message_window(after=messages[-1].id, limit=limit)
+    
+    messages_data = [message.to_dict(request.user) for message in messages]
     
     return JsonResponse({
         'messages': messages_data,
-        'has_more': len(messages) > end
+        'has_more': has_more,
+        'first_id': messages_data[0]['id'] if messages_data else None,
+        'last_id': messages_data[-1]['id'] if messages_data else None,
+    })
+
+
+@login_required
+@require_http_methods(["POST"])
+def read_up_to(request, conversation_id):
+    """Mark every message up to a message id as read with a single update"""
+    conversation = get_object_or_404(
+        Conversation,
+        id=conversation_id,
+        participants=request.user,
+        is_active=True
+    )
+    
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body)
+        except json.JSONDecodeError:
+            return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    else:
+        data = request.POST
+    
+    message_id = _parse_message_id(data.get('message_id'))
+    if not message_id:
+        return JsonResponse({'error': 'message_id is required'}, status=400)
+    
+    updated, message_id = conversation.mark_read_up_to(request.user, message_id)
+    if updated:
+        _broadcast_read_receipt(conversation, request.user, message_id)
+    
+    return JsonResponse({'success': True, 'updated': updated, 'up_to': message_id})
+
+
+def _group_send(conversation, event):
+    """Send an event to the conversation's WebSocket group (best effort)"""
+    try:
+        from channels.layers import get_channel_layer
+        from asgiref.sync import async_to_sync
+        
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            return
+        event.setdefault('conversation_id', conversation.id)
+        async_to_sync(channel_layer.group_send)(f'chat_{conversation.id}', event)
+    except Exception as e:
+        print(f"Chat broadcast failed: {e}")
+
+
+def _broadcast_read_receipt(conversation, user, message_id):
+    """Send a single range read receipt to the conversation group"""
+    _group_send(conversation, {
+        'type': 'read_receipt',
+        'user': user.username,
+        'up_to': message_id,
     })
 
 
+@login_required
+@require_http_methods(["POST"])
+def upload_attachment(request, conversation_id):
+    """
+    Upload an attachment as the raw request body.
+    
+    The body is streamed to disk in chunks while it is hashed, so large files
+    never sit in memory. Pass ``?filename=`` and optionally ``?content=`` for
+    the message text.
+    """
+    conversation = get_object_or_404(
+        Conversation,
+        id=conversation_id,
+        participants=request.user,
+        is_active=True
+    )
+    
+    filename = os.path.basename(request.GET.get('filename', '') or request.META.get('HTTP_X_FILENAME', ''))[:255]
+    if not filename:
+        return JsonResponse({'error': 'filename is required'}, status=400)
+    
+    try:
+        blob, created = store_stream(request, request.META.get('CONTENT_TYPE', ''))
+    except AttachmentError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    content = request.GET.get('content', '').strip()[:2000] or filename
+    # The message only exists together with its attachment
+    with transaction.atomic():
+        message = Message.objects.create(conversation=conversation, sender=request.user, content=content)
+        attachment = MessageAttachment.objects.create(
+            message=message,
+            blob=blob,
+            file=blob.file.name,
+            filename=filename,
+            file_size=blob.file_size,
+            content_type=blob.content_type
+        )
+        
+        conversation.updated_at = timezone.now()
+        conversation.save(update_fields=['updated_at'])
+    
+    attachment_data = {
+        'id': attachment.id,
+        'filename': attachment.filename,
+        'file_size': attachment.file_size,
+        'content_type': attachment.content_type,
+        'url': reverse('messaging:download_attachment', args=[attachment.id]),
+        'deduplicated': not created,
+    }
+    message_data = message.to_dict(request.user)
+    message_data['attachments'] = [attachment_data]
+    
+    # Peers only hear about the message once it is committed
+    transaction.on_commit(
+        lambda: _group_send(conversation, {'type': 'chat_message', 'message': dict(message_data, is_own=False)})
+    )
+    
+    return JsonResponse({'success': True, 'message': message_data})
+
+
+@login_required
+@require_http_methods(["GET", "HEAD"])
+def download_attachment(request, attachment_id):
+    """Serve an attachment to a conversation participant (supports Range requests)"""
+    attachment = get_object_or_404(
+        MessageAttachment.objects.select_related('blob'),
+        id=attachment_id,
+        message__conversation__participants=request.user
+    )
+    return serve_attachment(request, attachment)
+
+
 @login_required
 @require_http_methods(["POST"])
 @csrf_exempt
@@ -425,6 +529,22 @@ def get_typing_indicators(request, conversation_id):
     return JsonResponse({'typing_users': typing_users})
 
 
+@login_required
+@require_http_methods(["GET"])
+def search_messages(request):
+    """Search the current user's message history (AJAX)"""
+    from .search import search_messages as run_search
+    
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 20)), 50))
+    except (TypeError, ValueError):
+        limit = 20
+    
+    results = run_search(request.user, query, limit=limit) if query else []
+    return JsonResponse({'query': query, 'results': results})
+
+
 @login_required
 def get_unread_message_count(request):
     """Return total unread messages for the current user"""
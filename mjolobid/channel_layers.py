@@ -0,0 +1,336 @@
+"""
+Broker-less channel layer for running several ASGI worker processes on one host.
+
+Each process listens on a Unix domain socket in a shared directory (under
+/dev/shm when available). Channel names created by ``new_channel()`` embed the
+owning process id, so a send to another process's channel is forwarded over
+that process's socket and queued there, with the same capacity and expiry
+rules as ``InMemoryChannelLayer``. Group membership is kept as one file per
+(group, channel) in the shared directory; ``group_send`` batches the fan-out
+into a single frame per destination process.
+
+Channels without a process part (``!``) are process-local, as with the
+in-memory layer.
+
+Only ``receive()`` and ``new_channel()`` start the process's server; callers
+that only send (e.g. ``async_to_sync(layer.group_send)`` from a view) just
+connect to their peers. Connections, and the server, belong to the event loop
+that opened them and are closed when that loop shuts down, so the short-lived
+loops of ``async_to_sync`` leave nothing behind.
+"""
+import asyncio
+import os
+import random
+import string
+import struct
+import tempfile
+import time
+from pathlib import Path
+
+import msgpack
+from channels.exceptions import ChannelFull
+from channels.layers import InMemoryChannelLayer
+
+_FRAME_HEADER = struct.Struct('>I')
+
+FORWARD_TIMEOUT = 5  # seconds to wait for a peer to queue a forwarded message
+
+STATUS_OK = b'\x00'
+STATUS_FULL = b'\x01'
+
+
+def _default_path():
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(base, 'mjolobid-channels')
+
+
+async def _read_frame(reader):
+    header = await reader.readexactly(_FRAME_HEADER.size)
+    (length,) = _FRAME_HEADER.unpack(header)
+    return msgpack.unpackb(await reader.readexactly(length), raw=False)
+
+
+def _encode_frame(payload):
+    data = msgpack.packb(payload, use_bin_type=True)
+    return _FRAME_HEADER.pack(len(data)) + data
+
+
+class _LoopResources:
+    """Peer connections, and possibly the server, opened on one event loop"""
+
+    def __init__(self):
+        self.peers = {}  # process id -> (reader, writer, lock)
+        self.server = None
+        self.watcher = None
+
+
+class LocalSocketChannelLayer(InMemoryChannelLayer):
+    """Channel layer shared by the processes of one host over Unix domain sockets"""
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, path=None, expiry=60, group_expiry=86400, capacity=100, channel_capacity=None,
+                 forward_timeout=FORWARD_TIMEOUT, **kwargs):
+        super().__init__(
+            expiry=expiry,
+            group_expiry=group_expiry,
+            capacity=capacity,
+            channel_capacity=channel_capacity,
+            **kwargs,
+        )
+        self.path = Path(path or _default_path())
+        self.groups_path = self.path / 'groups'
+        self.forward_timeout = forward_timeout
+        self.process_id = f"{os.getpid()}x{''.join(random.choice(string.ascii_letters) for _ in range(8))}"
+        self._server = None
+        self._server_loop = None
+        self._loops = {}  # event loop -> _LoopResources
+
+    # Process-to-process transport
+
+    def _socket_path(self, process_id):
+        return self.path / f'{process_id}.sock'
+
+    def _loop_resources(self):
+        """This event loop's resources, registering a watcher that closes them when the loop ends"""
+        loop = asyncio.get_running_loop()
+        resources = self._loops.get(loop)
+        if resources is None:
+            resources = self._loops[loop] = _LoopResources()
+            resources.watcher = loop.create_task(self._close_when_loop_ends(loop, resources))
+        return resources
+
+    async def _close_when_loop_ends(self, loop, resources):
+        # asyncio.run() (and so async_to_sync) cancels pending tasks on shutdown
+        try:
+            await loop.create_future()
+        finally:
+            await self._close_resources(loop, resources)
+
+    async def _close_resources(self, loop, resources):
+        if self._loops.get(loop) is resources:
+            del self._loops[loop]
+        peers, resources.peers = resources.peers, {}
+        for _, writer, _ in peers.values():
+            writer.close()
+        if resources.server is not None:
+            resources.server.close()
+            if self._server is resources.server:
+                self._server = None
+                try:
+                    self._socket_path(self.process_id).unlink()
+                except FileNotFoundError:
+                    pass
+            resources.server = None
+        for _, writer, _ in peers.values():
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, asyncio.CancelledError):
+                pass
+
+    async def _ensure_server(self):
+        """Listen for messages forwarded to this process's channels"""
+        if self._server is not None and not self._server_loop.is_closed():
+            return
+
+        resources = self._loop_resources()
+        self.groups_path.mkdir(mode=0o700, parents=True, exist_ok=True)
+        socket_path = self._socket_path(self.process_id)
+        if socket_path.exists():
+            socket_path.unlink()
+        self._server = resources.server = await asyncio.start_unix_server(self._handle_peer, path=str(socket_path))
+        os.chmod(socket_path, 0o600)
+        self._server_loop = asyncio.get_running_loop()
+
+    async def _handle_peer(self, reader, writer):
+        """Queue frames forwarded by other processes onto our local channels"""
+        try:
+            while True:
+                frame = await _read_frame(reader)
+                status = STATUS_OK
+                for channel in frame['channels']:
+                    try:
+                        await InMemoryChannelLayer.send(self, channel, frame['message'])
+                    except ChannelFull:
+                        status = STATUS_FULL
+                writer.write(status)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            # Peer went away, or our loop is shutting down
+            pass
+        finally:
+            writer.close()
+
+    def _owner(self, channel):
+        """Process id that owns a specific channel, or None for process-local names"""
+        if '!' not in channel:
+            return None
+        return channel[:channel.index('!')].rsplit('.', 1)[-1]
+
+    async def _forward(self, process_id, channels, message):
+        """
+        Send a message to channels owned by another process.
+
+        Returns False if any destination channel was full, or the peer
+        didn't answer within ``forward_timeout``. Messages for processes that
+        have gone away are dropped, like expired messages.
+        """
+        peers = self._loop_resources().peers
+        try:
+            return await asyncio.wait_for(self._forward_frame(peers, process_id, channels, message),
+                                          self.forward_timeout)
+        except asyncio.TimeoutError:
+            # The reply may still arrive later, so the connection can't be reused
+            self._drop_peer(peers, process_id)
+            return False
+        except (FileNotFoundError, ConnectionError, asyncio.IncompleteReadError):
+            self._drop_peer(peers, process_id)
+            for channel in channels:
+                self._remove_from_groups(channel)
+            return True
+
+    async def _forward_frame(self, peers, process_id, channels, message):
+        peer = peers.get(process_id)
+        if peer is None:
+            reader, writer = await asyncio.open_unix_connection(str(self._socket_path(process_id)))
+            peer = peers[process_id] = (reader, writer, asyncio.Lock())
+        reader, writer, lock = peer
+        async with lock:
+            writer.write(_encode_frame({'channels': channels, 'message': message}))
+            await writer.drain()
+            status = await reader.readexactly(1)
+        return status == STATUS_OK
+
+    def _drop_peer(self, peers, process_id):
+        peer = peers.pop(process_id, None)
+        if peer is not None:
+            peer[1].close()
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        """Send a message onto a channel, forwarding it if another process owns it"""
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_channel_name(channel)
+
+        owner = self._owner(channel)
+        if owner is None or owner == self.process_id:
+            return await super().send(channel, message)
+
+        if not await self._forward(owner, [channel], message):
+            raise ChannelFull(channel)
+
+    async def receive(self, channel):
+        """Receive the first message that arrives on one of our channels"""
+        await self._ensure_server()
+        return await super().receive(channel)
+
+    async def new_channel(self, prefix='specific.'):
+        """Returns a new channel name owned by this process"""
+        await self._ensure_server()
+        return '%s.%s!%s' % (
+            prefix,
+            self.process_id,
+            ''.join(random.choice(string.ascii_letters) for _ in range(12)),
+        )
+
+    # Groups extension
+
+    def _remove_from_groups(self, channel):
+        """Removes a channel from all groups. Used when a message on it expires."""
+        if not self.groups_path.exists():
+            return
+        for group in os.listdir(self.groups_path):
+            try:
+                os.unlink(self.groups_path / group / channel)
+            except FileNotFoundError:
+                pass
+
+    async def group_add(self, group, channel):
+        """Adds the channel name to a group"""
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        member = self.groups_path / group / channel
+        for _ in range(3):
+            member.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+            try:
+                member.touch()
+                # Re-joining refreshes the membership for group_expiry
+                os.utime(member)
+                return
+            except FileNotFoundError:
+                # The group directory was removed by a concurrent discard
+                continue
+
+    async def group_discard(self, group, channel):
+        """Removes the channel name from a group"""
+        self.require_valid_channel_name(channel)
+        self.require_valid_group_name(group)
+        group_path = self.groups_path / group
+        try:
+            os.unlink(group_path / channel)
+            os.rmdir(group_path)
+        except (FileNotFoundError, OSError):
+            pass
+
+    async def group_send(self, group, message):
+        """Sends a message to every channel in the group, one frame per destination process"""
+        assert isinstance(message, dict), 'Message is not a dict'
+        self.require_valid_group_name(group)
+        self._clean_expired()
+
+        group_path = self.groups_path / group
+        try:
+            members = os.listdir(group_path)
+        except FileNotFoundError:
+            return
+
+        timeout = time.time() - self.group_expiry
+        by_process = {}
+        for channel in members:
+            try:
+                if os.stat(group_path / channel).st_mtime < timeout:
+                    os.unlink(group_path / channel)
+                    continue
+            except FileNotFoundError:
+                continue
+            by_process.setdefault(self._owner(channel) or self.process_id, []).append(channel)
+
+        ops = []
+        for process_id, channels in by_process.items():
+            if process_id == self.process_id:
+                for channel in channels:
+                    ops.append(super().send(channel, message))
+            else:
+                ops.append(self._forward(process_id, channels, message))
+
+        for result in await asyncio.gather(*ops, return_exceptions=True):
+            # Full channels in a group are skipped, as with the other layers
+            if isinstance(result, Exception) and not isinstance(result, ChannelFull):
+                raise result
+
+    # Flush extension
+
+    async def flush(self):
+        """Drop local messages and every group membership"""
+        await super().flush()
+        if self.groups_path.exists():
+            for group in os.listdir(self.groups_path):
+                group_path = self.groups_path / group
+                for channel in os.listdir(group_path):
+                    try:
+                        os.unlink(group_path / channel)
+                    except FileNotFoundError:
+                        pass
+                try:
+                    os.rmdir(group_path)
+                except OSError:
+                    pass
+
+    async def close(self):
+        """Close this event loop's connections, and stop listening if the server runs on it"""
+        loop = asyncio.get_running_loop()
+        resources = self._loops.get(loop)
+        if resources is not None:
+            await self._close_resources(loop, resources)
+            resources.watcher.cancel()
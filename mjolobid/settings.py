@@ -34,6 +34,7 @@ INSTALLED_APPS = [
     'payments',
     'notifications',
     'messaging',
+    'maintenance',
     'admin_dashboard',
 ]
 
@@ -47,6 +48,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'notifications.middleware.ScheduledNotificationMiddleware',
 ]
 
 ROOT_URLCONF = 'mjolobid.urls'
@@ -134,18 +136,56 @@ CORS_ALLOWED_ORIGINS = [
 ]
 
 # Channels configuration
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels_redis.core.RedisChannelLayer',
-        'CONFIG': {
-            "hosts": [('127.0.0.1', 6379)],
+# Worker processes on one host share the Unix-socket layer; set
+# USE_REDIS_CHANNEL_LAYER when running across several hosts
+if config('USE_REDIS_CHANNEL_LAYER', default=False, cast=bool):
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                "hosts": [('127.0.0.1', 6379)],
+            },
         },
-    },
-}
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'mjolobid.channel_layers.LocalSocketChannelLayer',
+            'CONFIG': {
+                'path': config('CHANNEL_LAYER_PATH', default='') or None,
+            },
+        },
+    }
+
+# Chat message inserts are group-committed every CHAT_WRITE_BATCH_INTERVAL seconds
+CHAT_WRITE_BATCH_INTERVAL = 0.005
+CHAT_WRITE_BATCH_SIZE = 200
 
 # Redis configuration
 REDIS_URL = config('REDIS_URL', default='redis://127.0.0.1:6379/1')
 
+# Cache shared by every worker process (notification preferences, unread
+# counters, presence, gateway tokens). The default keeps it in a database
+# table created by `manage.py createcachetable`; set USE_REDIS_CACHE to keep
+# it in Redis instead
+if config('USE_REDIS_CACHE', default=False, cast=bool):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'django_cache',
+            'OPTIONS': {
+                'MAX_ENTRIES': 100000,
+            },
+        },
+    }
+
 # Celery configuration
 CELERY_BROKER_URL = REDIS_URL
 CELERY_RESULT_BACKEND = REDIS_URL
@@ -162,6 +202,13 @@ MJOLOBID_SETTINGS = {
     'MAX_BID_AMOUNT': 500.00,  # Maximum bid amount
 }
 
+# Message attachments
+MESSAGE_ATTACHMENT_MAX_SIZE = 10 * 1024 * 1024  # 10MB
+# Set to 'X-Sendfile' (Apache) or 'X-Accel-Redirect' (nginx) to let the front-end server send files
+MESSAGE_ATTACHMENT_SENDFILE_HEADER = config('MESSAGE_ATTACHMENT_SENDFILE_HEADER', default='')
+# Compressed archives of idle conversations (see archive_conversations command)
+MESSAGE_ARCHIVE_ROOT = config('MESSAGE_ARCHIVE_ROOT', default=str(BASE_DIR / 'message_archive'))
+
 # Email configuration - SendGrid SMTP (recommended)
 # NOTE: Put your actual API key in the SENDGRID_API_KEY environment variable (both locally and on Render).
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
@@ -198,10 +245,36 @@ PESEPAY_SANDBOX = config('PESEPAY_SANDBOX', default=False, cast=bool)
 # Default payment gateway
 DEFAULT_PAYMENT_GATEWAY = config('DEFAULT_PAYMENT_GATEWAY', default='ECOCASH')
 
+# Gateway HTTP transport (see payments/gateways/transport.py)
+PAYMENT_GATEWAY_CONNECT_TIMEOUT = 5  # seconds
+PAYMENT_GATEWAY_READ_TIMEOUT = 30
+PAYMENT_GATEWAY_RETRIES = 2  # extra attempts; payment submissions only retry if never sent
+PAYMENT_GATEWAY_BREAKER_THRESHOLD = 5  # consecutive failures before failing fast
+PAYMENT_GATEWAY_BREAKER_RESET = 30  # seconds before trying a failing gateway again
+PAYMENT_GATEWAY_SLOW_SECONDS = 5  # gateway requests slower than this are logged
+PAYMENT_WEBHOOK_MAX_ATTEMPTS = 8  # stored webhooks that keep failing are marked FAILED after this
+PAYMENT_WEBHOOK_BACKOFF = 15  # seconds before retrying a webhook, doubled each time
+
+# Notification delivery queue (see run_notification_workers)
+NOTIFICATION_JOB_MAX_ATTEMPTS = 5
+NOTIFICATION_JOB_BACKOFF = 30  # seconds before the first retry, doubled each time
+NOTIFICATION_JOB_MAX_BACKOFF = 3600
+NOTIFICATION_COALESCE_WINDOW = 300  # seconds; repeats within it update one notification
+NOTIFICATION_COALESCE_TYPES = ['NEW_MESSAGE']
+NOTIFICATION_DIGEST_INTERVAL = 3600  # seconds between email digests for users who opt in
+NOTIFICATION_RETENTION_DAYS = 90  # read notifications older than this are removed by prune_notifications
+NOTIFICATION_LOG_SAMPLE_RATE = config('NOTIFICATION_LOG_SAMPLE_RATE', default=0.01, cast=float)  # share of routine delivery events logged
+NOTIFICATION_SLOW_SECONDS = 5  # provider requests slower than this are always logged
+NOTIFICATION_EVENT_REMINDER_HOURS = 24  # event reminders go out this long before a bid's or offer's event
+NOTIFICATION_PREMIUM_EXPIRY_DAYS = 3  # expiry notices go out this long before premium or a subscription ends
+METRICS_TOKEN = config('METRICS_TOKEN', default='')  # bearer token for scraping /metrics
+NOTIFICATION_ARCHIVE_ROOT = config('NOTIFICATION_ARCHIVE_ROOT', default=str(BASE_DIR / 'notification_archive'))
+
 # Web push (VAPID) settings
 WEBPUSH_VAPID_PUBLIC_KEY = config('WEBPUSH_VAPID_PUBLIC_KEY', default='')
 WEBPUSH_VAPID_PRIVATE_KEY = config('WEBPUSH_VAPID_PRIVATE_KEY', default='')
 WEBPUSH_VAPID_CONTACT_EMAIL = config('WEBPUSH_VAPID_CONTACT_EMAIL', default='support@mjolobid.com')
+WEBPUSH_MAX_WORKERS = config('WEBPUSH_MAX_WORKERS', default=8, cast=int)  # concurrent push service requests per process
 
 # Logging
 LOGGING = {
@@ -33,6 +33,7 @@ INSTALLED_APPS = [
     'payments',
     'notifications',
     'messaging',
+    'maintenance',
     'admin_dashboard',
 ]
 
@@ -46,6 +47,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'notifications.middleware.ScheduledNotificationMiddleware',
 ]
 
 ROOT_URLCONF = 'mjolobid.urls'
@@ -129,6 +131,29 @@ else:
     MEDIA_URL = '/media/'
     MEDIA_ROOT = os.environ.get('MEDIA_ROOT', os.path.join(BASE_DIR, 'media'))
 
+# Message archives live on the persistent disk next to the database
+MESSAGE_ARCHIVE_ROOT = os.environ.get('MESSAGE_ARCHIVE_ROOT', '/var/disk1/message_archive')
+NOTIFICATION_ARCHIVE_ROOT = os.environ.get('NOTIFICATION_ARCHIVE_ROOT', '/var/disk1/notification_archive')
+
+# No Redis on Render - the web workers share a Unix-socket channel layer
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'mjolobid.channel_layers.LocalSocketChannelLayer',
+    },
+}
+
+# Cache shared by the web workers and background commands, in a table
+# created by `manage.py createcachetable`
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'django_cache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    },
+}
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -212,6 +237,10 @@ MJOLOBID_SETTINGS = {
 WEBPUSH_VAPID_PUBLIC_KEY = config('WEBPUSH_VAPID_PUBLIC_KEY', default='')
 WEBPUSH_VAPID_PRIVATE_KEY = config('WEBPUSH_VAPID_PRIVATE_KEY', default='')
 WEBPUSH_VAPID_CONTACT_EMAIL = config('WEBPUSH_VAPID_CONTACT_EMAIL', default='support@mjolobid.com')
+WEBPUSH_MAX_WORKERS = config('WEBPUSH_MAX_WORKERS', default=8, cast=int)  # concurrent push service requests per process
+
+# Bearer token Prometheus uses to scrape /metrics
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
 
 # Logging
 LOGGING = {
@@ -0,0 +1,173 @@
+import asyncio
+import gc
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+import warnings
+
+from asgiref.sync import async_to_sync
+from channels.exceptions import ChannelFull
+from django.test import SimpleTestCase
+
+from .channel_layers import LocalSocketChannelLayer
+
+
+class LocalSocketChannelLayerTests(SimpleTestCase):
+    """The channel layer contract (as tested for InMemoryChannelLayer), within and across processes"""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.layer = self.make_layer(capacity=3, expiry=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def make_layer(self, **kwargs):
+        # Layers sharing a path behave like the layers of separate processes
+        return LocalSocketChannelLayer(path=self.path, **kwargs)
+
+    async def assertNothingReceived(self, layer, channel):
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(layer.receive(channel), 0.2)
+
+    async def test_send_receive(self):
+        await self.layer.send('test-channel-1', {'type': 'test.message', 'text': 'Ahoy-hoy!'})
+        message = await self.layer.receive('test-channel-1')
+        self.assertEqual(message, {'type': 'test.message', 'text': 'Ahoy-hoy!'})
+
+    async def test_send_capacity(self):
+        channel = await self.layer.new_channel()
+        for i in range(3):
+            await self.layer.send(channel, {'type': 'test.message', 'i': i})
+        with self.assertRaises(ChannelFull):
+            await self.layer.send(channel, {'type': 'test.message'})
+        for i in range(3):
+            self.assertEqual((await self.layer.receive(channel))['i'], i)
+
+    async def test_process_local_send_receive(self):
+        channel = await self.layer.new_channel()
+        self.assertIn(self.layer.process_id, channel)
+        await self.layer.send(channel, {'type': 'test.message', 'text': 'Local only'})
+        self.assertEqual((await self.layer.receive(channel))['text'], 'Local only')
+
+    async def test_groups(self):
+        channels = [await self.layer.new_channel() for _ in range(3)]
+        for channel in channels:
+            await self.layer.group_add('test-group', channel)
+        await self.layer.group_discard('test-group', channels[1])
+        await self.layer.group_send('test-group', {'type': 'message.1'})
+
+        self.assertEqual((await self.layer.receive(channels[0]))['type'], 'message.1')
+        self.assertEqual((await self.layer.receive(channels[2]))['type'], 'message.1')
+        await self.assertNothingReceived(self.layer, channels[1])
+
+    async def test_group_send_skips_full_channels(self):
+        full, other = await self.layer.new_channel(), await self.layer.new_channel()
+        for channel in (full, other):
+            await self.layer.group_add('test-group', channel)
+        for i in range(3):
+            await self.layer.send(full, {'type': 'filler'})
+        await self.layer.group_send('test-group', {'type': 'message.1'})
+        self.assertEqual((await self.layer.receive(other))['type'], 'message.1')
+
+    async def test_expiry(self):
+        await self.layer.send('test-channel-1', {'type': 'test.message'})
+        await asyncio.sleep(1.1)
+        await self.assertNothingReceived(self.layer, 'test-channel-1')
+
+    async def test_group_expiry(self):
+        channel = await self.layer.new_channel()
+        await self.layer.group_add('test-group', channel)
+        stale = time.time() - self.layer.group_expiry - 1
+        os.utime(self.layer.groups_path / 'test-group' / channel, (stale, stale))
+        await self.layer.group_send('test-group', {'type': 'message.1'})
+        await self.assertNothingReceived(self.layer, channel)
+
+    async def test_flush(self):
+        channel = await self.layer.new_channel()
+        await self.layer.group_add('test-group', channel)
+        await self.layer.send(channel, {'type': 'test.message'})
+        await self.layer.flush()
+        await self.assertNothingReceived(self.layer, channel)
+        await self.layer.group_send('test-group', {'type': 'message.1'})
+        await self.assertNothingReceived(self.layer, channel)
+
+    async def test_forward_to_other_process(self):
+        other = self.make_layer()
+        channels = [await other.new_channel() for _ in range(2)]
+        for channel in channels:
+            await self.layer.group_add('test-group', channel)
+
+        await self.layer.send(channels[0], {'type': 'direct', 'data': b'\x00binary'})
+        await self.layer.group_send('test-group', {'type': 'message.1'})
+
+        self.assertEqual(await other.receive(channels[0]), {'type': 'direct', 'data': b'\x00binary'})
+        for channel in channels:
+            self.assertEqual((await other.receive(channel))['type'], 'message.1')
+        await other.close()
+
+    async def test_forward_capacity(self):
+        other = self.make_layer(capacity=1)
+        channel = await other.new_channel()
+        await self.layer.send(channel, {'type': 'test.message'})
+        with self.assertRaises(ChannelFull):
+            await self.layer.send(channel, {'type': 'test.message'})
+        await other.close()
+
+    async def test_gone_process_leaves_groups(self):
+        other = self.make_layer()
+        channel = await other.new_channel()
+        await self.layer.group_add('test-group', channel)
+        await other.close()
+
+        await self.layer.group_send('test-group', {'type': 'message.1'})
+        self.assertFalse((self.layer.groups_path / 'test-group' / channel).exists())
+
+    async def test_forward_timeout(self):
+        async def never_answer(reader, writer):
+            try:
+                await reader.read()
+            except asyncio.CancelledError:
+                pass
+            writer.close()
+
+        layer = self.make_layer(forward_timeout=0.2)
+        os.makedirs(self.path, exist_ok=True)
+        server = await asyncio.start_unix_server(never_answer, path=os.path.join(self.path, '1xstuck.sock'))
+        with self.assertRaises(ChannelFull):
+            await layer.send('specific.1xstuck!abc', {'type': 'test.message'})
+        server.close()
+        await layer.close()
+
+    def test_send_only_callers_start_no_server(self):
+        received = queue.Queue()
+        ready = threading.Event()
+
+        async def serve(layer):
+            channel = await layer.new_channel()
+            await layer.group_add('test-group', channel)
+            ready.set()
+            for _ in range(3):
+                received.put(await layer.receive(channel))
+            await layer.close()
+
+        receiver = threading.Thread(target=asyncio.run, args=(serve(self.make_layer()),))
+        receiver.start()
+        self.assertTrue(ready.wait(5))
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always', ResourceWarning)
+            for i in range(3):
+                # Each call runs on a new event loop
+                async_to_sync(self.layer.group_send)('test-group', {'type': 'message.1', 'i': i})
+            receiver.join(5)
+            gc.collect()
+
+        self.assertEqual([received.get(timeout=1)['i'] for _ in range(3)], [0, 1, 2])
+        self.assertIsNone(self.layer._server)
+        self.assertEqual(self.layer._loops, {})
+        self.assertEqual([f for f in os.listdir(self.path) if f.endswith('.sock')], [])
+        self.assertEqual([w for w in caught if issubclass(w.category, ResourceWarning)], [])
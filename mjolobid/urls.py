@@ -8,6 +8,7 @@ from django.conf.urls.static import static
 from django.http import JsonResponse
 from django.views.generic import TemplateView
 from accounts.views import home
+from notifications.views import metrics
 
 def health_check(request):
     try:
@@ -26,6 +27,7 @@ def health_check(request):
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('health/', health_check, name='health_check'),
+    path('metrics', metrics, name='metrics'),
     path('service-worker.js', TemplateView.as_view(template_name='serviceworker.js', content_type='application/javascript'), name='service_worker'),
     path('bids/', include('bids.urls')),
     path('offers/', include('offers.urls')),
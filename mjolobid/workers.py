@@ -0,0 +1,59 @@
+"""
+Heartbeats for the background commands (notification workers, scheduler,
+payment webhook processor).
+
+A running command touches a file named after it every few seconds. Web
+processes call ``is_running`` to decide whether to do that command's work
+inline instead, e.g. on a host whose entrypoint didn't start it or while it
+is restarting. The files are on local disk (under /dev/shm when available),
+so only commands on the same host count.
+"""
+import os
+import tempfile
+import time
+
+from django.conf import settings
+
+HEARTBEAT_INTERVAL = 5  # seconds between touches
+HEARTBEAT_TIMEOUT = 30  # a command whose file is older than this is treated as stopped
+
+
+def _heartbeat_path(name):
+    base = getattr(settings, 'WORKER_HEARTBEAT_DIR', None)
+    if not base:
+        base = os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'mjolobid-workers')
+    return os.path.join(base, name)
+
+
+class Heartbeat:
+    """Marks a command as running while it calls ``beat()`` regularly"""
+
+    def __init__(self, name):
+        self.path = _heartbeat_path(name)
+        self.last_beat = 0
+
+    def beat(self):
+        """Touch the heartbeat file, at most every HEARTBEAT_INTERVAL seconds"""
+        now = time.monotonic()
+        if now - self.last_beat < HEARTBEAT_INTERVAL:
+            return
+        os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+        with open(self.path, 'a'):
+            pass
+        os.utime(self.path)
+        self.last_beat = now
+
+    def stop(self):
+        """Remove the file so web processes take over right away"""
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def is_running(name):
+    """True if the named command touched its heartbeat within HEARTBEAT_TIMEOUT seconds"""
+    try:
+        return time.time() - os.stat(_heartbeat_path(name)).st_mtime < HEARTBEAT_TIMEOUT
+    except FileNotFoundError:
+        return False
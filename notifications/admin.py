@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Notification, NotificationSettings, WebPushSubscription
+from .models import Notification, NotificationJob, NotificationSettings, ScheduledNotification, WebPushSubscription
 
 
 @admin.register(Notification)
@@ -18,7 +18,7 @@ class NotificationAdmin(admin.ModelAdmin):
             'fields': ('related_object_type', 'related_object_id')
         }),
         ('Status', {
-            'fields': ('is_read', 'is_sent', 'read_at')
+            'fields': ('is_read', 'is_sent', 'count', 'read_at')
         }),
         ('Timestamps', {
             'fields': ('created_at',)
@@ -29,9 +29,10 @@ class NotificationAdmin(admin.ModelAdmin):
 @admin.register(NotificationSettings)
 class NotificationSettingsAdmin(admin.ModelAdmin):
     list_display = ('user', 'email_bid_updates', 'push_bid_updates', 'sms_payments')
-    list_filter = ('email_bid_updates', 'push_bid_updates', 'sms_payments')
+    list_filter = ('email_bid_updates', 'email_digest', 'push_bid_updates', 'sms_payments')
     search_fields = ('user__username',)
     raw_id_fields = ('user',)
+    readonly_fields = ('version',)
 
 
 @admin.register(WebPushSubscription)
@@ -41,3 +42,21 @@ class WebPushSubscriptionAdmin(admin.ModelAdmin):
     readonly_fields = ('created_at', 'updated_at')
     raw_id_fields = ('user',)
     list_filter = ('created_at',)
+
+
+@admin.register(NotificationJob)
+class NotificationJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'notification', 'channel', 'status', 'attempts', 'run_after', 'locked_by')
+    list_filter = ('channel', 'status')
+    search_fields = ('notification__user__username', 'last_error')
+    raw_id_fields = ('notification',)
+    readonly_fields = ('created_at', 'updated_at')
+
+
+@admin.register(ScheduledNotification)
+class ScheduledNotificationAdmin(admin.ModelAdmin):
+    list_display = ('key', 'user', 'notification_type', 'due_at', 'status', 'sent_at')
+    list_filter = ('notification_type', 'status')
+    search_fields = ('key', 'user__username', 'title')
+    raw_id_fields = ('user',)
+    readonly_fields = ('sent_at', 'created_at', 'updated_at')
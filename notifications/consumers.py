@@ -2,6 +2,7 @@ import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
+from .counters import get_unread_count
 from .models import Notification
 
 
@@ -20,6 +21,11 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         )
         
         await self.accept()
+        
+        # Current unread count, so the client never has to poll for it
+        user = self.scope.get('user')
+        if user is not None and user.is_authenticated and str(user.id) == self.user_id:
+            await self.unread_count({'count': await database_sync_to_async(get_unread_count)(user.id)})
     
     async def disconnect(self, close_code):
         """Disconnect from WebSocket"""
@@ -55,6 +61,13 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             'timestamp': event.get('timestamp'),
         }))
     
+    async def unread_count(self, event):
+        """Send the user's unread notification count"""
+        await self.send(text_data=json.dumps({
+            'type': 'unread_count',
+            'count': event['count'],
+        }))
+    
     async def bid_update(self, event):
         """Send bid update notification"""
         await self.send(text_data=json.dumps({
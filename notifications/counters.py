@@ -0,0 +1,97 @@
+"""
+Cached unread-notification counters.
+
+Each user's unread count lives in the shared cache and is adjusted as
+notifications are created and read, so the badge endpoint and the
+notifications page rarely count rows. The database stays the source of
+truth: a count is recounted CACHE_TIMEOUT seconds after it was last counted,
+however often it was adjusted since, so a lost concurrent update or a change
+that bypasses the counter is corrected within a minute. Every change is
+pushed to the user's ``notifications_<id>`` WebSocket group as an
+``unread_count`` event, except bulk sends, which just drop the cached counts
+of a whole chunk in one call.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .metrics import log_event
+from .models import Notification
+
+try:
+    from channels.layers import get_channel_layer
+    from asgiref.sync import async_to_sync
+    CHANNELS_AVAILABLE = True
+except ImportError:
+    CHANNELS_AVAILABLE = False
+
+# Seconds a count is trusted after it was counted from the database
+CACHE_TIMEOUT = 60
+
+
+def _cache_key(user_id):
+    return f'notification_unread:{user_id}'
+
+
+def _count(user_id):
+    """Count from the database and cache it as (count, recount deadline)"""
+    count = Notification.objects.filter(user_id=user_id, is_read=False).count()
+    cache.set(_cache_key(user_id), (count, time.time() + CACHE_TIMEOUT), CACHE_TIMEOUT)
+    return count
+
+
+def get_unread_count(user_id):
+    """Unread notifications for a user, counted from the database only on a cache miss"""
+    cached = cache.get(_cache_key(user_id))
+    if cached is None:
+        return _count(user_id)
+    return cached[0]
+
+
+def publish_unread_count(user_id, count):
+    """Push the current unread count to the user's open notification sockets"""
+    if not CHANNELS_AVAILABLE:
+        return
+    try:
+        async_to_sync(get_channel_layer().group_send)(
+            f'notifications_{user_id}',
+            {'type': 'unread_count', 'count': count},
+        )
+    except Exception as e:
+        log_event('unread_count_push_failed', force=True, user_id=user_id, error=f'{type(e).__name__}: {e}')
+
+
+def _adjust(user_id, delta):
+    cached = cache.get(_cache_key(user_id))
+    remaining = cached[1] - time.time() if cached is not None else 0
+    if remaining < 1 or cached[0] + delta < 0:
+        count = _count(user_id)
+    else:
+        # Keep the original deadline so the count is still recounted on time
+        count = cached[0] + delta
+        cache.set(_cache_key(user_id), (count, cached[1]), int(remaining))
+    publish_unread_count(user_id, count)
+
+
+def adjust_unread_count(user_id, delta):
+    """Add ``delta`` to a user's unread count once the current transaction commits"""
+    transaction.on_commit(lambda: _adjust(user_id, delta))
+
+
+def _refresh(user_id):
+    publish_unread_count(user_id, _count(user_id))
+
+
+def refresh_unread_count(user_id):
+    """Recount a user's unread notifications after a bulk change, e.g. mark all read"""
+    transaction.on_commit(lambda: _refresh(user_id))
+
+
+def forget_unread_counts(user_ids):
+    """
+    Drop the cached counts of many users once the current transaction commits,
+    e.g. after a bulk send. They are recounted when next read; nothing is pushed.
+    """
+    keys = [_cache_key(user_id) for user_id in user_ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
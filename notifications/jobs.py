@@ -0,0 +1,341 @@
+"""
+Database-backed queue for notification deliveries.
+
+``send_notification`` stores the notification and one ``NotificationJob`` per
+external channel (email, web push, SMS) in the caller's transaction. Workers
+started with ``manage.py run_notification_workers`` claim due jobs, deliver
+them and retry failures with exponential backoff, so requests never wait on
+an email or push provider. While no worker is running on this host, the
+process that queued the jobs delivers them itself once its transaction
+commits, so nothing waits for a worker that was never started.
+"""
+import os
+import random
+import socket
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from mjolobid.workers import is_running
+
+from .models import Notification, NotificationJob, WebPushSubscription
+from .metrics import BATCH_SECONDS, DELIVERIES, DELIVERY_LATENCY, log_event
+from .preferences import allowed_channels, get_preference_masks
+
+MAX_ATTEMPTS = 5
+DIGEST_INTERVAL = 3600  # seconds
+BACKOFF_BASE = 30  # seconds
+BACKOFF_MAX = 3600
+LOCK_TIMEOUT = 300  # a RUNNING job older than this belonged to a dead worker
+WORKER_NAME = 'notification_workers'  # heartbeat of run_notification_workers
+INLINE_BATCH_SIZE = 100
+
+
+class DeliveryError(Exception):
+    """Raised by a channel handler when a delivery should be retried"""
+
+
+def _deliver_email_batch(jobs):
+    """Send a batch of notification emails over the worker's pooled SMTP session"""
+    from .mailer import get_mailer
+    from .utils import build_email_message
+
+    notifications = [job.notification for job in jobs]
+    results = [None] * len(notifications)
+    messages = []
+    positions = []
+    for position, notification in enumerate(notifications):
+        try:
+            message = build_email_message(notification.user, notification)
+        except Exception as e:
+            results[position] = e
+            continue
+        if message is not None:
+            messages.append(message)
+            positions.append(position)
+
+    sent_ids = []
+    for position, error in zip(positions, get_mailer().send_batch(messages)):
+        results[position] = error
+        if error is None:
+            sent_ids.append(notifications[position].id)
+    Notification.objects.filter(id__in=sent_ids).update(is_sent=True)
+    return results
+
+
+def _deliver_digest_batch(jobs):
+    """
+    Send one digest email per user.
+
+    Each DIGEST job hangs off the first notification of its period; the
+    digest covers every unsent notification the user has received since.
+    """
+    from .mailer import get_mailer
+    from .utils import build_digest_message
+
+    notifications = [job.notification for job in jobs]
+    masks = get_preference_masks({notification.user_id for notification in notifications})
+    results = [None] * len(notifications)
+    messages = []
+    positions = []
+    included = []
+    for position, anchor in enumerate(notifications):
+        items = [
+            item for item in Notification.objects.filter(
+                user_id=anchor.user_id, is_sent=False, created_at__gte=anchor.created_at
+            ).order_by('created_at')
+            if 'DIGEST' in allowed_channels(masks[anchor.user_id], item.notification_type)
+        ]
+        try:
+            message = build_digest_message(anchor.user, items) if items else None
+        except Exception as e:
+            results[position] = e
+            continue
+        if message is not None:
+            messages.append(message)
+            positions.append(position)
+            included.append(items)
+
+    sent_ids = []
+    for position, items, error in zip(positions, included, get_mailer().send_batch(messages)):
+        results[position] = error
+        if error is None:
+            sent_ids.extend(item.id for item in items)
+    Notification.objects.filter(id__in=sent_ids).update(is_sent=True)
+    return results
+
+
+def _deliver_push_batch(jobs):
+    """
+    Send a batch of web push notifications concurrently through the shared dispatcher.
+
+    Subscriptions a job already reached are recorded on it, so a retry only
+    sends to the ones that failed.
+    """
+    from .push import build_payload, get_push_dispatcher
+
+    dispatcher = get_push_dispatcher()
+    if dispatcher is None:
+        # Not configured (or pywebpush missing) - nothing will ever be deliverable
+        return [None] * len(jobs)
+
+    subscriptions = {}
+    for subscription in WebPushSubscription.objects.filter(user_id__in={job.notification.user_id for job in jobs}):
+        subscriptions.setdefault(subscription.user_id, []).append(subscription)
+
+    deliveries = []
+    owners = []
+    for position, job in enumerate(jobs):
+        data = build_payload(job.notification)
+        delivered = set(job.delivered_subscriptions)
+        for subscription in subscriptions.get(job.notification.user_id, []):
+            if subscription.id not in delivered:
+                deliveries.append((subscription, data))
+                owners.append(position)
+
+    result = dispatcher.dispatch(deliveries)
+    failures = [0] * len(jobs)
+    for delivery in result.failed:
+        failures[owners[delivery]] += 1
+    for delivery, ((subscription, _), position) in enumerate(zip(deliveries, owners)):
+        if delivery not in result.failed:
+            jobs[position].delivered_subscriptions.append(subscription.id)
+    return [DeliveryError(f'{failed} push subscription(s) failed') if failed else None for failed in failures]
+
+
+def _deliver_sms(notification):
+    from .utils import send_sms_notification
+    send_sms_notification(notification.user, notification)
+
+
+# Channels delivered one notification at a time
+HANDLERS = {
+    'SMS': _deliver_sms,
+}
+
+# Channels delivered a batch at a time; handlers return one error (or None) per job
+BATCH_HANDLERS = {
+    'EMAIL': _deliver_email_batch,
+    'PUSH': _deliver_push_batch,
+    'DIGEST': _deliver_digest_batch,
+}
+
+CHANNELS = sorted(set(HANDLERS) | set(BATCH_HANDLERS))
+
+
+def next_digest_time(now=None):
+    """When the current digest period ends, aligned to the digest interval"""
+    interval = getattr(settings, 'NOTIFICATION_DIGEST_INTERVAL', DIGEST_INTERVAL)
+    now = now or timezone.now()
+    return now + timedelta(seconds=interval - now.timestamp() % interval)
+
+
+def enqueue_bulk(routed):
+    """
+    Queue delivery jobs for ``(notification, channels)`` pairs in one INSERT.
+
+    ``DIGEST`` only queues a job for users who don't already have a digest
+    pending; the pending one will pick the notification up.
+    """
+    jobs = []
+    digest_users = {notification.user_id for notification, channels in routed if 'DIGEST' in channels}
+    if digest_users:
+        digest_users -= set(NotificationJob.objects.filter(
+            channel='DIGEST', status='PENDING', notification__user_id__in=digest_users
+        ).values_list('notification__user_id', flat=True))
+        digest_at = next_digest_time()
+
+    for notification, channels in routed:
+        for channel in channels:
+            if channel != 'DIGEST':
+                jobs.append(NotificationJob(notification=notification, channel=channel))
+            elif notification.user_id in digest_users:
+                digest_users.discard(notification.user_id)
+                jobs.append(NotificationJob(notification=notification, channel=channel, run_after=digest_at))
+    if not jobs:
+        return []
+    created = NotificationJob.objects.bulk_create(jobs)
+    if not is_running(WORKER_NAME):
+        job_ids = [job.id for job in created]
+        transaction.on_commit(lambda: run_inline(job_ids))
+    return created
+
+
+def enqueue_deliveries(notification, channels):
+    """Queue one delivery job per channel for a notification"""
+    return enqueue_bulk([(notification, channels)])
+
+
+def backoff_delay(attempts):
+    """Seconds to wait before retry number ``attempts``, with jitter"""
+    base = getattr(settings, 'NOTIFICATION_JOB_BACKOFF', BACKOFF_BASE)
+    cap = getattr(settings, 'NOTIFICATION_JOB_MAX_BACKOFF', BACKOFF_MAX)
+    delay = min(base * 2 ** (attempts - 1), cap)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def claim_jobs(worker_id, channels=None, limit=50, job_ids=None):
+    """
+    Claim up to ``limit`` due jobs for this worker.
+
+    The claiming UPDATE re-checks that each job is still claimable, so only
+    one worker wins a job. PostgreSQL also skips rows other workers have
+    locked (``FOR UPDATE SKIP LOCKED``) instead of waiting on them.
+    """
+    now = timezone.now()
+    claimable = NotificationJob.objects.filter(
+        Q(status='PENDING', run_after__lte=now) |
+        Q(status='RUNNING', locked_at__lt=now - timedelta(seconds=LOCK_TIMEOUT))
+    )
+    if channels:
+        claimable = claimable.filter(channel__in=channels)
+    if job_ids is not None:
+        claimable = claimable.filter(id__in=job_ids)
+
+    candidates = claimable.order_by('run_after').values_list('id', flat=True)
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            job_ids = list(candidates.select_for_update(skip_locked=True)[:limit])
+            claimable.filter(id__in=job_ids).update(status='RUNNING', locked_by=worker_id, locked_at=now)
+    else:
+        # SQLite: two autocommit statements, so no read lock is held while waiting to write
+        job_ids = list(candidates[:limit])
+        claimable.filter(id__in=job_ids).update(status='RUNNING', locked_by=worker_id, locked_at=now)
+
+    return list(
+        NotificationJob.objects.filter(id__in=job_ids, locked_by=worker_id, locked_at=now)
+        .select_related('notification__user')
+    )
+
+
+def _finish(job, error):
+    """Record the outcome of a delivery attempt"""
+    notification_type = job.notification.notification_type
+    if error is None:
+        latency = (timezone.now() - job.notification.created_at).total_seconds()
+        DELIVERIES.inc(channel=job.channel, type=notification_type, outcome='sent')
+        DELIVERY_LATENCY.observe(latency, channel=job.channel, type=notification_type)
+        log_event('delivered', channel=job.channel, type=notification_type,
+                  notification_id=job.notification_id, attempts=job.attempts + 1, latency=round(latency, 3))
+        # Delivered jobs are removed; failed ones stay for inspection
+        job.delete()
+        return True
+
+    job.attempts += 1
+    job.last_error = f'{type(error).__name__}: {error}'[:2000]
+    job.locked_by = ''
+    job.locked_at = None
+    max_attempts = getattr(settings, 'NOTIFICATION_JOB_MAX_ATTEMPTS', MAX_ATTEMPTS)
+    if job.attempts >= max_attempts:
+        job.status = 'FAILED'
+    else:
+        job.status = 'PENDING'
+        job.run_after = timezone.now() + timedelta(seconds=backoff_delay(job.attempts))
+    job.save(update_fields=['attempts', 'last_error', 'locked_by', 'locked_at', 'status', 'run_after',
+                            'delivered_subscriptions', 'updated_at'])
+    outcome = 'failed' if job.status == 'FAILED' else 'retry'
+    DELIVERIES.inc(channel=job.channel, type=notification_type, outcome=outcome)
+    log_event('delivery_' + outcome, force=True, channel=job.channel, type=notification_type,
+              notification_id=job.notification_id, attempts=job.attempts, error=job.last_error)
+    return False
+
+
+def run_job(job):
+    """Deliver one claimed job. Returns True on success."""
+    try:
+        HANDLERS[job.channel](job.notification)
+    except Exception as e:
+        return _finish(job, e)
+    return _finish(job, None)
+
+
+def run_jobs(jobs):
+    """Deliver a batch of claimed jobs. Returns the number delivered."""
+    delivered = 0
+    by_channel = {}
+    for job in jobs:
+        by_channel.setdefault(job.channel, []).append(job)
+
+    for channel, channel_jobs in by_channel.items():
+        with BATCH_SECONDS.time(channel=channel):
+            if channel in BATCH_HANDLERS:
+                try:
+                    errors = BATCH_HANDLERS[channel](channel_jobs)
+                except Exception as e:
+                    errors = [e] * len(channel_jobs)
+                delivered += sum(_finish(job, error) for job, error in zip(channel_jobs, errors))
+            else:
+                delivered += sum(run_job(job) for job in channel_jobs)
+    return delivered
+
+
+def run_inline(job_ids):
+    """
+    Deliver just-queued jobs in this process, for when no worker is running.
+
+    Then one batch of whatever else is due (retries, digests) goes too, so
+    nothing stays queued while traffic continues. Jobs are claimed like a
+    worker would, so a worker that starts in the meantime never delivers
+    them a second time; failures stay queued for their retries.
+    """
+    from .mailer import get_mailer
+
+    worker_id = f'inline:{socket.gethostname()}:{os.getpid()}'
+    try:
+        for start in range(0, len(job_ids), INLINE_BATCH_SIZE):
+            batch = job_ids[start:start + INLINE_BATCH_SIZE]
+            jobs = claim_jobs(worker_id, limit=len(batch), job_ids=batch)
+            if jobs:
+                run_jobs(jobs)
+        jobs = claim_jobs(worker_id, limit=INLINE_BATCH_SIZE)
+        if jobs:
+            run_jobs(jobs)
+    except Exception as e:
+        # e.g. the database is briefly locked - the jobs stay queued
+        log_event('inline_delivery_failed', force=True, error=f'{type(e).__name__}: {e}')
+    finally:
+        get_mailer().close()
+
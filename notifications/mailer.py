@@ -0,0 +1,98 @@
+"""
+Pooled SMTP delivery for notification emails.
+
+Each worker thread keeps one authenticated SMTP session open and sends its
+queued emails over it, instead of paying a new TCP + TLS + AUTH handshake per
+message. Dropped sessions are reopened and the message retried once.
+"""
+import smtplib
+import threading
+import time
+
+from django.conf import settings
+from django.core.mail import get_connection
+
+from .metrics import log_event, observe_provider
+
+IDLE_TIMEOUT = 60  # seconds - most SMTP servers drop idle sessions soon after
+
+_local = threading.local()
+
+
+class PooledMailer:
+    """One reusable email connection for the current worker thread"""
+
+    def __init__(self, idle_timeout=IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.connection = None
+        self.last_used = 0
+
+    def _open(self):
+        if self.connection is not None and time.monotonic() - self.last_used > self.idle_timeout:
+            self.close()
+        if self.connection is None:
+            self.connection = get_connection(fail_silently=False)
+            self.connection.open()
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+    def _send_one(self, message):
+        started = time.monotonic()
+        try:
+            try:
+                self.connection.send_messages([message])
+            except (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError):
+                # The session went away under us - reconnect and retry once
+                self.close()
+                self._open()
+                self.connection.send_messages([message])
+        except Exception as e:
+            observe_provider('EMAIL', time.monotonic() - started, e)
+            raise
+        observe_provider('EMAIL', time.monotonic() - started)
+
+    def send_batch(self, messages):
+        """
+        Send a batch of EmailMessages over the pooled session.
+
+        Returns one entry per message: None when it was sent, otherwise the
+        exception it failed with.
+        """
+        if not messages:
+            return []
+
+        started = time.monotonic()
+        results = []
+        try:
+            self._open()
+        except Exception as e:
+            self.close()
+            return [e] * len(messages)
+
+        for message in messages:
+            try:
+                self._send_one(message)
+                results.append(None)
+            except Exception as e:
+                results.append(e)
+        self.last_used = time.monotonic()
+
+        sent = results.count(None)
+        elapsed = max(time.monotonic() - started, 0.001)
+        log_event('email_batch', sent=sent, total=len(messages), seconds=round(elapsed, 3),
+                  per_second=round(sent / elapsed, 1), host=getattr(settings, 'EMAIL_HOST', ''))
+        return results
+
+
+def get_mailer():
+    """Get the pooled mailer for the current thread"""
+    mailer = getattr(_local, 'mailer', None)
+    if mailer is None:
+        mailer = _local.mailer = PooledMailer()
+    return mailer
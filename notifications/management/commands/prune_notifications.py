@@ -0,0 +1,90 @@
+"""
+Management command that applies the notification retention policy: read
+notifications older than N days are deleted (optionally archived first), in
+resumable batches, so the notifications table only holds the working set.
+"""
+import gzip
+import json
+import os
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+from maintenance.batch import BatchCommand
+from notifications.models import Notification
+
+RETENTION_DAYS = 90
+
+
+def archive_root():
+    """Directory holding the pruned-notification archives"""
+    root = getattr(settings, 'NOTIFICATION_ARCHIVE_ROOT', None) or os.path.join(settings.BASE_DIR, 'notification_archive')
+    return Path(root)
+
+
+def _encode(notification):
+    return {
+        'id': notification.id,
+        'user_id': notification.user_id,
+        'title': notification.title,
+        'message': notification.message,
+        'notification_type': notification.notification_type,
+        'related_object_type': notification.related_object_type,
+        'related_object_id': notification.related_object_id,
+        'count': notification.count,
+        'is_sent': notification.is_sent,
+        'created_at': notification.created_at.isoformat(),
+        'read_at': notification.read_at.isoformat() if notification.read_at else None,
+    }
+
+
+class Command(BatchCommand):
+    help = 'Delete (or archive, then delete) read notifications older than the retention period'
+
+    checkpoint_name = 'prune_notifications'
+    default_batch_size = 2000
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=getattr(settings, 'NOTIFICATION_RETENTION_DAYS', RETENTION_DAYS),
+            help=f'Keep read notifications for this many days (default: NOTIFICATION_RETENTION_DAYS or {RETENTION_DAYS}).',
+        )
+        parser.add_argument(
+            '--archive',
+            action='store_true',
+            help='Append pruned notifications to monthly gzipped JSON-lines files before deleting them.',
+        )
+
+    def handle(self, *args, **options):
+        self.cutoff = timezone.now() - timedelta(days=options['days'])
+        # Archive files can't be rolled back, so a dry run never writes them
+        self.archive = options['archive'] and not options['dry_run']
+        if self.archive:
+            archive_root().mkdir(parents=True, exist_ok=True)
+        self.stdout.write(f'Pruning read notifications created before {self.cutoff:%Y-%m-%d}')
+        super().handle(*args, **options)
+
+    def get_queryset(self):
+        # Unread notifications are never pruned, however old
+        return Notification.objects.filter(is_read=True, created_at__lt=self.cutoff)
+
+    def process_batch(self, notifications, stats):
+        if self.archive:
+            by_month = {}
+            for notification in notifications:
+                by_month.setdefault(notification.created_at.strftime('%Y-%m'), []).append(notification)
+            for month, rows in by_month.items():
+                # Appending adds a gzip member; readers see one continuous stream
+                with gzip.open(archive_root() / f'notifications-{month}.jsonl.gz', 'at', encoding='utf-8') as f:
+                    for notification in rows:
+                        f.write(json.dumps(_encode(notification)) + '\n')
+            stats['archived'] = stats.get('archived', 0) + len(notifications)
+
+        # Failed delivery jobs of these notifications go with them (cascade)
+        _, deleted = Notification.objects.filter(id__in=[n.id for n in notifications]).delete()
+        stats['deleted'] = stats.get('deleted', 0) + deleted.get(Notification._meta.label, 0)
@@ -0,0 +1,94 @@
+"""
+Management command that sends scheduled notifications (event reminders, premium expiry notices) when they come due.
+"""
+import signal
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from mjolobid.workers import Heartbeat
+from notifications.scheduler import SCHEDULER_NAME, Scheduler, dispatch
+
+
+class Command(BaseCommand):
+    help = 'Dispatch scheduled notifications from an in-process timer wheel'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tick',
+            type=float,
+            default=1.0,
+            help='Timer wheel resolution in seconds (default: 1).',
+        )
+        parser.add_argument(
+            '--window',
+            type=int,
+            default=300,
+            help='Seconds ahead to load pending entries from the database (default: 300).',
+        )
+        parser.add_argument(
+            '--reload-interval',
+            type=int,
+            default=60,
+            help='Seconds between database loads; keep it below --window (default: 60).',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Entries dispatched per transaction (default: 100).',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Send everything already due, then exit.',
+        )
+
+    def handle(self, *args, **options):
+        stopping = threading.Event()
+
+        def stop(signum, frame):
+            self.stdout.write('Stopping notification scheduler after the current batch...')
+            stopping.set()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        scheduler = Scheduler(window=options['window'], tick=options['tick'])
+        self.stdout.write(f"Starting notification scheduler (tick {options['tick']}s, window {options['window']}s)")
+        heartbeat = Heartbeat(SCHEDULER_NAME)
+        next_load = 0
+        try:
+            while not stopping.is_set():
+                heartbeat.beat()
+                if time.monotonic() >= next_load:
+                    close_old_connections()
+                    try:
+                        scheduler.load()
+                        next_load = time.monotonic() + options['reload_interval']
+                    except Exception as e:
+                        # e.g. the database is briefly locked - try again next tick
+                        self.stderr.write(f'Loading scheduled notifications failed: {e}')
+
+                due = scheduler.due()
+                for start in range(0, len(due), options['batch_size']):
+                    batch = due[start:start + options['batch_size']]
+                    try:
+                        sent = dispatch(batch)
+                    except Exception as e:
+                        # Nothing in the batch was marked sent; reload so it's retried
+                        self.stderr.write(f'Dispatching scheduled notifications failed: {e}')
+                        next_load = 0
+                        continue
+                    self.stdout.write(f'Sent {sent}/{len(batch)} scheduled notifications')
+
+                if options['once']:
+                    break
+                stopping.wait(options['tick'])
+        finally:
+            heartbeat.stop()
+            connection.close()
+
+        self.stdout.write(self.style.SUCCESS('Notification scheduler stopped'))
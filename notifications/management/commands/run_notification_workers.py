@@ -0,0 +1,134 @@
+"""
+Management command that delivers queued notification jobs (email, web push, SMS).
+"""
+import os
+import signal
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from mjolobid.workers import Heartbeat
+from notifications.jobs import CHANNELS, WORKER_NAME, claim_jobs, run_jobs
+from notifications.mailer import get_mailer
+from notifications.metrics import CONTENT_TYPE, render
+
+
+class Command(BaseCommand):
+    help = 'Run worker threads that deliver queued notifications with retries and backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threads',
+            type=int,
+            default=2,
+            help='Number of worker threads (default: 2).',
+        )
+        parser.add_argument(
+            '--channel',
+            action='append',
+            choices=CHANNELS,
+            help='Only deliver this channel; repeat for several (default: all).',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Jobs claimed per round trip; emails in a batch share one SMTP session (default: 100).',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=1.0,
+            help='Seconds to sleep when the queue is empty (default: 1).',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit once no jobs are due instead of polling.',
+        )
+        parser.add_argument(
+            '--metrics-port',
+            type=int,
+            default=None,
+            help='Serve delivery metrics for Prometheus on this port (e.g. 9108).',
+        )
+
+    def handle(self, *args, **options):
+        self.stopping = threading.Event()
+        self.options = options
+
+        def stop(signum, frame):
+            self.stdout.write('Stopping notification workers after the current batch...')
+            self.stopping.set()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        channels = options['channel'] or CHANNELS
+        # Only a worker for every channel stops web processes delivering inline
+        self.heartbeat = Heartbeat(WORKER_NAME) if set(channels) == set(CHANNELS) else None
+        self.stdout.write(f"Starting {options['threads']} notification worker(s) for {', '.join(channels)}")
+        if options['metrics_port']:
+            self.serve_metrics(options['metrics_port'])
+
+        threads = [
+            threading.Thread(target=self.work, args=(f'{socket.gethostname()}:{os.getpid()}:{n}', channels), daemon=True)
+            for n in range(options['threads'])
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    if self.heartbeat is not None:
+                        self.heartbeat.beat()
+                    thread.join(0.5)
+        finally:
+            if self.heartbeat is not None:
+                self.heartbeat.stop()
+
+        self.stdout.write(self.style.SUCCESS('Notification workers stopped'))
+
+    def serve_metrics(self, port):
+        """Expose this process's delivery metrics over HTTP in a background thread"""
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(('0.0.0.0', port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.stdout.write(f'Serving notification metrics on port {port}')
+
+    def work(self, worker_id, channels):
+        try:
+            while not self.stopping.is_set():
+                close_old_connections()
+                try:
+                    jobs = claim_jobs(worker_id, channels=channels, limit=self.options['batch_size'])
+                except Exception as e:
+                    # e.g. the database is briefly locked - try again next round
+                    self.stderr.write(f'[{worker_id}] claiming jobs failed: {e}')
+                    self.stopping.wait(self.options['poll_interval'])
+                    continue
+                if not jobs:
+                    if self.options['once']:
+                        return
+                    self.stopping.wait(self.options['poll_interval'])
+                    continue
+
+                delivered = run_jobs(jobs)
+                self.stdout.write(f'[{worker_id}] delivered {delivered}/{len(jobs)} jobs')
+        finally:
+            get_mailer().close()
+            connection.close()
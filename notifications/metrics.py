@@ -0,0 +1,162 @@
+"""
+Delivery instrumentation for notifications.
+
+In-process counters and histograms, rendered in the Prometheus text format
+by the ``/metrics`` view (web process) and by ``run_notification_workers
+--metrics-port`` (worker process). Metrics are per process, so scrape each
+one. Delivery events are also written as JSON log lines on the
+``notifications.delivery`` logger: failures and slow deliveries always,
+successes sampled at ``NOTIFICATION_LOG_SAMPLE_RATE``.
+"""
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LATENCY_BUCKETS = (0.1, 0.5, 1, 5, 15, 30, 60, 300, 900, 3600, 4 * 3600)
+LOG_SAMPLE_RATE = 0.01
+SLOW_SECONDS = 5
+
+logger = logging.getLogger('notifications.delivery')
+
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, list(zip(self.labelnames, key)), value
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[len(self.buckets)] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {key: list(counts) for key, counts in self._values.items()}
+        for key, counts in sorted(values.items()):
+            pairs = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield f'{self.name}_bucket', pairs + [('le', repr(float(bound)))], cumulative
+            cumulative += counts[len(self.buckets)]
+            yield f'{self.name}_bucket', pairs + [('le', '+Inf')], cumulative
+            yield f'{self.name}_count', pairs, cumulative
+            yield f'{self.name}_sum', pairs, counts[-1]
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for name, pairs, value in metric.samples():
+            lines.append(f'{name}{_labels(pairs)} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+NOTIFICATIONS_CREATED = Counter(
+    'notifications_created_total', 'Notifications stored, by type', ('type',))
+DELIVERIES = Counter(
+    'notification_deliveries_total', 'Delivery attempts by channel, type and outcome (sent, retry, failed)',
+    ('channel', 'type', 'outcome'))
+DELIVERY_LATENCY = Histogram(
+    'notification_delivery_latency_seconds', 'Time from notification creation to successful delivery',
+    ('channel', 'type'), buckets=LATENCY_BUCKETS)
+PROVIDER_SECONDS = Histogram(
+    'notification_provider_request_seconds', 'Duration of one request to an email or push provider',
+    ('channel', 'outcome'))
+BATCH_SECONDS = Histogram(
+    'notification_batch_seconds', 'Time to deliver one claimed batch of jobs', ('channel',))
+WEBSOCKET_FANOUT_SECONDS = Histogram(
+    'notification_websocket_fanout_seconds', 'Time to publish a notification event to the channel layer', ('type',))
+
+
+def log_event(event, force=False, **fields):
+    """Write a JSON log line; routine events are sampled, ``force`` ones never are"""
+    rate = getattr(settings, 'NOTIFICATION_LOG_SAMPLE_RATE', LOG_SAMPLE_RATE)
+    if not force and random.random() >= rate:
+        return
+    logger.info(json.dumps(dict(fields, event=event), default=str))
+
+
+def observe_provider(channel, seconds, error=None, **fields):
+    """Record one provider request; slow or failed ones are always logged"""
+    PROVIDER_SECONDS.observe(seconds, channel=channel, outcome='error' if error else 'ok')
+    slow = seconds >= getattr(settings, 'NOTIFICATION_SLOW_SECONDS', SLOW_SECONDS)
+    log_event(
+        'provider_request', force=bool(error) or slow,
+        channel=channel, seconds=round(seconds, 4), slow=slow,
+        error=f'{type(error).__name__}: {error}' if isinstance(error, Exception) else error, **fields
+    )
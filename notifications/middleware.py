@@ -0,0 +1,18 @@
+from .metrics import log_event
+from .scheduler import dispatch_due_inline
+
+
+class ScheduledNotificationMiddleware:
+    """Send due scheduled notifications after a request while run_notification_scheduler isn't running"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        try:
+            dispatch_due_inline()
+        except Exception as e:
+            # e.g. the database is briefly locked - the entries stay pending
+            log_event('inline_schedule_failed', force=True, error=f'{type(e).__name__}: {e}')
+        return response
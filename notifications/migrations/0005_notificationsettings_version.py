@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 02:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0004_notificationjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationsettings',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-19 02:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0005_notificationsettings_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='notificationsettings',
+            name='email_digest',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='notificationjob',
+            name='channel',
+            field=models.CharField(choices=[('EMAIL', 'Email'), ('PUSH', 'Web Push'), ('SMS', 'SMS'), ('DIGEST', 'Email Digest')], max_length=10),
+        ),
+    ]
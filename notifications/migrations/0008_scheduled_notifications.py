@@ -0,0 +1,39 @@
+# Generated by Django 4.2.7 on 2026-10-19 02:23
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('notifications', '0007_notification_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduledNotification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100, unique=True)),
+                ('title', models.CharField(max_length=200)),
+                ('message', models.TextField()),
+                ('notification_type', models.CharField(choices=[('BID_ACCEPTED', 'Bid Accepted'), ('BID_CANCELLED', 'Bid Cancelled'), ('NEW_MESSAGE', 'New Message'), ('OFFER_BID', 'Offer Bid'), ('OFFER_ACCEPTED', 'Offer Accepted'), ('PAYMENT_RECEIVED', 'Payment Received'), ('PAYMENT_SENT', 'Payment Sent'), ('WITHDRAWAL_PROCESSED', 'Withdrawal Processed'), ('REFERRAL_BONUS', 'Referral Bonus'), ('PREMIUM_EXPIRING', 'Premium Expiring'), ('EVENT_REMINDER', 'Event Reminder'), ('SYSTEM_ANNOUNCEMENT', 'System Announcement')], max_length=30)),
+                ('related_object_type', models.CharField(blank=True, max_length=50)),
+                ('related_object_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('due_at', models.DateTimeField()),
+                ('expires_at', models.DateTimeField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('SENT', 'Sent'), ('CANCELLED', 'Cancelled'), ('EXPIRED', 'Expired')], default='PENDING', max_length=10)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scheduled_notifications', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['due_at'],
+                'indexes': [models.Index(fields=['status', 'due_at'], name='sched_notif_due_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 02:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0008_scheduled_notifications'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationjob',
+            name='delivered_subscriptions',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
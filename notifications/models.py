@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 from accounts.models import User
 
@@ -33,6 +33,7 @@ class Notification(models.Model):
     # Status
     is_read = models.BooleanField(default=False)
     is_sent = models.BooleanField(default=False)
+    count = models.PositiveIntegerField(default=1)  # events coalesced into this notification
     
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
@@ -40,16 +41,26 @@ class Notification(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Unread counts and unread lists: user + is_read, newest first, without touching the table
+            models.Index(fields=['user', 'is_read', '-created_at'], name='notif_user_unread_idx'),
+            # The notifications page: all of a user's notifications, newest first
+            models.Index(fields=['user', '-created_at'], name='notif_user_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.title}"
     
     def mark_as_read(self):
         """Mark notification as read"""
+        from .counters import adjust_unread_count
+        
         if not self.is_read:
             self.is_read = True
             self.read_at = timezone.now()
-            self.save()
+            # Conditional so a concurrent mark_read can't decrement the unread counter twice
+            if Notification.objects.filter(id=self.id, is_read=False).update(is_read=True, read_at=self.read_at):
+                adjust_unread_count(self.user_id, -1)
     
     def mark_as_sent(self):
         """Mark notification as sent"""
@@ -68,6 +79,7 @@ class NotificationSettings(models.Model):
     email_payments = models.BooleanField(default=True)
     email_promotions = models.BooleanField(default=True)
     email_system = models.BooleanField(default=True)
+    email_digest = models.BooleanField(default=False)  # one email per hour instead of one per notification
     
     # Push notifications
     push_bid_updates = models.BooleanField(default=True)
@@ -80,11 +92,24 @@ class NotificationSettings(models.Model):
     sms_payments = models.BooleanField(default=False)
     sms_urgent = models.BooleanField(default=True)
     
+    # Bumped on every save; compiled preference masks are checked against it on read
+    version = models.PositiveIntegerField(default=0)
+    
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
         return f"{self.user.username}'s Notification Settings"
+    
+    def save(self, *args, **kwargs):
+        from .preferences import store_preferences
+        
+        self.version += 1
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'version', 'updated_at'}
+        super().save(*args, **kwargs)
+        # Other processes see the new version and recompile on their next read
+        transaction.on_commit(lambda: store_preferences(self))
 
 
 class WebPushSubscription(models.Model):
@@ -104,4 +129,78 @@ class WebPushSubscription(models.Model):
         ordering = ['-created_at']
 
     def __str__(self):
-        return f"WebPush subscription for {self.user.username}"
\ No newline at end of file
+        return f"WebPush subscription for {self.user.username}"
+
+class NotificationJob(models.Model):
+    """Queued delivery of a notification over one channel, run by run_notification_workers"""
+
+    CHANNEL_CHOICES = [
+        ('EMAIL', 'Email'),
+        ('PUSH', 'Web Push'),
+        ('SMS', 'SMS'),
+        ('DIGEST', 'Email Digest'),
+    ]
+
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('RUNNING', 'Running'),
+        ('FAILED', 'Failed'),
+    ]
+
+    notification = models.ForeignKey(Notification, on_delete=models.CASCADE, related_name='jobs')
+    channel = models.CharField(max_length=10, choices=CHANNEL_CHOICES)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=64, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    # Push subscriptions already reached, skipped when the job is retried
+    delivered_subscriptions = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['run_after']
+        indexes = [
+            models.Index(fields=['status', 'channel', 'run_after'], name='notif_job_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.channel} delivery of notification {self.notification_id} ({self.status})"
+
+
+class ScheduledNotification(models.Model):
+    """A notification to send at a future time, dispatched by run_notification_scheduler"""
+
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('SENT', 'Sent'),
+        ('CANCELLED', 'Cancelled'),
+        ('EXPIRED', 'Expired'),
+    ]
+
+    # Identifies what the entry is about (e.g. 'event_reminder:bid:12:user:5'), so rescheduling updates it
+    key = models.CharField(max_length=100, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='scheduled_notifications')
+    title = models.CharField(max_length=200)
+    message = models.TextField()
+    notification_type = models.CharField(max_length=30, choices=Notification.NOTIFICATION_TYPE_CHOICES)
+    related_object_type = models.CharField(max_length=50, blank=True)
+    related_object_id = models.PositiveIntegerField(null=True, blank=True)
+
+    due_at = models.DateTimeField()
+    expires_at = models.DateTimeField(null=True, blank=True)  # not worth sending after this (e.g. the event itself)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING')
+    sent_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['due_at']
+        indexes = [
+            models.Index(fields=['status', 'due_at'], name='sched_notif_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.notification_type} for {self.user_id} at {self.due_at} ({self.status})"
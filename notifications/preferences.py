@@ -0,0 +1,146 @@
+"""
+Compiled notification preferences.
+
+A user's ``NotificationSettings`` are compiled into one integer with a bit per
+(notification type, delivery channel) pair, and kept in a per-process LRU
+together with the row version it was compiled from. Routing a batch of
+notifications is then one query for the versions, a dict lookup and a bit
+test per user; only users whose settings changed are loaded and recompiled.
+``NotificationSettings.save`` bumps the version; ``QuerySet.update()``
+bypasses that, so bulk updates must bump it themselves
+(``version=F('version') + 1``).
+"""
+import threading
+from collections import OrderedDict
+
+from django.conf import settings as django_settings
+
+from .models import Notification, NotificationSettings
+
+CHANNELS = ('EMAIL', 'PUSH', 'SMS')
+TYPES = [choice for choice, _ in Notification.NOTIFICATION_TYPE_CHOICES]
+
+# (notification type, channel) -> settings fields; any enabled field allows delivery
+RULES = {
+    ('BID_ACCEPTED', 'EMAIL'): ('email_bid_updates',),
+    ('NEW_MESSAGE', 'EMAIL'): ('email_messages',),
+    ('OFFER_BID', 'EMAIL'): ('email_bid_updates',),
+    ('OFFER_ACCEPTED', 'EMAIL'): ('email_bid_updates',),
+    ('PAYMENT_RECEIVED', 'EMAIL'): ('email_payments',),
+    ('PAYMENT_SENT', 'EMAIL'): ('email_payments',),
+    ('SYSTEM_ANNOUNCEMENT', 'EMAIL'): ('email_system',),
+
+    ('BID_ACCEPTED', 'PUSH'): ('push_bid_updates',),
+    ('NEW_MESSAGE', 'PUSH'): ('push_messages',),
+    ('OFFER_BID', 'PUSH'): ('push_bid_updates',),
+    ('OFFER_ACCEPTED', 'PUSH'): ('push_bid_updates',),
+    ('PAYMENT_RECEIVED', 'PUSH'): ('push_payments',),
+    ('PAYMENT_SENT', 'PUSH'): ('push_payments',),
+    ('SYSTEM_ANNOUNCEMENT', 'PUSH'): ('push_system',),
+
+    ('BID_ACCEPTED', 'SMS'): ('sms_urgent',),
+    ('PAYMENT_RECEIVED', 'SMS'): ('sms_payments', 'sms_urgent'),
+    ('PAYMENT_SENT', 'SMS'): ('sms_payments',),
+}
+
+CACHE_SIZE = 10000  # masks kept per process
+
+
+def _bit(notification_type, channel):
+    return 1 << (TYPES.index(notification_type) * len(CHANNELS) + CHANNELS.index(channel))
+
+
+# (notification type, channel) -> bit, precomputed for every pair that has a rule
+_BITS = {key: _bit(*key) for key in RULES}
+
+# notification type -> [(bit, channel)], in CHANNELS order
+_TYPE_BITS = {}
+for (notification_type, channel), bit in sorted(_BITS.items(), key=lambda item: CHANNELS.index(item[0][1])):
+    _TYPE_BITS.setdefault(notification_type, []).append((bit, channel))
+
+
+# Set when emails should be collected into the periodic digest
+DIGEST_BIT = 1 << (len(TYPES) * len(CHANNELS))
+
+
+def compile_preferences(settings):
+    """Bitmask of the (type, channel) pairs a NotificationSettings row allows"""
+    mask = DIGEST_BIT if settings.email_digest else 0
+    for key, fields in RULES.items():
+        if any(getattr(settings, field) for field in fields):
+            mask |= _BITS[key]
+    return mask
+
+
+DEFAULT_MASK = compile_preferences(NotificationSettings())
+
+
+# user id -> (settings version, mask), least recently used first
+_masks = OrderedDict()
+_lock = threading.Lock()
+
+
+def store_preferences(settings):
+    """Compile and keep the mask for a NotificationSettings row, unless a newer one is kept. Returns the mask."""
+    limit = getattr(django_settings, 'NOTIFICATION_PREFERENCE_CACHE_SIZE', CACHE_SIZE)
+    mask = compile_preferences(settings)
+    with _lock:
+        kept = _masks.get(settings.user_id)
+        if kept is not None and kept[0] > settings.version:
+            return mask
+        _masks[settings.user_id] = (settings.version, mask)
+        _masks.move_to_end(settings.user_id)
+        while len(_masks) > limit:
+            _masks.popitem(last=False)
+    return mask
+
+
+def get_preference_masks(user_ids):
+    """
+    Compiled preference masks for many users, keyed by user id.
+
+    Kept masks are checked against the current settings versions in one
+    query; changed settings are loaded in one more, and users without
+    settings get default settings created in one bulk insert.
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    versions = dict(NotificationSettings.objects.filter(user_id__in=user_ids).values_list('user_id', 'version'))
+
+    masks = {}
+    stale = []
+    with _lock:
+        for user_id in user_ids:
+            kept = _masks.get(user_id)
+            if kept is not None and user_id in versions and kept[0] == versions[user_id]:
+                masks[user_id] = kept[1]
+                _masks.move_to_end(user_id)
+            else:
+                stale.append(user_id)
+
+    if stale:
+        rows = {s.user_id: s for s in NotificationSettings.objects.filter(
+            user_id__in=[user_id for user_id in stale if user_id in versions])}
+        created = [NotificationSettings(user_id=user_id) for user_id in stale if user_id not in rows]
+        if created:
+            NotificationSettings.objects.bulk_create(created, ignore_conflicts=True)
+            rows.update((s.user_id, s) for s in created)
+        for user_id in stale:
+            masks[user_id] = store_preferences(rows[user_id])
+    return masks
+
+
+def get_preference_mask(user_id):
+    """Compiled preference mask for one user"""
+    return get_preference_masks([user_id])[user_id]
+
+
+def allowed_channels(mask, notification_type):
+    """
+    Delivery channels a compiled mask allows for a notification type.
+
+    Users in digest mode get ``DIGEST`` in place of ``EMAIL``.
+    """
+    channels = [channel for bit, channel in _TYPE_BITS.get(notification_type, ()) if mask & bit]
+    if mask & DIGEST_BIT and 'EMAIL' in channels:
+        channels[channels.index('EMAIL')] = 'DIGEST'
+    return channels
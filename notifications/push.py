@@ -0,0 +1,167 @@
+"""
+Concurrent Web Push delivery.
+
+The dispatcher keeps one HTTP session (with keep-alive connections to each
+push service) and a bounded thread pool, signs one VAPID header per push
+service origin and reuses it until shortly before it expires, and deletes
+subscriptions the push service reports as gone (404/410) in one query.
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from .metrics import log_event, observe_provider
+from .models import WebPushSubscription
+
+try:
+    from py_vapid import Vapid
+    from pywebpush import WebPusher
+    WEBPUSH_AVAILABLE = True
+except ImportError:
+    WEBPUSH_AVAILABLE = False
+
+VAPID_EXPIRY = 12 * 60 * 60  # the longest expiry push services accept is 24h
+VAPID_REFRESH_MARGIN = 10 * 60
+MAX_WORKERS = 8
+TIMEOUT = 10
+
+
+def build_payload(notification):
+    """Serialized push payload for a notification"""
+    from .utils import notification_payload_url
+    return json.dumps({
+        'title': notification.title,
+        'body': notification.message,
+        'url': notification_payload_url(notification),
+        'tag': f"{notification.notification_type}-{notification.id}",
+        'data': {
+            'notification_id': notification.id,
+            'type': notification.notification_type,
+        },
+    })
+
+
+class PushResult:
+    """Outcome of a dispatch: counts plus the positions of deliveries that failed transiently"""
+
+    def __init__(self):
+        self.sent = 0
+        self.pruned = 0
+        self.failed = set()
+
+
+class PushDispatcher:
+    """Sends Web Push messages concurrently with cached VAPID headers"""
+
+    def __init__(self, private_key, contact_email='', max_workers=MAX_WORKERS, timeout=TIMEOUT, ttl=0):
+        # Accept the same key formats pywebpush.webpush() does: a key file path or the encoded key
+        if os.path.isfile(private_key):
+            self.vapid = Vapid.from_file(private_key_file=private_key)
+        else:
+            self.vapid = Vapid.from_string(private_key=private_key)
+        self.subject = f"mailto:{contact_email or 'support@mjolobid.com'}"
+        self.timeout = timeout
+        self.ttl = ttl
+        self._vapid_headers = {}
+        self._lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='webpush')
+
+    def vapid_headers(self, endpoint):
+        """Signed VAPID headers for the endpoint's push service, cached until near expiry"""
+        parsed = urlparse(endpoint)
+        origin = f'{parsed.scheme}://{parsed.netloc}'
+        now = time.time()
+        # Signing under the lock stops a burst to a new origin from signing once per thread
+        with self._lock:
+            cached = self._vapid_headers.get(origin)
+            if cached is None or cached[1] - VAPID_REFRESH_MARGIN <= now:
+                expires = int(now) + VAPID_EXPIRY
+                cached = self._vapid_headers[origin] = (
+                    self.vapid.sign({'sub': self.subject, 'aud': origin, 'exp': expires}),
+                    expires,
+                )
+            return dict(cached[0])
+
+    def _send(self, subscription, data):
+        pusher = WebPusher(
+            {
+                'endpoint': subscription.endpoint,
+                'keys': {'p256dh': subscription.p256dh_key, 'auth': subscription.auth_key},
+            },
+            requests_session=self.session,
+        )
+        # WebPusher encrypts the payload for this subscription's keys exactly once
+        started = time.monotonic()
+        try:
+            response = pusher.send(data, self.vapid_headers(subscription.endpoint), ttl=self.ttl, timeout=self.timeout)
+        except Exception as e:
+            observe_provider('PUSH', time.monotonic() - started, e, service=urlparse(subscription.endpoint).netloc)
+            raise
+        error = f'HTTP {response.status_code}' if response.status_code > 202 else None
+        observe_provider('PUSH', time.monotonic() - started, error, service=urlparse(subscription.endpoint).netloc)
+        return response.status_code
+
+    def dispatch(self, deliveries):
+        """
+        Send ``(subscription, payload)`` pairs concurrently.
+
+        Subscriptions the push service no longer knows are deleted in bulk.
+        """
+        result = PushResult()
+        if not deliveries:
+            return result
+        futures = [(subscription, self.executor.submit(self._send, subscription, data)) for subscription, data in deliveries]
+
+        stale_ids = []
+        for position, (subscription, future) in enumerate(futures):
+            try:
+                status = future.result()
+            except Exception:
+                result.failed.add(position)
+                continue
+            if status in (404, 410):
+                stale_ids.append(subscription.id)
+            elif status > 202:
+                result.failed.add(position)
+            else:
+                result.sent += 1
+
+        if stale_ids:
+            result.pruned, _ = WebPushSubscription.objects.filter(id__in=stale_ids).delete()
+        log_event('push_batch', sent=result.sent, failed=len(result.failed), pruned=result.pruned)
+        return result
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_push_dispatcher():
+    """Get the process-wide dispatcher, or None if web push isn't available or configured"""
+    global _dispatcher
+    if not WEBPUSH_AVAILABLE:
+        return None
+    private_key = getattr(settings, 'WEBPUSH_VAPID_PRIVATE_KEY', '')
+    if not private_key or not getattr(settings, 'WEBPUSH_VAPID_PUBLIC_KEY', ''):
+        return None
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = PushDispatcher(
+                private_key,
+                contact_email=getattr(settings, 'WEBPUSH_VAPID_CONTACT_EMAIL', ''),
+                max_workers=getattr(settings, 'WEBPUSH_MAX_WORKERS', MAX_WORKERS),
+                ttl=getattr(settings, 'WEBPUSH_TTL', 0),
+            )
+    return _dispatcher
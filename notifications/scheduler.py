@@ -0,0 +1,311 @@
+"""
+Time-based notifications (event reminders, premium expiry notices).
+
+Producers call ``schedule()`` with a stable key; the entry is stored in
+``ScheduledNotification`` and rescheduling the same key just moves it.
+``manage.py run_notification_scheduler`` loads the pending entries due
+within the next window (an indexed range scan on status + due_at) into an
+in-process hierarchical timer wheel and, each tick, dispatches the ones
+that have come due in batches. Marking an entry SENT and creating its
+notification happen in one transaction, so a restart never sends twice.
+
+Event reminders are cancelled when their bid or offer is deleted or
+completed (``cancel_event_reminders``), and ``dispatch`` cancels any whose
+bid or offer is no longer accepted, whatever path changed it.
+
+While the scheduler isn't running on this host, ``ScheduledNotificationMiddleware``
+has web processes send due entries themselves (``dispatch_due_inline``).
+"""
+import math
+import time
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from mjolobid.workers import is_running
+
+from .metrics import Counter, log_event
+from .models import ScheduledNotification
+
+EVENT_REMINDER_HOURS = 24
+PREMIUM_EXPIRY_DAYS = 3
+SCHEDULER_NAME = 'notification_scheduler'  # heartbeat of run_notification_scheduler
+INLINE_INTERVAL = 60  # seconds between inline dispatches in one web process
+INLINE_BATCH_SIZE = 100
+
+# related_object_type of an event reminder -> model whose row must still be ACCEPTED
+EVENT_MODELS = {
+    'bid': 'bids.Bid',
+    'offer': 'offers.Offer',
+}
+
+SCHEDULED_DISPATCHED = Counter(
+    'notifications_scheduled_total',
+    'Scheduled notifications handled, by type and outcome (sent, expired, cancelled)',
+    ('type', 'outcome'))
+
+
+def schedule(key, user, title, message, notification_type, due_at,
+             related_object_type='', related_object_id=None, expires_at=None):
+    """
+    Schedule a notification, or move an existing entry with the same key.
+
+    An entry that was already sent for the same due time is left alone, so
+    calling this again for unchanged data doesn't send a second time.
+    """
+    fields = {
+        'user': user,
+        'title': title,
+        'message': message,
+        'notification_type': notification_type,
+        'related_object_type': related_object_type,
+        'related_object_id': related_object_id,
+        'due_at': due_at,
+        'expires_at': expires_at,
+        'status': 'PENDING',
+        'sent_at': None,
+    }
+    existing = ScheduledNotification.objects.filter(key=key).first()
+    if existing is None:
+        return ScheduledNotification.objects.create(key=key, **fields)
+    if existing.status == 'SENT' and existing.due_at == due_at:
+        return existing
+    for name, value in fields.items():
+        setattr(existing, name, value)
+    existing.save()
+    return existing
+
+
+def cancel(key):
+    """Cancel a pending entry. Returns True if one was cancelled."""
+    return bool(ScheduledNotification.objects.filter(key=key, status='PENDING').update(
+        status='CANCELLED', updated_at=timezone.now()))
+
+
+def cancel_event_reminders(kind, obj_id):
+    """Cancel the pending reminders for a bid's or offer's event. Returns the number cancelled."""
+    return ScheduledNotification.objects.filter(
+        key__startswith=f'event_reminder:{kind}:{obj_id}:', status='PENDING'
+    ).update(status='CANCELLED', updated_at=timezone.now())
+
+
+def schedule_event_reminders(kind, obj, users):
+    """Remind each of ``users`` ahead of a bid's or offer's event"""
+    if not obj.event_date:
+        return
+    hours = getattr(settings, 'NOTIFICATION_EVENT_REMINDER_HOURS', EVENT_REMINDER_HOURS)
+    due_at = max(obj.event_date - timedelta(hours=hours), timezone.now())
+    when = timezone.localtime(obj.event_date).strftime('%b %d at %H:%M')
+    for user in users:
+        schedule(
+            f'event_reminder:{kind}:{obj.id}:user:{user.id}',
+            user,
+            title='Upcoming Event Reminder',
+            message=f'Reminder: "{obj.title}" is on {when}.',
+            notification_type='EVENT_REMINDER',
+            due_at=due_at,
+            related_object_type=kind,
+            related_object_id=obj.id,
+            expires_at=obj.event_date,
+        )
+
+
+def schedule_expiry_reminder(user, field):
+    """Warn a user before their premium status or subscription (``field`` on User) runs out"""
+    expires = getattr(user, field)
+    if not expires:
+        return
+    days = getattr(settings, 'NOTIFICATION_PREMIUM_EXPIRY_DAYS', PREMIUM_EXPIRY_DAYS)
+    label = 'premium membership' if field == 'premium_expires' else 'subscription'
+    schedule(
+        f'{field}:user:{user.id}',
+        user,
+        title=f'Your {label} is expiring',
+        message=f'Your {label} expires on {timezone.localtime(expires).strftime("%b %d")}. Renew to keep your benefits.',
+        notification_type='PREMIUM_EXPIRING',
+        due_at=max(expires - timedelta(days=days), timezone.now()),
+        expires_at=expires,
+    )
+
+
+class TimerWheel:
+    """
+    Hierarchical timing wheel.
+
+    Level 0 has ``slots`` buckets of ``tick`` seconds; each bucket of level
+    n spans a full turn of level n-1. An entry goes into the lowest level
+    whose range covers its delay and cascades down a level whenever the
+    level below wraps, so adding and advancing are O(1) per entry no
+    matter how many are waiting.
+    """
+
+    def __init__(self, tick=1.0, slots=64, levels=3, now=0.0):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.wheels = [[[] for _ in range(slots)] for _ in range(levels)]
+        self.current = int(now // tick)
+        self.expired = []  # due on the next advance
+        self.overflow = []  # beyond the last level's range, placed again on each of its turns
+
+    @property
+    def horizon(self):
+        """Seconds ahead the wheel can hold without overflow"""
+        return self.tick * self.slots ** self.levels
+
+    def add(self, due, item):
+        self._place(max(math.ceil(due / self.tick), 0), item)
+
+    def _place(self, ticks, item):
+        delay = ticks - self.current
+        if delay <= 0:
+            self.expired.append(item)
+            return
+        for level in range(self.levels):
+            if delay < self.slots ** (level + 1):
+                self.wheels[level][(ticks // self.slots ** level) % self.slots].append((ticks, item))
+                return
+        self.overflow.append((ticks, item))
+
+    def advance(self, now):
+        """Move the wheel to ``now`` and return the items that came due"""
+        due, self.expired = self.expired, []
+        target = int(now // self.tick)
+        while self.current < target:
+            self.current += 1
+            # Cascade from the highest level that wrapped this tick down to level 1
+            for level in range(self.levels - 1, 0, -1):
+                span = self.slots ** level
+                if self.current % span:
+                    continue
+                if level == self.levels - 1 and self.current % (span * self.slots) == 0:
+                    entries, self.overflow = self.overflow, []
+                    for ticks, item in entries:
+                        self._place(ticks, item)
+                slot = (self.current // span) % self.slots
+                entries, self.wheels[level][slot] = self.wheels[level][slot], []
+                for ticks, item in entries:
+                    self._place(ticks, item)
+            slot = self.current % self.slots
+            due.extend(item for _, item in self.wheels[0][slot])
+            self.wheels[0][slot] = []
+            due.extend(self.expired)
+            self.expired = []
+        return due
+
+
+class Scheduler:
+    """Feeds the wheel from the database and dispatches what comes due"""
+
+    def __init__(self, window=300, tick=1.0):
+        self.window = window
+        self.wheel = TimerWheel(tick=tick, now=timezone.now().timestamp())
+        self.loaded = {}  # entry id -> due timestamp currently in the wheel
+
+    def load(self):
+        """Add pending entries due before the end of the window (overdue ones included)"""
+        horizon = timezone.now() + timedelta(seconds=self.window)
+        added = 0
+        for entry_id, due_at in ScheduledNotification.objects.filter(
+            status='PENDING', due_at__lt=horizon
+        ).values_list('id', 'due_at'):
+            due = due_at.timestamp()
+            # A rescheduled entry is added again; the stale copy is ignored when it fires
+            if self.loaded.get(entry_id) != due:
+                self.loaded[entry_id] = due
+                self.wheel.add(due, (entry_id, due))
+                added += 1
+        return added
+
+    def due(self):
+        """Ids of loaded entries that have come due"""
+        ids = []
+        for entry_id, due in self.wheel.advance(timezone.now().timestamp()):
+            if self.loaded.get(entry_id) == due:
+                del self.loaded[entry_id]
+                ids.append(entry_id)
+        return ids
+
+
+def _active_events(entries):
+    """(kind, id) of the bids and offers the event reminders among ``entries`` are for that are still accepted"""
+    ids = {}
+    for entry in entries:
+        if entry.notification_type == 'EVENT_REMINDER' and entry.related_object_type in EVENT_MODELS:
+            ids.setdefault(entry.related_object_type, set()).add(entry.related_object_id)
+    return {
+        (kind, obj_id)
+        for kind, obj_ids in ids.items()
+        for obj_id in apps.get_model(EVENT_MODELS[kind]).objects.filter(
+            id__in=obj_ids, status='ACCEPTED').values_list('id', flat=True)
+    }
+
+
+def dispatch(entry_ids):
+    """
+    Send the scheduled notifications with these ids. Returns the number sent.
+
+    Each entry is claimed with a conditional UPDATE in the same transaction
+    that creates its notification, so it's sent at most once even if the
+    scheduler is restarted or another one runs. Event reminders whose bid or
+    offer is gone or no longer accepted are cancelled instead.
+    """
+    from .utils import send_notification
+
+    now = timezone.now()
+    sent = 0
+    with transaction.atomic():
+        entries = list(ScheduledNotification.objects.filter(
+            id__in=entry_ids, status='PENDING', due_at__lte=now
+        ).select_related('user'))
+        active = _active_events(entries)
+        for entry in entries:
+            if entry.expires_at is not None and entry.expires_at <= now:
+                status = 'EXPIRED'
+            elif (entry.notification_type == 'EVENT_REMINDER' and entry.related_object_type in EVENT_MODELS
+                  and (entry.related_object_type, entry.related_object_id) not in active):
+                status = 'CANCELLED'
+            else:
+                status = 'SENT'
+            if not ScheduledNotification.objects.filter(id=entry.id, status='PENDING').update(
+                status=status, sent_at=now if status == 'SENT' else None, updated_at=now
+            ):
+                continue
+            SCHEDULED_DISPATCHED.inc(type=entry.notification_type, outcome=status.lower())
+            if status != 'SENT':
+                log_event(f'scheduled_{status.lower()}', force=True, key=entry.key, due_at=entry.due_at)
+                continue
+            send_notification(
+                user=entry.user,
+                title=entry.title,
+                message=entry.message,
+                notification_type=entry.notification_type,
+                related_object_type=entry.related_object_type,
+                related_object_id=entry.related_object_id,
+            )
+            sent += 1
+    log_event('scheduled_batch', sent=sent, size=len(entry_ids))
+    return sent
+
+
+_next_inline = 0
+
+
+def dispatch_due_inline():
+    """
+    Send due entries from a web process while the scheduler isn't running on
+    this host, at most once every INLINE_INTERVAL seconds per process.
+    Returns the number sent.
+    """
+    global _next_inline
+    now = time.monotonic()
+    if now < _next_inline or is_running(SCHEDULER_NAME):
+        return 0
+    _next_inline = now + getattr(settings, 'NOTIFICATION_INLINE_SCHEDULE_INTERVAL', INLINE_INTERVAL)
+    entry_ids = list(ScheduledNotification.objects.filter(
+        status='PENDING', due_at__lte=timezone.now()
+    ).order_by('due_at').values_list('id', flat=True)[:INLINE_BATCH_SIZE])
+    return dispatch(entry_ids) if entry_ids else 0
@@ -1,7 +1,15 @@
+from datetime import timedelta
+from itertools import islice
+
 from django.utils import timezone
 from django.conf import settings
-from .models import Notification, NotificationSettings, WebPushSubscription
-import json
+from django.db import transaction
+from django.db.models import F, QuerySet
+from .counters import adjust_unread_count, forget_unread_counts
+from .jobs import enqueue_bulk, enqueue_deliveries
+from .metrics import NOTIFICATIONS_CREATED, WEBSOCKET_FANOUT_SECONDS, log_event
+from .models import Notification, WebPushSubscription
+from .preferences import allowed_channels, get_preference_mask, get_preference_masks
 
 # Try to import channels, but don't fail if it's not available
 try:
@@ -13,45 +21,80 @@ except ImportError:
 
 # Try to import pywebpush for web push notifications
 try:
-    from pywebpush import webpush, WebPushException
+    import pywebpush  # noqa: F401
     WEBPUSH_AVAILABLE = True
 except ImportError:
     WEBPUSH_AVAILABLE = False
 
+BULK_CHUNK_SIZE = 1000
+COALESCE_WINDOW = 300  # seconds
+COALESCE_TYPES = ['NEW_MESSAGE']
+
 
 def send_notification(user, title, message, notification_type, related_object_type='', related_object_id=None):
-    """Send notification to user"""
+    """
+    Send notification to user
     
-    # Create notification in database
-    notification = Notification.objects.create(
-        user=user,
-        title=title,
-        message=message,
-        notification_type=notification_type,
-        related_object_type=related_object_type,
-        related_object_id=related_object_id
+    Only the database insert and the WebSocket event happen here; email, web
+    push and SMS are queued as NotificationJobs for run_notification_workers.
+    Repeats of a coalescing type (see NOTIFICATION_COALESCE_TYPES) about the
+    same object update the user's unread notification instead of adding one.
+    """
+    # Compiled preferences from the cache (settings are created on first use)
+    channels = allowed_channels(get_preference_mask(user.id), notification_type)
+    
+    notification = _coalesce_notification(
+        user, title, message, notification_type, related_object_type, related_object_id
     )
+    if notification is None:
+        # Create notification in database
+        notification = Notification.objects.create(
+            user=user,
+            title=title,
+            message=message,
+            notification_type=notification_type,
+            related_object_type=related_object_type,
+            related_object_id=related_object_id
+        )
+        enqueue_deliveries(notification, channels)
+        adjust_unread_count(user.id, 1)
+        NOTIFICATIONS_CREATED.inc(type=notification_type)
     
-    # Get user's notification settings
-    try:
-        settings = user.notification_settings
-    except NotificationSettings.DoesNotExist:
-        settings = NotificationSettings.objects.create(user=user)
+    # Real-time notification via WebSocket right away, everything else through the queue
+    if 'PUSH' in channels:
+        send_websocket_notification(user, notification)
     
-    # Send email notification first (most reliable method)
-    # Email notifications are enabled by default for bids and messages
-    if _should_send_email_notification(notification_type, settings):
-        send_email_notification(user, notification)
+    return notification
+
+
+def _coalesce_notification(user, title, message, notification_type, related_object_type, related_object_id):
+    """
+    Fold a repeat into the user's recent unread notification about the same object.
     
-    # Send real-time notification via WebSocket and Push (optional, less reliable)
-    if _should_send_push_notification(notification_type, settings):
-        send_websocket_notification(user, notification)
-        send_web_push_notification(user, notification)
+    Returns the updated notification, or None if a new one should be created.
+    The merged notification keeps its single round of deliveries: queued
+    jobs that haven't run yet pick up the new text, sent ones aren't repeated.
+    """
+    window = getattr(settings, 'NOTIFICATION_COALESCE_WINDOW', COALESCE_WINDOW)
+    types = getattr(settings, 'NOTIFICATION_COALESCE_TYPES', COALESCE_TYPES)
+    if not window or notification_type not in types or related_object_id is None:
+        return None
     
-    # Send SMS notification (if enabled)
-    if _should_send_sms_notification(notification_type, settings):
-        send_sms_notification(user, notification)
+    notification = Notification.objects.filter(
+        user=user,
+        notification_type=notification_type,
+        related_object_type=related_object_type,
+        related_object_id=related_object_id,
+        is_read=False,
+        created_at__gte=timezone.now() - timedelta(seconds=window),
+    ).order_by('-created_at').first()
+    if notification is None:
+        return None
     
+    Notification.objects.filter(id=notification.id).update(title=title, message=message, count=F('count') + 1)
+    notification.title = title
+    notification.message = message
+    notification.count += 1
     return notification
 
 
@@ -64,93 +107,47 @@ def send_websocket_notification(user, notification):
     try:
         channel_layer = get_channel_layer()
         
-        async_to_sync(channel_layer.group_send)(
-            f'notifications_{user.id}',
-            {
-                'type': 'notification_message',
-                'message': notification.message,
-                'title': notification.title,
-                'notification_type': notification.notification_type,
-                'timestamp': timezone.now().isoformat(),
-            }
-        )
+        with WEBSOCKET_FANOUT_SECONDS.time(type=notification.notification_type):
+            async_to_sync(channel_layer.group_send)(
+                f'notifications_{user.id}',
+                {
+                    'type': 'notification_message',
+                    'message': notification.message,
+                    'title': notification.title,
+                    'notification_type': notification.notification_type,
+                    'timestamp': timezone.now().isoformat(),
+                }
+            )
     except Exception as e:
         # Log error but don't fail the notification
-        print(f"WebSocket notification failed: {e}")
-        pass
+        log_event('websocket_failed', force=True, user_id=user.id, notification_id=notification.id, error=str(e))
 
 
 def send_web_push_notification(user, notification):
-    """Send push notification using the Web Push protocol"""
+    """
+    Send push notification using the Web Push protocol
+    
+    Returns the number of subscriptions that failed and are worth retrying.
+    """
+    from .push import build_payload, get_push_dispatcher
+    
     if not WEBPUSH_AVAILABLE:
-        print("Web push not available: pywebpush not installed")
-        return
-
-    vapid_public_key = getattr(settings, 'WEBPUSH_VAPID_PUBLIC_KEY', '')
-    vapid_private_key = getattr(settings, 'WEBPUSH_VAPID_PRIVATE_KEY', '')
-    vapid_contact_email = getattr(settings, 'WEBPUSH_VAPID_CONTACT_EMAIL', '')
-
-    if not vapid_public_key or not vapid_private_key:
-        print(f"Web push not configured: public_key={bool(vapid_public_key)} (length: {len(vapid_public_key) if vapid_public_key else 0}), private_key={bool(vapid_private_key)} (length: {len(vapid_private_key) if vapid_private_key else 0})")
-        return
-
-    payload = {
-        'title': notification.title,
-        'body': notification.message,
-        'url': notification_payload_url(notification),
-        'tag': f"{notification.notification_type}-{notification.id}",
-        'data': {
-            'notification_id': notification.id,
-            'type': notification.notification_type,
-        },
-    }
-
-    subscriptions = WebPushSubscription.objects.filter(user=user)
-    if not subscriptions.exists():
-        print(f"No push subscriptions found for user {user.username}")
-        return
+        log_event('push_unavailable', force=True, reason='pywebpush not installed')
+        return 0
     
-    print(f"Sending push notification to {subscriptions.count()} subscription(s) for user {user.username}")
-
-    for subscription in subscriptions:
-        try:
-            # pywebpush 2.x API - only needs vapid_private_key and vapid_claims
-            # The public key is derived from the private key automatically
-            vapid_claims = {
-                "sub": f"mailto:{vapid_contact_email}" if vapid_contact_email else "mailto:support@mjolobid.com"
-            }
-            
-            print(f"Attempting to send push notification to {subscription.endpoint[:50]}...")
-            print(f"VAPID private key length: {len(vapid_private_key)}")
-            print(f"Payload: {json.dumps(payload)}")
-            
-            result = webpush(
-                subscription_info={
-                    "endpoint": subscription.endpoint,
-                    "keys": {
-                        "p256dh": subscription.p256dh_key,
-                        "auth": subscription.auth_key,
-                    },
-                },
-                data=json.dumps(payload),
-                vapid_private_key=vapid_private_key,
-                vapid_claims=vapid_claims,
-            )
-            print(f"Push notification sent successfully! Response: {result}")
-        except WebPushException as exc:
-            # Remove stale subscriptions (410 Gone or 404 Not Found)
-            status = getattr(exc.response, 'status_code', None)
-            if status in (404, 410):
-                print(f"Removing stale subscription (status {status}): {subscription.endpoint[:50]}...")
-                subscription.delete()
-            else:
-                print(f"Web push failed for {subscription.endpoint[:50]}...: {exc}")
-                import traceback
-                traceback.print_exc()
-        except Exception as exc:
-            print(f"Unexpected web push error for {subscription.endpoint[:50]}...: {exc}")
-            import traceback
-            traceback.print_exc()
+    dispatcher = get_push_dispatcher()
+    if dispatcher is None:
+        log_event('push_unavailable', force=True,
+                  reason='WEBPUSH_VAPID_PUBLIC_KEY and WEBPUSH_VAPID_PRIVATE_KEY are required')
+        return 0
+    
+    subscriptions = list(WebPushSubscription.objects.filter(user=user))
+    if not subscriptions:
+        return 0
+    
+    data = build_payload(notification)
+    result = dispatcher.dispatch([(subscription, data) for subscription in subscriptions])
+    return len(result.failed)
 
 
 def notification_payload_url(notification):
@@ -178,108 +175,151 @@ def notification_payload_url(notification):
     return f"{base_url}{target_path}"
 
 
-def send_email_notification(user, notification):
-    """Send email notification"""
-    from django.core.mail import send_mail, EmailMultiAlternatives
+def build_email_message(user, notification):
+    """Build the email for a notification, or None if the user has no email address"""
+    from django.core.mail import EmailMultiAlternatives
     from django.template.loader import render_to_string
     from django.conf import settings as django_settings
-    from django.utils import timezone
     
-    try:
-        # Get user's email
-        user_email = user.email
-        if not user_email:
-            print(f"Cannot send email notification: User {user.username} has no email address")
-            return
-        
-        # Determine email template based on notification type
-        template_name = 'emails/notification.html'
-        subject_prefix = 'MjoloBid Notification'
-        
-        # Customize subject and template based on notification type
-        # Use professional, non-spammy language
-        if notification.notification_type == 'NEW_MESSAGE':
-            # Extract sender name from message
-            message_text = notification.message
-            if ' sent you a message' in message_text:
-                sender_name = message_text.split(' sent you a message')[0]
-                subject = f'New message from {sender_name} - MjoloBid'
-            elif ' sent you a message in' in message_text:
-                sender_name = message_text.split(' sent you a message in')[0]
-                subject = f'New message from {sender_name} - MjoloBid'
-            else:
-                subject = f'New message received - MjoloBid'
-        elif notification.notification_type == 'OFFER_BID':
-            subject = f'New bid received on your offer - MjoloBid'
-        elif notification.notification_type == 'OFFER_ACCEPTED':
-            subject = f'Your bid has been selected - MjoloBid'
-        elif notification.notification_type == 'BID_ACCEPTED':
-            subject = f'Your bid has been accepted - MjoloBid'
+    # Get user's email
+    user_email = user.email
+    if not user_email:
+        log_event('email_skipped', force=True, user_id=user.id, notification_id=notification.id, reason='no email address')
+        return None
+    
+    base_url = getattr(django_settings, 'SITE_URL', 'http://localhost:8000').rstrip('/')
+    
+    # Customize subject based on notification type
+    # Use professional, non-spammy language
+    if notification.notification_type == 'NEW_MESSAGE':
+        # Extract sender name from message
+        message_text = notification.message
+        if ' sent you a message' in message_text:
+            sender_name = message_text.split(' sent you a message')[0]
+            subject = f'New message from {sender_name} - MjoloBid'
         else:
-            subject = f'{notification.title} - MjoloBid'
-        
-        # Build notification URL (already includes full URL with domain)
-        full_url = notification_payload_url(notification)
-        
-        # Prepare email context
-        context = {
-            'user': user,
-            'notification': notification,
-            'title': notification.title,
-            'message': notification.message,
-            'notification_url': full_url,
-            'site_name': 'MjoloBid',
-            'site_url': base_url,
+            subject = f'New message received - MjoloBid'
+    elif notification.notification_type == 'OFFER_BID':
+        subject = f'New bid received on your offer - MjoloBid'
+    elif notification.notification_type == 'OFFER_ACCEPTED':
+        subject = f'Your bid has been selected - MjoloBid'
+    elif notification.notification_type == 'BID_ACCEPTED':
+        subject = f'Your bid has been accepted - MjoloBid'
+    else:
+        subject = f'{notification.title} - MjoloBid'
+    
+    # Build notification URL (already includes full URL with domain)
+    full_url = notification_payload_url(notification)
+    
+    # Prepare email context
+    context = {
+        'user': user,
+        'notification': notification,
+        'title': notification.title,
+        'message': notification.message,
+        'notification_url': full_url,
+        'site_name': 'MjoloBid',
+        'site_url': base_url,
+    }
+    
+    # Render email templates
+    html_message = render_to_string('emails/notification.html', context)
+    text_message = render_to_string('emails/notification.txt', context)
+    
+    # Improved headers for better deliverability
+    email = EmailMultiAlternatives(
+        subject=subject,
+        body=text_message,
+        from_email=getattr(django_settings, 'DEFAULT_FROM_EMAIL', 'noreply@mjolobid.com'),
+        to=[user_email],
+        headers={
+            'X-Mailer': 'MjoloBid Notification System',
+            'X-Priority': '3',  # Normal priority
+            'X-MSMail-Priority': 'Normal',
+            'Importance': 'Normal',
+            'List-Unsubscribe': f'<{base_url}/notifications/unsubscribe/>',
+            'List-Unsubscribe-Post': 'List-Unsubscribe=One-Click',
+            'Message-ID': f'<notification-{notification.id}-{int(timezone.now().timestamp())}@mjolobid.com>',
+            'Reply-To': getattr(django_settings, 'DEFAULT_FROM_EMAIL', 'noreply@mjolobid.com'),
         }
-        
-        # Render email templates
-        html_message = render_to_string('emails/notification.html', context)
-        text_message = render_to_string('emails/notification.txt', context)
-        
-        # Send email with improved headers for better deliverability
-        email = EmailMultiAlternatives(
-            subject=subject,
-            body=text_message,
-            from_email=getattr(django_settings, 'DEFAULT_FROM_EMAIL', 'noreply@mjolobid.com'),
-            to=[user_email],
-            headers={
-                'X-Mailer': 'MjoloBid Notification System',
-                'X-Priority': '3',  # Normal priority
-                'X-MSMail-Priority': 'Normal',
-                'Importance': 'Normal',
-                'List-Unsubscribe': f'<{base_url}/notifications/unsubscribe/>',
-                'List-Unsubscribe-Post': 'List-Unsubscribe=One-Click',
-                'Message-ID': f'<notification-{notification.id}-{int(timezone.now().timestamp())}@mjolobid.com>',
-                'Reply-To': getattr(django_settings, 'DEFAULT_FROM_EMAIL', 'noreply@mjolobid.com'),
-            }
-        )
-        email.attach_alternative(html_message, "text/html")
+    )
+    email.attach_alternative(html_message, "text/html")
+    return email
+
+
+def build_digest_message(user, notifications):
+    """Build one email summarising several notifications, or None if the user has no email address"""
+    from django.core.mail import EmailMultiAlternatives
+    from django.template.loader import render_to_string
+    from django.conf import settings as django_settings
+    
+    if not user.email:
+        log_event('digest_skipped', force=True, user_id=user.id, reason='no email address')
+        return None
+    
+    base_url = getattr(django_settings, 'SITE_URL', 'http://localhost:8000').rstrip('/')
+    total = sum(notification.count for notification in notifications)
+    title = f'You have {total} new notification{"s" if total != 1 else ""}'
+    lines = []
+    for notification in notifications:
+        repeat = f' ({notification.count}x)' if notification.count > 1 else ''
+        lines.append(f'- {notification.title}{repeat}: {notification.message}')
+    
+    # Same templates as single notifications, with the list as the message
+    context = {
+        'user': user,
+        'title': title,
+        'message': '\n'.join(lines),
+        'notification_url': f'{base_url}/notifications/',
+        'site_name': 'MjoloBid',
+        'site_url': base_url,
+    }
+    html_message = render_to_string('emails/notification.html', context)
+    text_message = render_to_string('emails/notification.txt', context)
+    
+    email = EmailMultiAlternatives(
+        subject=f'{title} - MjoloBid',
+        body=text_message,
+        from_email=getattr(django_settings, 'DEFAULT_FROM_EMAIL', 'noreply@mjolobid.com'),
+        to=[user.email],
+        headers={
+            'X-Mailer': 'MjoloBid Notification System',
+            'List-Unsubscribe': f'<{base_url}/notifications/unsubscribe/>',
+            'List-Unsubscribe-Post': 'List-Unsubscribe=One-Click',
+            'Message-ID': f'<digest-{user.id}-{int(timezone.now().timestamp())}@mjolobid.com>',
+            'Reply-To': getattr(django_settings, 'DEFAULT_FROM_EMAIL', 'noreply@mjolobid.com'),
+        }
+    )
+    email.attach_alternative(html_message, "text/html")
+    return email
+
+
+def send_email_notification(user, notification):
+    """Send email notification right away (the queue workers use build_email_message)"""
+    try:
+        email = build_email_message(user, notification)
+        if email is None:
+            return
         email.send(fail_silently=False)
         
         # Mark notification as sent
         notification.mark_as_sent()
-        print(f"Email notification sent successfully to {user_email} for notification: {notification.title}")
+        log_event('email_sent', user_id=user.id, notification_id=notification.id)
         
     except Exception as e:
         error_msg = str(e)
-        print(f"Failed to send email notification to {user.username}: {error_msg}")
-        
-        # Provide helpful error messages
+        fields = {}
+        # Point at the usual causes
         if 'BadCredentials' in error_msg or 'Authentication failed' in error_msg or '535' in error_msg:
-            print("\n⚠️  Email authentication failed. For Gmail:")
-            print("   1. Enable 2-Factor Authentication on your Google account")
-            print("   2. Generate an 'App Password' at: https://myaccount.google.com/apppasswords")
-            print("   3. Use the App Password (16 characters, no spaces) instead of your regular password")
-            print("   4. Make sure EMAIL_HOST_USER is your full Gmail address (mjolobidapp@gmail.com)")
-            print("   5. Update EMAIL_HOST_PASSWORD in settings.py with the App Password")
+            fields['hint'] = ('authentication failed - for Gmail, enable 2FA and set EMAIL_HOST_PASSWORD to an App Password '
+                              'and EMAIL_HOST_USER to the full address')
         elif 'Connection refused' in error_msg or 'Connection timed out' in error_msg:
-            print("\n⚠️  Could not connect to email server. Check:")
-            print("   - EMAIL_HOST is correct (smtp.gmail.com for Gmail)")
-            print("   - EMAIL_PORT is correct (587 for TLS)")
-            print("   - Your internet connection")
+            fields['hint'] = 'could not connect - check EMAIL_HOST, EMAIL_PORT (587 for TLS) and the network'
         else:
             import traceback
-            traceback.print_exc()
+            fields['traceback'] = traceback.format_exc()
+        log_event('email_failed', force=True, user_id=user.id, notification_id=notification.id,
+                  error=f'{type(e).__name__}: {e}', **fields)
         
         # Don't mark as sent if email failed, but notification is still created in database
 
@@ -292,58 +332,65 @@ def send_sms_notification(user, notification):
     pass
 
 
-def _should_send_push_notification(notification_type, settings):
-    """Check if push notification should be sent"""
-    if notification_type == 'BID_ACCEPTED' and settings.push_bid_updates:
-        return True
-    elif notification_type == 'NEW_MESSAGE' and settings.push_messages:
-        return True
-    elif notification_type in ['OFFER_BID', 'OFFER_ACCEPTED'] and settings.push_bid_updates:
-        return True
-    elif notification_type in ['PAYMENT_RECEIVED', 'PAYMENT_SENT'] and settings.push_payments:
-        return True
-    elif notification_type == 'SYSTEM_ANNOUNCEMENT' and settings.push_system:
-        return True
-    return False
-
-
-def _should_send_email_notification(notification_type, settings):
-    """Check if email notification should be sent"""
-    # Email notifications are enabled by default for bids and messages
-    if notification_type == 'BID_ACCEPTED' and settings.email_bid_updates:
-        return True
-    elif notification_type == 'NEW_MESSAGE' and settings.email_messages:
-        return True
-    elif notification_type in ['OFFER_BID', 'OFFER_ACCEPTED'] and settings.email_bid_updates:
-        return True
-    elif notification_type in ['PAYMENT_RECEIVED', 'PAYMENT_SENT'] and settings.email_payments:
-        return True
-    elif notification_type == 'SYSTEM_ANNOUNCEMENT' and settings.email_system:
-        return True
-    return False
-
-
-def _should_send_sms_notification(notification_type, settings):
-    """Check if SMS notification should be sent"""
-    if notification_type in ['PAYMENT_RECEIVED', 'PAYMENT_SENT'] and settings.sms_payments:
-        return True
-    elif notification_type in ['BID_ACCEPTED', 'PAYMENT_RECEIVED'] and settings.sms_urgent:
-        return True
-    return False
+def _user_chunks(users, chunk_size):
+    """Yield lists of users, streaming querysets from the database chunk by chunk"""
+    if isinstance(users, QuerySet):
+        users = users.only('id').order_by('pk').iterator(chunk_size=chunk_size)
+    users = iter(users)
+    while True:
+        chunk = list(islice(users, chunk_size))
+        if not chunk:
+            return
+        yield chunk
 
 
-def send_bulk_notification(users, title, message, notification_type):
-    """Send notification to multiple users"""
-    notifications = []
-    for user in users:
-        notification = send_notification(
+def _send_notification_chunk(users, title, message, notification_type, related_object_type, related_object_id):
+    """Store and queue one chunk of a bulk notification. Returns (created, needing a WebSocket event)."""
+    masks = get_preference_masks([user.id for user in users])
+    
+    notifications = Notification.objects.bulk_create([
+        Notification(
             user=user,
             title=title,
             message=message,
-            notification_type=notification_type
+            notification_type=notification_type,
+            related_object_type=related_object_type,
+            related_object_id=related_object_id,
         )
-        notifications.append(notification)
-    return notifications
+        for user in users
+    ])
+    
+    routed = [
+        (notification, allowed_channels(masks[notification.user_id], notification_type))
+        for notification in notifications
+    ]
+    enqueue_bulk(routed)
+    forget_unread_counts([notification.user_id for notification in notifications])
+    NOTIFICATIONS_CREATED.inc(len(notifications), type=notification_type)
+    return notifications, [notification for notification, channels in routed if 'PUSH' in channels]
+
+
+def send_bulk_notification(users, title, message, notification_type, related_object_type='',
+                           related_object_id=None, chunk_size=BULK_CHUNK_SIZE):
+    """
+    Send notification to multiple users
+    
+    Recipients are processed ``chunk_size`` at a time: one INSERT for the
+    notifications, one preferences lookup and one INSERT for the queued
+    deliveries per chunk, so memory stays bounded however many users there
+    are. Returns the number of notifications created.
+    """
+    total = 0
+    for chunk in _user_chunks(users, chunk_size):
+        with transaction.atomic():
+            notifications, live = _send_notification_chunk(
+                chunk, title, message, notification_type, related_object_type, related_object_id
+            )
+        # WebSocket events only once the chunk is committed
+        for notification in live:
+            send_websocket_notification(notification.user, notification)
+        total += len(notifications)
+    return total
 
 
 def send_admin_notification(message, notification_type='SYSTEM'):
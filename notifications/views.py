@@ -1,11 +1,13 @@
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse, HttpResponseBadRequest
+from django.conf import settings as django_settings
+from django.http import HttpResponse, JsonResponse, HttpResponseBadRequest
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 from django.utils import timezone
 from django.core.paginator import Paginator
 import json
+from .counters import get_unread_count as cached_unread_count, refresh_unread_count
 from .models import Notification, NotificationSettings, WebPushSubscription
 from .utils import send_notification
 
@@ -26,11 +28,12 @@ def notifications(request):
             is_read=True,
             read_at=timezone.now()
         )
+        refresh_unread_count(request.user.id)
         return redirect('notifications:notifications')
     
     context = {
         'page_obj': page_obj,
-        'unread_count': Notification.objects.filter(user=request.user, is_read=False).count(),
+        'unread_count': cached_unread_count(request.user.id),
     }
     
     return render(request, 'notifications/notifications.html', context)
@@ -59,6 +62,7 @@ def mark_all_read(request):
         is_read=True,
         read_at=timezone.now()
     )
+    refresh_unread_count(request.user.id)
     return JsonResponse({'status': 'success'})
 
 
@@ -77,6 +81,7 @@ def notification_settings(request):
         settings.email_payments = request.POST.get('email_payments') == 'on'
         settings.email_promotions = request.POST.get('email_promotions') == 'on'
         settings.email_system = request.POST.get('email_system') == 'on'
+        settings.email_digest = request.POST.get('email_digest') == 'on'
         
         settings.push_bid_updates = request.POST.get('push_bid_updates') == 'on'
         settings.push_messages = request.POST.get('push_messages') == 'on'
@@ -97,11 +102,23 @@ def notification_settings(request):
     return render(request, 'notifications/notification_settings.html', context)
 
 
+def metrics(request):
+    """Notification delivery metrics in the Prometheus text format"""
+    from .metrics import CONTENT_TYPE, render
+    
+    token = getattr(django_settings, 'METRICS_TOKEN', '')
+    authorized = request.user.is_authenticated and request.user.is_staff
+    if token and request.headers.get('Authorization') == f'Bearer {token}':
+        authorized = True
+    if not authorized:
+        return HttpResponse(status=404)
+    return HttpResponse(render(), content_type=CONTENT_TYPE)
+
+
 @login_required
 def get_unread_count(request):
-    """Get unread notification count via AJAX"""
-    count = Notification.objects.filter(user=request.user, is_read=False).count()
-    return JsonResponse({'count': count})
+    """Get unread notification count via AJAX (also pushed over the notifications socket)"""
+    return JsonResponse({'count': cached_unread_count(request.user.id)})
 
 
 @csrf_exempt
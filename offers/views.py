@@ -364,6 +364,10 @@ def choose_bid(request, offer_id, bid_id):
         offer.accepted_at = timezone.now()
         offer.save()
         
+        # Remind both sides ahead of the event
+        from notifications.scheduler import schedule_event_reminders
+        schedule_event_reminders('offer', offer, [offer.user, offer.accepted_by])
+        
         # Send notifications
         from notifications.utils import send_notification
         
@@ -524,6 +528,9 @@ def delete_offer(request, offer_id):
                 related_object_id=offer.id
             )
         
+        from notifications.scheduler import cancel_event_reminders
+        cancel_event_reminders('offer', offer.id)
+        
         offer.delete()
         messages.success(request, 'Offer deleted successfully!')
         return redirect('offers:my_offers')
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import PaymentMethod, Transaction, Wallet, EscrowTransaction, Subscription, WithdrawalRequest
+from .models import PaymentMethod, Transaction, Wallet, EscrowTransaction, Subscription, WithdrawalRequest, WebhookEvent
 
 
 @admin.register(PaymentMethod)
@@ -50,3 +50,11 @@ class WithdrawalRequestAdmin(admin.ModelAdmin):
     list_filter = ('status', 'created_at')
     search_fields = ('user__username',)
     raw_id_fields = ('user', 'payment_method', 'transaction', 'processed_by')
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ('id', 'gateway', 'event_id', 'status', 'attempts', 'received_at', 'processed_at')
+    list_filter = ('gateway', 'status')
+    search_fields = ('event_id', 'last_error')
+    readonly_fields = ('received_at', 'processed_at')
@@ -7,11 +7,13 @@ from .base import PaymentGateway
 from .ecocash import EcoCashGateway
 from .paynow import PaynowGateway
 from .pesepay import PesepayGateway
+from .transport import GatewayUnavailable
 
 __all__ = [
     'PaymentGateway',
     'EcoCashGateway',
     'PaynowGateway',
     'PesepayGateway',
+    'GatewayUnavailable',
 ]
 
@@ -5,6 +5,7 @@ from abc import ABC, abstractmethod
 from decimal import Decimal
 from typing import Dict, Optional
 from django.conf import settings
+from .transport import get_transport
 
 
 class PaymentGateway(ABC):
@@ -13,6 +14,8 @@ class PaymentGateway(ABC):
     def __init__(self, config: Optional[Dict] = None):
         self.config = config or {}
         self.gateway_name = self.__class__.__name__
+        # Shared per gateway class: pooled connections, retries and circuit breaker
+        self.http = get_transport(self.gateway_name)
     
     @abstractmethod
     def initiate_payment(self, amount: Decimal, currency: str, reference: str, 
@@ -60,7 +63,8 @@ class PaymentGateway(ABC):
                 'status': str,
                 'amount': Decimal,
                 'gateway_response': dict,
-                'error': str (if failed)
+                'error': str (if failed),
+                'invalid_signature': bool (if the callback failed verification, so retrying can't help)
             }
         """
         pass
@@ -2,7 +2,6 @@
 EcoCash Payment Gateway Integration
 EcoCash is Zimbabwe's most popular mobile money service
 """
-import requests
 import hashlib
 import hmac
 import json
@@ -10,6 +9,10 @@ from decimal import Decimal
 from typing import Dict, Optional
 from django.conf import settings
 from .base import PaymentGateway
+from .tokens import TokenCache
+
+# Shared by every EcoCashGateway in the process (and across workers via the cache)
+ACCESS_TOKENS = TokenCache('ecocash_token')
 
 
 class EcoCashGateway(PaymentGateway):
@@ -28,19 +31,23 @@ class EcoCashGateway(PaymentGateway):
     
     def __init__(self, config: Optional[Dict] = None):
         super().__init__(config)
-        self.client_id = config.get('client_id') or getattr(settings, 'ECOCASH_CLIENT_ID', '')
-        self.client_secret = config.get('client_secret') or getattr(settings, 'ECOCASH_CLIENT_SECRET', '')
-        self.merchant_id = config.get('merchant_id') or getattr(settings, 'ECOCASH_MERCHANT_ID', '')
-        self.api_url = config.get('api_url') or getattr(settings, 'ECOCASH_API_URL', 'https://api.ecocash.co.zw')
-        self.sandbox = config.get('sandbox', False) or getattr(settings, 'ECOCASH_SANDBOX', False)
+        self.client_id = self.config.get('client_id') or getattr(settings, 'ECOCASH_CLIENT_ID', '')
+        self.client_secret = self.config.get('client_secret') or getattr(settings, 'ECOCASH_CLIENT_SECRET', '')
+        self.merchant_id = self.config.get('merchant_id') or getattr(settings, 'ECOCASH_MERCHANT_ID', '')
+        self.api_url = self.config.get('api_url') or getattr(settings, 'ECOCASH_API_URL', 'https://api.ecocash.co.zw')
+        self.sandbox = self.config.get('sandbox', False) or getattr(settings, 'ECOCASH_SANDBOX', False)
         
         if self.sandbox:
             self.api_url = 'https://sandbox.ecocash.co.zw'  # Update with actual sandbox URL
     
-    def _get_access_token(self) -> Optional[str]:
-        """Get OAuth access token from EcoCash API"""
+    @property
+    def _token_key(self) -> str:
+        return f'{self.api_url}|{self.client_id}'
+    
+    def _fetch_access_token(self):
+        """Request a new OAuth access token from EcoCash API; returns (token, expires_in)"""
         try:
-            response = requests.post(
+            response = self.http.post(
                 f'{self.api_url}/oauth/token',
                 data={
                     'grant_type': 'client_credentials',
@@ -48,18 +55,40 @@ class EcoCashGateway(PaymentGateway):
                     'client_secret': self.client_secret,
                 },
                 headers={'Content-Type': 'application/x-www-form-urlencoded'},
-                timeout=30
+                idempotent=True,  # asking for a token again is harmless
             )
             
             if response.status_code == 200:
                 data = response.json()
-                return data.get('access_token')
+                return data.get('access_token'), data.get('expires_in')
             else:
                 print(f"EcoCash token error: {response.status_code} - {response.text}")
-                return None
+                return None, None
         except Exception as e:
             print(f"EcoCash token exception: {str(e)}")
-            return None
+            return None, None
+    
+    def _get_access_token(self) -> Optional[str]:
+        """Get OAuth access token, cached across requests and workers until shortly before it expires"""
+        return ACCESS_TOKENS.get(self._token_key, self._fetch_access_token)
+    
+    def _authorized_request(self, method: str, url: str, headers: Optional[Dict] = None, **kwargs):
+        """
+        Call the API with the cached access token
+        
+        A token EcoCash rejects (401) is dropped and the call is retried once
+        with a fresh one. Returns None if no token could be obtained.
+        """
+        for attempt in range(2):
+            access_token = self._get_access_token()
+            if not access_token:
+                return None
+            response = self.http.request(
+                method, url, headers={**(headers or {}), 'Authorization': f'Bearer {access_token}'}, **kwargs
+            )
+            if response.status_code != 401 or attempt:
+                return response
+            ACCESS_TOKENS.invalidate(self._token_key, access_token)
     
     def initiate_payment(self, amount: Decimal, currency: str, reference: str,
                         customer_phone: str, customer_email: str = '',
@@ -73,14 +102,6 @@ class EcoCashGateway(PaymentGateway):
             # Format phone number
             phone = self.format_phone_number(customer_phone)
             
-            # Get access token
-            access_token = self._get_access_token()
-            if not access_token:
-                return {
-                    'success': False,
-                    'error': 'Failed to authenticate with EcoCash API'
-                }
-            
             # Prepare payment request
             payment_data = {
                 'merchant_id': self.merchant_id,
@@ -93,15 +114,19 @@ class EcoCashGateway(PaymentGateway):
             }
             
             # Make API request
-            response = requests.post(
+            response = self._authorized_request(
+                'POST',
                 f'{self.api_url}/api/v1/payments',
                 json=payment_data,
                 headers={
-                    'Authorization': f'Bearer {access_token}',
                     'Content-Type': 'application/json',
-                },
-                timeout=30
+                }
             )
+            if response is None:
+                return {
+                    'success': False,
+                    'error': 'Failed to authenticate with EcoCash API'
+                }
             
             if response.status_code in [200, 201]:
                 data = response.json()
@@ -128,21 +153,13 @@ class EcoCashGateway(PaymentGateway):
     def verify_payment(self, payment_reference: str) -> Dict:
         """Verify payment status"""
         try:
-            access_token = self._get_access_token()
-            if not access_token:
+            response = self._authorized_request('GET', f'{self.api_url}/api/v1/payments/{payment_reference}')
+            if response is None:
                 return {
                     'success': False,
                     'error': 'Failed to authenticate with EcoCash API'
                 }
             
-            response = requests.get(
-                f'{self.api_url}/api/v1/payments/{payment_reference}',
-                headers={
-                    'Authorization': f'Bearer {access_token}',
-                },
-                timeout=30
-            )
-            
             if response.status_code == 200:
                 data = response.json()
                 status = data.get('status', 'PENDING').upper()
@@ -8,7 +8,6 @@ Paynow is a popular payment aggregator in Zimbabwe supporting:
 - VISA/MasterCard
 - PayPal
 """
-import requests
 import hashlib
 from decimal import Decimal
 from typing import Dict, Optional
@@ -31,10 +30,10 @@ class PaynowGateway(PaymentGateway):
     
     def __init__(self, config: Optional[Dict] = None):
         super().__init__(config)
-        self.integration_id = config.get('integration_id') or getattr(settings, 'PAYNOW_INTEGRATION_ID', '')
-        self.integration_key = config.get('integration_key') or getattr(settings, 'PAYNOW_INTEGRATION_KEY', '')
-        self.api_url = config.get('api_url') or getattr(settings, 'PAYNOW_API_URL', 'https://www.paynow.co.zw/Interface/API')
-        self.sandbox = config.get('sandbox', False) or getattr(settings, 'PAYNOW_SANDBOX', False)
+        self.integration_id = self.config.get('integration_id') or getattr(settings, 'PAYNOW_INTEGRATION_ID', '')
+        self.integration_key = self.config.get('integration_key') or getattr(settings, 'PAYNOW_INTEGRATION_KEY', '')
+        self.api_url = self.config.get('api_url') or getattr(settings, 'PAYNOW_API_URL', 'https://www.paynow.co.zw/Interface/API')
+        self.sandbox = self.config.get('sandbox', False) or getattr(settings, 'PAYNOW_SANDBOX', False)
         
         if self.sandbox:
             self.api_url = 'https://sandbox.paynow.co.zw/Interface/API'  # Update with actual sandbox URL
@@ -71,10 +70,9 @@ class PaynowGateway(PaymentGateway):
             payment_data['hash'] = self._create_hash(payment_data)
             
             # Make API request
-            response = requests.post(
+            response = self.http.post(
                 f'{self.api_url}/InitiateTransaction',
-                data=payment_data,
-                timeout=30
+                data=payment_data
             )
             
             if response.status_code == 200:
@@ -125,7 +123,7 @@ class PaynowGateway(PaymentGateway):
         try:
             poll_url = f'{self.api_url}/GetTransactionStatus/{payment_reference}'
             
-            response = requests.get(poll_url, timeout=30)
+            response = self.http.get(poll_url)
             
             if response.status_code == 200:
                 # Parse response
@@ -172,7 +170,8 @@ class PaynowGateway(PaymentGateway):
             if received_hash != calculated_hash:
                 return {
                     'success': False,
-                    'error': 'Hash verification failed'
+                    'error': 'Hash verification failed',
+                    'invalid_signature': True,
                 }
             
             payment_reference = request_data.get('reference', '')
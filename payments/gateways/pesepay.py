@@ -2,7 +2,6 @@
 Pesepay Payment Gateway Integration
 Pesepay supports EcoCash, VISA, and other payment methods
 """
-import requests
 import hashlib
 import hmac
 import json
@@ -27,10 +26,10 @@ class PesepayGateway(PaymentGateway):
     
     def __init__(self, config: Optional[Dict] = None):
         super().__init__(config)
-        self.api_key = config.get('api_key') or getattr(settings, 'PESEPAY_API_KEY', '')
-        self.secret_key = config.get('secret_key') or getattr(settings, 'PESEPAY_SECRET_KEY', '')
-        self.api_url = config.get('api_url') or getattr(settings, 'PESEPAY_API_URL', 'https://api.pesepay.com')
-        self.sandbox = config.get('sandbox', False) or getattr(settings, 'PESEPAY_SANDBOX', False)
+        self.api_key = self.config.get('api_key') or getattr(settings, 'PESEPAY_API_KEY', '')
+        self.secret_key = self.config.get('secret_key') or getattr(settings, 'PESEPAY_SECRET_KEY', '')
+        self.api_url = self.config.get('api_url') or getattr(settings, 'PESEPAY_API_URL', 'https://api.pesepay.com')
+        self.sandbox = self.config.get('sandbox', False) or getattr(settings, 'PESEPAY_SANDBOX', False)
         
         if self.sandbox:
             self.api_url = 'https://sandbox.pesepay.com'  # Update with actual sandbox URL
@@ -67,14 +66,13 @@ class PesepayGateway(PaymentGateway):
             payment_data['signature'] = signature
             
             # Make API request
-            response = requests.post(
+            response = self.http.post(
                 f'{self.api_url}/api/v1/payments',
                 json=payment_data,
                 headers={
                     'Authorization': f'Bearer {self.api_key}',
                     'Content-Type': 'application/json',
-                },
-                timeout=30
+                }
             )
             
             if response.status_code in [200, 201]:
@@ -102,12 +100,11 @@ class PesepayGateway(PaymentGateway):
     def verify_payment(self, payment_reference: str) -> Dict:
         """Verify payment status"""
         try:
-            response = requests.get(
+            response = self.http.get(
                 f'{self.api_url}/api/v1/payments/{payment_reference}',
                 headers={
                     'Authorization': f'Bearer {self.api_key}',
-                },
-                timeout=30
+                }
             )
             
             if response.status_code == 200:
@@ -152,7 +149,8 @@ class PesepayGateway(PaymentGateway):
             if received_signature != calculated_signature:
                 return {
                     'success': False,
-                    'error': 'Signature verification failed'
+                    'error': 'Signature verification failed',
+                    'invalid_signature': True,
                 }
             
             payment_reference = request_data.get('reference', '')
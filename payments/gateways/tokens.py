@@ -0,0 +1,178 @@
+"""
+OAuth access-token cache for the payment gateways.
+
+Tokens are kept in process memory and, encrypted with a key derived from
+SECRET_KEY, in Django's cache, so workers share them, until shortly before
+they expire. Without the ``cryptography`` package they stay in process
+memory only. Once most of a token's lifetime has passed, the next caller
+still gets it but starts one background refresh. Only one thread per
+process, and (through a cache lock) only one process, fetches a token for a
+given key at a time; the others wait for that fetch instead of stampeding
+the token endpoint.
+"""
+import base64
+import hashlib
+import logging
+import threading
+import time
+import uuid
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+    CRYPTOGRAPHY_AVAILABLE = True
+except ImportError:
+    CRYPTOGRAPHY_AVAILABLE = False
+
+EXPIRY_SKEW = 30  # seconds (at most a tenth of the lifetime); treat tokens as expired this early
+REFRESH_AFTER = 0.8  # share of a token's lifetime after which it is refreshed in the background
+DEFAULT_EXPIRES_IN = 3600  # if the provider doesn't say
+LOCK_TIMEOUT = 30
+WAIT_TIMEOUT = 10  # longest a caller waits for another process's fetch before fetching itself
+
+logger = logging.getLogger('payments.gateways')
+
+
+@lru_cache(maxsize=4)
+def _fernet(secret_key):
+    key = hashlib.sha256(f'payments.gateways.tokens:{secret_key}'.encode()).digest()
+    return Fernet(base64.urlsafe_b64encode(key))
+
+
+class TokenCache:
+    """Process-wide cache of bearer tokens, keyed by e.g. gateway and client id"""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self._tokens = {}  # cache key -> (token, refresh_at, expires_at)
+        self._locks = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def _cache_key(self, key):
+        return f'{self.prefix}:{hashlib.sha256(key.encode()).hexdigest()[:32]}'
+
+    def _key_lock(self, cache_key):
+        with self._lock:
+            return self._locks.setdefault(cache_key, threading.Lock())
+
+    def _shared(self, cache_key):
+        """The entry in the shared cache, decrypted, or None"""
+        if not CRYPTOGRAPHY_AVAILABLE:
+            return None
+        shared = cache.get(cache_key)
+        if shared is None:
+            return None
+        try:
+            token = _fernet(settings.SECRET_KEY).decrypt(shared[0]).decode()
+        except InvalidToken:
+            return None  # e.g. written before SECRET_KEY was rotated
+        return (token,) + tuple(shared[1:])
+
+    def _share(self, cache_key, entry, timeout):
+        """Store an entry in the shared cache with the token encrypted"""
+        if CRYPTOGRAPHY_AVAILABLE:
+            encrypted = _fernet(settings.SECRET_KEY).encrypt(entry[0].encode())
+            cache.set(cache_key, (encrypted,) + tuple(entry[1:]), timeout)
+
+    def _lookup(self, cache_key):
+        """A usable cached entry from memory or the shared cache"""
+        now = time.time()
+        entry = self._tokens.get(cache_key)
+        if entry is None or entry[2] <= now:
+            entry = self._shared(cache_key)
+            if entry is None or entry[2] <= now:
+                return None
+            self._tokens[cache_key] = entry
+        return entry
+
+    def get(self, key, fetch):
+        """
+        The token for ``key``, fetching one if needed.
+
+        ``fetch`` returns ``(token, expires_in)``, or ``(None, None)`` if
+        the provider refused; in that case this returns None.
+        """
+        cache_key = self._cache_key(key)
+        entry = self._lookup(cache_key)
+        if entry is not None:
+            if entry[1] <= time.time():
+                self._refresh_in_background(cache_key, fetch)
+            return entry[0]
+
+        with self._key_lock(cache_key):
+            # Another thread may have fetched it while we waited
+            entry = self._lookup(cache_key)
+            if entry is not None:
+                return entry[0]
+            return self._fetch(cache_key, fetch, wait=True)
+
+    def invalidate(self, key, token):
+        """Drop ``token`` (e.g. after the provider rejected it) so the next call fetches a new one"""
+        cache_key = self._cache_key(key)
+        entry = self._tokens.get(cache_key)
+        if entry is not None and entry[0] == token:
+            self._tokens.pop(cache_key, None)
+        shared = self._shared(cache_key)
+        if shared is not None and shared[0] == token:
+            cache.delete(cache_key)
+
+    def _fetch(self, cache_key, fetch, wait):
+        """Fetch and store a token while holding the cross-process lock"""
+        lock_key = f'{cache_key}:lock'
+        owner = uuid.uuid4().hex
+        locked = cache.add(lock_key, owner, LOCK_TIMEOUT)
+        if not locked:
+            if not wait:
+                return None  # another process is already refreshing
+            deadline = time.monotonic() + WAIT_TIMEOUT
+            while time.monotonic() < deadline:
+                time.sleep(0.1)
+                entry = self._lookup(cache_key)
+                if entry is not None:
+                    return entry[0]
+                locked = cache.add(lock_key, owner, LOCK_TIMEOUT)
+                if locked:
+                    break
+            # Give up waiting and fetch anyway (without the lock); a lost lock must not block payments
+        try:
+            token, expires_in = fetch()
+            if not token:
+                return None
+            expires_in = float(expires_in or DEFAULT_EXPIRES_IN)
+            lifetime = expires_in - min(EXPIRY_SKEW, expires_in / 10)
+            now = time.time()
+            entry = (token, now + expires_in * REFRESH_AFTER, now + lifetime)
+            self._tokens[cache_key] = entry
+            self._share(cache_key, entry, max(int(lifetime), 1))
+            return token
+        finally:
+            # Only release our own lock - it may have expired and been taken by another process
+            if locked and cache.get(lock_key) == owner:
+                cache.delete(lock_key)
+
+    def _refresh_in_background(self, cache_key, fetch):
+        with self._lock:
+            if cache_key in self._refreshing:
+                return
+            self._refreshing.add(cache_key)
+
+        def refresh():
+            try:
+                with self._key_lock(cache_key):
+                    # Another process may have refreshed it already
+                    shared = self._shared(cache_key)
+                    if shared is not None and shared[1] > time.time():
+                        self._tokens[cache_key] = shared
+                    else:
+                        self._fetch(cache_key, fetch, wait=False)
+            except Exception as e:
+                logger.warning('%s token refresh failed: %s', self.prefix, e)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(cache_key)
+
+        threading.Thread(target=refresh, name=f'{self.prefix}-token-refresh', daemon=True).start()
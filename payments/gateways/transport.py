@@ -0,0 +1,216 @@
+"""
+HTTP transport shared by the payment gateways.
+
+Each gateway gets one process-wide transport holding a pooled keep-alive
+``requests.Session`` per API host, separate connect/read timeouts, retries
+with jittered exponential backoff (only where a repeat can't charge a
+customer twice) and a circuit breaker that fails fast while the provider is
+down. Every request is timed into ``payment_gateway_request_seconds`` on the
+``/metrics`` endpoint; slow and failed ones are also logged.
+"""
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+from notifications.metrics import Counter, Histogram
+
+CONNECT_TIMEOUT = 5  # seconds
+READ_TIMEOUT = 30
+RETRIES = 2
+BACKOFF = 0.5  # seconds before the first retry, doubled each time (full jitter)
+POOL_SIZE = 10
+BREAKER_THRESHOLD = 5  # consecutive failures that open the circuit
+BREAKER_RESET = 30  # seconds the circuit stays open before a trial request
+SLOW_SECONDS = 5
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+RETRY_STATUSES = frozenset([429, 502, 503, 504])
+
+logger = logging.getLogger('payments.gateways')
+
+REQUEST_SECONDS = Histogram(
+    'payment_gateway_request_seconds', 'Duration of one HTTP request to a payment gateway',
+    ('gateway', 'method', 'outcome'))
+CIRCUIT_REJECTIONS = Counter(
+    'payment_gateway_circuit_open_total', 'Requests refused because the gateway circuit was open', ('gateway',))
+
+
+class GatewayUnavailable(requests.RequestException):
+    """Raised instead of calling a gateway whose circuit is open"""
+
+
+class CircuitBreaker:
+    """
+    Opens after ``threshold`` consecutive failures and refuses calls for
+    ``reset_timeout`` seconds, then lets one trial call through: success
+    closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, reset_timeout=BREAKER_RESET):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+
+def _never_sent(error):
+    """True if the request failed before any of it reached the server"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError):
+        reason = getattr(error.args[0], 'reason', None) if error.args else None
+        return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+    return False
+
+
+class GatewayTransport:
+    """Pooled, retrying, circuit-broken HTTP client for one payment gateway"""
+
+    def __init__(self, gateway, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 retries=RETRIES, backoff=BACKOFF, breaker=None):
+        self.gateway = gateway
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def session_for(self, url):
+        """The keep-alive session for the URL's host"""
+        parsed = urlparse(url)
+        host = f'{parsed.scheme}://{parsed.netloc}'
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = self._sessions[host] = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+            return session
+
+    def request(self, method, url, idempotent=None, **kwargs):
+        """
+        Send a request and return the response.
+
+        Idempotent requests (GET etc., or ``idempotent=True``) are retried on
+        timeouts, connection errors and 429/502/503/504. Others are only
+        retried when the connection was never established, so a payment is
+        never submitted twice. Raises ``GatewayUnavailable`` while the
+        circuit is open.
+        """
+        method = method.upper()
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        kwargs.setdefault('timeout', self.timeout)
+        session = self.session_for(url)
+
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                CIRCUIT_REJECTIONS.inc(gateway=self.gateway)
+                raise GatewayUnavailable(f'{self.gateway} is unavailable (circuit open), try again shortly')
+
+            started = time.monotonic()
+            try:
+                response = session.request(method, url, **kwargs)
+            except requests.RequestException as e:
+                self._observe(method, url, started, e)
+                self.breaker.record_failure()
+                if attempt < self.retries and (idempotent or _never_sent(e)):
+                    attempt += 1
+                    self._sleep(attempt)
+                    continue
+                raise
+
+            failed = response.status_code >= 500
+            self._observe(method, url, started, f'HTTP {response.status_code}' if failed else None)
+            if failed:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            if idempotent and response.status_code in RETRY_STATUSES and attempt < self.retries:
+                attempt += 1
+                self._sleep(attempt)
+                continue
+            return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def _sleep(self, attempt):
+        time.sleep(random.uniform(0, self.backoff * 2 ** (attempt - 1)))
+
+    def _observe(self, method, url, started, error):
+        seconds = time.monotonic() - started
+        REQUEST_SECONDS.observe(seconds, gateway=self.gateway, method=method, outcome='error' if error else 'ok')
+        if error or seconds >= getattr(settings, 'PAYMENT_GATEWAY_SLOW_SECONDS', SLOW_SECONDS):
+            if isinstance(error, Exception):
+                error = f'{type(error).__name__}: {error}'
+            logger.warning('%s %s %s took %.3fs (%s)', self.gateway, method, urlparse(url).path, seconds,
+                           error or 'slow')
+
+
+_transports = {}
+_transports_lock = threading.Lock()
+
+
+def get_transport(gateway):
+    """The process-wide transport for a gateway, so pools and breakers outlive gateway instances"""
+    with _transports_lock:
+        transport = _transports.get(gateway)
+        if transport is None:
+            transport = _transports[gateway] = GatewayTransport(
+                gateway,
+                connect_timeout=getattr(settings, 'PAYMENT_GATEWAY_CONNECT_TIMEOUT', CONNECT_TIMEOUT),
+                read_timeout=getattr(settings, 'PAYMENT_GATEWAY_READ_TIMEOUT', READ_TIMEOUT),
+                retries=getattr(settings, 'PAYMENT_GATEWAY_RETRIES', RETRIES),
+                breaker=CircuitBreaker(
+                    threshold=getattr(settings, 'PAYMENT_GATEWAY_BREAKER_THRESHOLD', BREAKER_THRESHOLD),
+                    reset_timeout=getattr(settings, 'PAYMENT_GATEWAY_BREAKER_RESET', BREAKER_RESET),
+                ),
+            )
+        return transport
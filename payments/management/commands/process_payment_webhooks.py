@@ -0,0 +1,70 @@
+"""
+Management command that applies stored payment gateway webhooks in arrival order.
+"""
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from mjolobid.workers import Heartbeat
+from payments.webhooks import PROCESSOR_NAME, process_pending
+
+
+class Command(BaseCommand):
+    help = 'Apply payment gateway webhooks stored by the webhook views'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Events fetched per round trip (default: 100).',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=1.0,
+            help='Seconds to sleep when no events are due (default: 1).',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit once no events are due instead of polling.',
+        )
+
+    def handle(self, *args, **options):
+        # A single worker, so events are applied in the order they arrived
+        stopping = threading.Event()
+
+        def stop(signum, frame):
+            self.stdout.write('Stopping webhook processor after the current batch...')
+            stopping.set()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        self.stdout.write('Starting payment webhook processor')
+        heartbeat = Heartbeat(PROCESSOR_NAME)
+        try:
+            while not stopping.is_set():
+                heartbeat.beat()
+                close_old_connections()
+                try:
+                    applied, handled = process_pending(limit=options['batch_size'])
+                except Exception as e:
+                    # e.g. the database is briefly locked - try again next round
+                    self.stderr.write(f'Processing webhooks failed: {e}')
+                    stopping.wait(options['poll_interval'])
+                    continue
+                if handled:
+                    self.stdout.write(f'Applied {applied}/{handled} webhook events')
+                    continue
+                if options['once']:
+                    break
+                stopping.wait(options['poll_interval'])
+        finally:
+            heartbeat.stop()
+            connection.close()
+
+        self.stdout.write(self.style.SUCCESS('Webhook processor stopped'))
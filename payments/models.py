@@ -68,7 +68,7 @@ class Transaction(models.Model):
     related_bid = models.ForeignKey(Bid, on_delete=models.SET_NULL, null=True, blank=True, related_name='transactions')
     
     # Payment gateway details
-    gateway_transaction_id = models.CharField(max_length=200, blank=True)
+    gateway_transaction_id = models.CharField(max_length=200, blank=True, db_index=True)  # webhooks look transactions up by it
     gateway_response = models.JSONField(default=dict, blank=True)
     
     # Description and metadata
@@ -263,3 +263,44 @@ class WithdrawalRequest(models.Model):
     
     def __str__(self):
         return f"Withdrawal ${self.amount} - {self.user.username}"
+
+
+class WebhookEvent(models.Model):
+    """Payment gateway callback, stored on receipt and applied by process_payment_webhooks"""
+    
+    GATEWAY_CHOICES = [
+        ('ECOCASH', 'EcoCash'),
+        ('PAYNOW', 'Paynow'),
+        ('PESEPAY', 'Pesepay'),
+    ]
+    
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('PROCESSED', 'Processed'),
+        ('FAILED', 'Failed'),
+    ]
+    
+    gateway = models.CharField(max_length=20, choices=GATEWAY_CHOICES)
+    event_id = models.CharField(max_length=128)  # the gateway's event id, or a hash of the payload
+    payload = models.JSONField(default=dict)
+    
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['id']
+        constraints = [
+            # Gateways retry callbacks; the same event is only ever stored once
+            models.UniqueConstraint(fields=['gateway', 'event_id'], name='webhook_event_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='webhook_event_due_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.gateway} webhook {self.event_id[:12]} ({self.status})"
@@ -18,13 +18,17 @@ class PaymentService:
         'PESEPAY': PesepayGateway,
     }
     
+    _gateways = {}
+    
     @classmethod
     def get_gateway(cls, gateway_name: str):
-        """Get payment gateway instance"""
+        """Get payment gateway instance (configured from settings, so one per gateway is reused)"""
         gateway_class = cls.GATEWAY_MAP.get(gateway_name.upper())
         if not gateway_class:
             raise ValueError(f"Unsupported payment gateway: {gateway_name}")
-        return gateway_class()
+        if gateway_class not in cls._gateways:
+            cls._gateways[gateway_class] = gateway_class()
+        return cls._gateways[gateway_class]
     
     @classmethod
     def initiate_payment(cls, transaction: Transaction, gateway_name: str = 'ECOCASH',
@@ -125,7 +129,8 @@ class PaymentService:
                     if status == 'COMPLETED':
                         transaction.status = 'COMPLETED'
                         transaction.processed_at = timezone.now()
-                    elif status == 'FAILED':
+                    elif status == 'FAILED' and transaction.status != 'COMPLETED':
+                        # A late or retried failure callback must not undo a completed payment
                         transaction.status = 'FAILED'
                     
                     transaction.gateway_response = result.get('gateway_response', {})
@@ -134,8 +139,6 @@ class PaymentService:
                     # Trigger subscription activation if needed
                     if transaction.transaction_type == 'SUBSCRIPTION':
                         from .models import Subscription
-                        from django.utils import timezone
-                        from datetime import timedelta
                         
                         subscription = Subscription.objects.filter(
                             payment_transaction=transaction
@@ -150,6 +153,9 @@ class PaymentService:
                             user.subscription_active = True
                             user.subscription_expires = subscription.end_date
                             user.save()
+                            
+                            from notifications.scheduler import schedule_expiry_reminder
+                            schedule_expiry_reminder(user, 'subscription_expires')
                     
                     result['transaction'] = transaction
                     
@@ -10,6 +10,8 @@ import json
 from .models import PaymentMethod, Transaction, Wallet, EscrowTransaction, Subscription, WithdrawalRequest
 from .forms import PaymentMethodForm, WithdrawalRequestForm
 from .services import PaymentService
+from .webhooks import record_webhook
+from notifications.scheduler import schedule_expiry_reminder
 
 
 @login_required
@@ -103,6 +105,7 @@ def subscription(request):
         request.user.subscription_active = True
         request.user.subscription_expires = subscription.end_date
         request.user.save()
+        schedule_expiry_reminder(request.user, 'subscription_expires')
         
         messages.success(request, 'Subscription activated successfully!')
         return redirect('bids:browse_bids')
@@ -151,6 +154,7 @@ def premium_upgrade(request):
         request.user.is_premium = True
         request.user.premium_expires = subscription.end_date
         request.user.save()
+        schedule_expiry_reminder(request.user, 'premium_expires')
         
         messages.success(request, 'Premium upgrade successful!')
         return redirect('accounts:profile')
@@ -300,12 +304,9 @@ def ecocash_webhook(request):
     """Handle EcoCash webhook callback"""
     try:
         data = json.loads(request.body) if request.body else request.POST.dict()
-        result = PaymentService.handle_webhook('ECOCASH', data)
-        
-        if result.get('success'):
-            return HttpResponse('OK', status=200)
-        else:
-            return HttpResponse(result.get('error', 'Error'), status=400)
+        # Stored for process_payment_webhooks; repeats of an event are acknowledged and dropped
+        record_webhook('ECOCASH', data)
+        return HttpResponse('OK', status=200)
     except Exception as e:
         return HttpResponse(f'Error: {str(e)}', status=500)
 
@@ -317,12 +318,9 @@ def paynow_webhook(request):
     try:
         # Paynow sends data as form-encoded
         data = request.POST.dict()
-        result = PaymentService.handle_webhook('PAYNOW', data)
-        
-        if result.get('success'):
-            return HttpResponse('OK', status=200)
-        else:
-            return HttpResponse(result.get('error', 'Error'), status=400)
+        # Stored for process_payment_webhooks; repeats of an event are acknowledged and dropped
+        record_webhook('PAYNOW', data)
+        return HttpResponse('OK', status=200)
     except Exception as e:
         return HttpResponse(f'Error: {str(e)}', status=500)
 
@@ -333,12 +331,9 @@ def pesepay_webhook(request):
     """Handle Pesepay webhook callback"""
     try:
         data = json.loads(request.body) if request.body else request.POST.dict()
-        result = PaymentService.handle_webhook('PESEPAY', data)
-        
-        if result.get('success'):
-            return HttpResponse('OK', status=200)
-        else:
-            return HttpResponse(result.get('error', 'Error'), status=400)
+        # Stored for process_payment_webhooks; repeats of an event are acknowledged and dropped
+        record_webhook('PESEPAY', data)
+        return HttpResponse('OK', status=200)
     except Exception as e:
         return HttpResponse(f'Error: {str(e)}', status=500)
 
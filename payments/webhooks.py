@@ -0,0 +1,155 @@
+"""
+Webhook inbox for payment gateways.
+
+The webhook views only store the callback (``record_webhook``) and answer
+200, so gateways never time out waiting on us. The (gateway, event_id)
+unique key drops retried deliveries of the same event. ``manage.py
+process_payment_webhooks`` applies stored events in arrival order, per
+payment even across retries. Each event is marked processed in the same
+transaction that applies it, so no event is applied twice. Events that fail
+signature verification are marked failed at once rather than retried. While
+the processor isn't running on this host, the webhook view applies pending
+events itself right after storing one.
+"""
+import hashlib
+import json
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from mjolobid.workers import is_running
+
+from .models import WebhookEvent
+from .services import PaymentService
+
+MAX_ATTEMPTS = 8
+BACKOFF_BASE = 15  # seconds before the first retry, doubled each time
+BACKOFF_MAX = 3600
+PROCESSOR_NAME = 'payment_webhooks'  # heartbeat of process_payment_webhooks
+
+# Gateway -> payload field holding an id unique to each callback. EcoCash,
+# Paynow and Pesepay don't send one (their ids name the payment, which has
+# several callbacks), so their events are keyed by a hash of the payload.
+EVENT_ID_FIELDS = {}
+
+
+class WebhookError(Exception):
+    """Raised when an event couldn't be applied and should be retried"""
+
+
+class InvalidWebhook(WebhookError):
+    """Raised when an event failed signature verification; it is never retried"""
+
+
+def event_key(gateway_name, payload):
+    """The gateway's event id if it sends one, otherwise a hash of the payload"""
+    field = EVENT_ID_FIELDS.get(gateway_name)
+    if field and payload.get(field):
+        return str(payload[field])[:128]
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def record_webhook(gateway_name, payload):
+    """Store a callback unless it was already received. Returns True if it's new."""
+    _, created = WebhookEvent.objects.get_or_create(
+        gateway=gateway_name, event_id=event_key(gateway_name, payload), defaults={'payload': payload}
+    )
+    if created and not is_running(PROCESSOR_NAME):
+        transaction.on_commit(_process_inline)
+    return created
+
+
+def _process_inline():
+    # The event is stored either way; if this fails the processor (or the next callback) applies it
+    try:
+        process_pending()
+    except Exception:
+        pass
+
+
+def backoff_delay(attempts):
+    base = getattr(settings, 'PAYMENT_WEBHOOK_BACKOFF', BACKOFF_BASE)
+    return min(base * 2 ** (attempts - 1), BACKOFF_MAX) * random.uniform(0.8, 1.2)
+
+
+def apply_event(event):
+    """
+    Apply one stored event. Returns True if it was applied.
+
+    The claim, the transaction/subscription updates and the PROCESSED mark
+    commit together; on failure all of it is rolled back and the event is
+    retried later (e.g. a callback that arrived before its payment was saved),
+    unless it failed signature verification.
+    """
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            if not WebhookEvent.objects.filter(id=event.id, status='PENDING').update(
+                status='PROCESSED', processed_at=now, attempts=event.attempts + 1
+            ):
+                return False  # already handled elsewhere
+            result = PaymentService.handle_webhook(event.gateway, dict(event.payload))
+            if result.get('invalid_signature'):
+                raise InvalidWebhook(result.get('error', 'Signature verification failed'))
+            if not result.get('success') or result.get('error'):
+                raise WebhookError(result.get('error', 'Webhook handling failed'))
+    except Exception as e:
+        event.attempts += 1
+        event.last_error = f'{type(e).__name__}: {e}'[:2000]
+        max_attempts = getattr(settings, 'PAYMENT_WEBHOOK_MAX_ATTEMPTS', MAX_ATTEMPTS)
+        if isinstance(e, InvalidWebhook) or event.attempts >= max_attempts:
+            event.status = 'FAILED'
+        else:
+            event.run_after = now + timedelta(seconds=backoff_delay(event.attempts))
+        event.save(update_fields=['attempts', 'last_error', 'status', 'run_after'])
+        return False
+    return True
+
+
+def _payment_reference(event):
+    """The payment an event is about, parsed the way the gateway does (None if it can't be)"""
+    try:
+        return PaymentService.get_gateway(event.gateway).handle_webhook(dict(event.payload)).get('payment_reference')
+    except Exception:
+        return None
+
+
+def process_pending(limit=100):
+    """
+    Apply up to ``limit`` due events, oldest first. Returns (applied, handled).
+
+    An event waits while an earlier event for the same payment is still
+    pending, so a payment's callbacks are applied in the order they arrived
+    even when one of them has to be retried. Waiting events are paged past,
+    so however many pile up behind a retrying payment, newer events for
+    other payments are still applied.
+    """
+    now = timezone.now()
+    # (gateway, payment) -> id of its oldest event waiting for a retry
+    held = {}
+    for event in WebhookEvent.objects.filter(status='PENDING', run_after__gt=now).order_by('-id'):
+        held[(event.gateway, _payment_reference(event))] = event.id
+
+    due = WebhookEvent.objects.filter(status='PENDING', run_after__lte=now).order_by('id')
+    applied = handled = last_id = 0
+    while handled < limit:
+        events = list(due.filter(id__gt=last_id)[:limit])
+        if not events:
+            break
+        for event in events:
+            last_id = event.id
+            key = (event.gateway, _payment_reference(event))
+            if key[1] and held.get(key, event.id) < event.id:
+                continue
+            handled += 1
+            if apply_event(event):
+                applied += 1
+            else:
+                held[key] = min(held.get(key, event.id), event.id)
+            if handled >= limit:
+                break
+    return applied, handled
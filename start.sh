@@ -6,6 +6,7 @@ echo "🚀 Starting MjoloBid application..."
 # Run migrations
 echo "📦 Running database migrations..."
 python manage.py migrate --noinput
+python manage.py createcachetable
 
 # Collect static files
 echo "📁 Collecting static files..."
@@ -23,6 +24,9 @@ else:
     print('Superuser already exists')
 "
 
+# Start the background workers (notification deliveries, payment webhooks, scheduler)
+bash workers.sh
+
 # Start the application
 echo "🌟 Starting Gunicorn server..."
 exec gunicorn mjolobid.wsgi:application --bind 0.0.0.0:$PORT --workers 2 --timeout 120
@@ -48,6 +48,7 @@ def run_migrations():
     """Run database migrations"""
     try:
         subprocess.run(['python', 'manage.py', 'migrate', '--noinput'], check=True)
+        subprocess.run(['python', 'manage.py', 'createcachetable'], check=True)
         print("✅ Migrations completed successfully!")
     except subprocess.CalledProcessError as e:
         print(f"❌ Migration failed: {e}")
@@ -92,6 +93,14 @@ def seed_data():
         print(f"❌ Error during data seeding setup: {e}")
         print("⚠️  Continuing without data seeding...")
 
+def start_workers():
+    """Start the background workers (see workers.sh)"""
+    try:
+        subprocess.run(['bash', 'workers.sh'], check=True)
+    except subprocess.CalledProcessError as e:
+        print(f"❌ Starting workers failed: {e}")
+        print("⚠️  Web processes will do the workers' jobs inline...")
+
 def start_gunicorn():
     """Start Gunicorn server"""
     port = os.environ.get('PORT', '8000')
@@ -123,6 +132,9 @@ if __name__ == "__main__":
     print("🌱 Seeding database with dummy data...")
     seed_data()
     
+    # Start background workers
+    start_workers()
+    
     # Start server
     print("🌐 Starting Gunicorn server...")
     start_gunicorn()
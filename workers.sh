@@ -0,0 +1,16 @@
+#!/bin/bash
+# Background commands every entrypoint starts next to the web server
+# (deploy.sh, start.sh, Procfile). Until one is running, web processes on
+# the same host do its work inline, so a host without them still works.
+
+# Notification workers (email, web push, SMS deliveries)
+echo "📨 Starting notification workers..."
+python manage.py run_notification_workers ${NOTIFICATION_METRICS_PORT:+--metrics-port "$NOTIFICATION_METRICS_PORT"} &
+
+# Apply payment gateway webhooks stored by the webhook views
+echo "💳 Starting payment webhook processor..."
+python manage.py process_payment_webhooks &
+
+# Send time-based notifications (event reminders, premium expiry)
+echo "⏰ Starting notification scheduler..."
+python manage.py run_notification_scheduler &